@@ -0,0 +1,156 @@
+"""
+Device Alias Index for Bus Tracking API
+
+Maps every name a bus is known by — GPS VID, plate number, the
+"BusNo."-stripped form and the numeric ERP id — to its device id, so
+`/api/liveplate` resolves aliases with a dict lookup instead of scanning
+live state. The poller updates a device's aliases whenever its VID or
+plate changes; lookups that match several devices are reported as
+ambiguous rather than silently picking one.
+"""
+import re
+import threading
+from collections import defaultdict
+from typing import Any, Dict, List, Optional
+
+# Match strength of each alias form; lower wins when several devices share an alias
+EXACT, STRIPPED, ERP = 0, 1, 2
+
+
+def normalize_alias(value: Any) -> Optional[str]:
+    """Normalize a VID / plate / ERP id for lookups ("BusNo.26" -> "26", "Bus26" -> "bus26")."""
+    if value is None:
+        return None
+    alias = str(value).strip().lower()
+    if alias.startswith("busno."):
+        alias = alias[len("busno."):]
+    return alias or None
+
+
+def extract_erp_id(vid: str) -> Optional[str]:
+    """
+    Derive the ERP id from a GPS VID.
+
+    Args:
+        vid: Vehicle id reported by the device (e.g. "Bus26")
+
+    Returns:
+        Digits in the VID ("26"), the whole VID if it has none, or None if empty
+    """
+    if not vid:
+        return None
+    match = re.search(r'\d+', vid)
+    return match.group() if match else vid
+
+
+def alias_forms(value: Any) -> Dict[str, int]:
+    """Return every lookup form of a name with its match strength."""
+    if value is None or not str(value).strip():
+        return {}
+    raw = str(value).strip()
+    forms = {raw.lower(): EXACT}
+    stripped = normalize_alias(raw)
+    if stripped and stripped not in forms:
+        forms[stripped] = STRIPPED
+    erp_id = extract_erp_id(raw)
+    if erp_id and erp_id.lower() not in forms:
+        forms[erp_id.lower()] = ERP
+    return forms
+
+
+class AmbiguousAlias(Exception):
+    """Raised when an alias matches more than one device equally well."""
+
+    def __init__(self, alias: str, candidates: List[str]):
+        super().__init__(f"Alias '{alias}' matches {len(candidates)} devices")
+        self.alias = alias
+        self.candidates = candidates
+
+
+class AliasIndex:
+    """Thread-safe alias -> device id index."""
+
+    def __init__(self):
+        self._index: Dict[str, Dict[str, int]] = defaultdict(dict)  # alias -> device_id -> strength
+        self._names: Dict[str, tuple] = {}  # device_id -> names currently indexed
+        self._lock = threading.Lock()
+        self.updates = 0
+
+    def update(self, device_id: str, *names: Any) -> bool:
+        """
+        Replace a device's aliases with the forms of `names`.
+
+        Returns:
+            True if the index changed
+        """
+        names = tuple(str(name) for name in names if name is not None)
+        with self._lock:
+            if self._names.get(device_id) == names:
+                return False
+            self._drop(device_id)
+            forms: Dict[str, int] = {}
+            for name in names:
+                for alias, strength in alias_forms(name).items():
+                    forms[alias] = min(strength, forms.get(alias, strength))
+            for alias, strength in forms.items():
+                self._index[alias][device_id] = strength
+            self._names[device_id] = names
+            self.updates += 1
+            return True
+
+    def remove(self, device_id: str):
+        """Drop all aliases of a device."""
+        with self._lock:
+            self._drop(device_id)
+            self._names.pop(device_id, None)
+
+    def _drop(self, device_id: str):
+        for name in self._names.get(device_id, ()):
+            for alias in alias_forms(name):
+                devices = self._index.get(alias)
+                if devices is not None:
+                    devices.pop(device_id, None)
+                    if not devices:
+                        del self._index[alias]
+
+    def candidates(self, alias: Any) -> List[str]:
+        """Devices matching `alias` at the strongest available match level."""
+        key = str(alias).strip().lower() if alias is not None else ""
+        if not key:
+            return []
+        with self._lock:
+            devices = self._index.get(key)
+            if not devices:
+                devices = self._index.get(normalize_alias(key) or "")
+            if not devices:
+                return []
+            best = min(devices.values())
+            return sorted(dev for dev, strength in devices.items() if strength == best)
+
+    def resolve(self, alias: Any) -> Optional[str]:
+        """
+        Resolve an alias to a single device id.
+
+        Raises:
+            AmbiguousAlias: If several devices match equally well
+        """
+        found = self.candidates(alias)
+        if len(found) > 1:
+            raise AmbiguousAlias(str(alias), found)
+        return found[0] if found else None
+
+    def stats(self) -> Dict:
+        """Return index size and ambiguous alias count."""
+        with self._lock:
+            ambiguous = 0
+            for devices in self._index.values():
+                if len(devices) > 1:
+                    best = min(devices.values())
+                    if sum(1 for strength in devices.values() if strength == best) > 1:
+                        ambiguous += 1
+            return {
+                "devices": len(self._names),
+                "aliases": len(self._index),
+                "ambiguous_aliases": ambiguous,
+                "updates": self.updates,
+            }
@@ -10,20 +10,38 @@ import sys
 from datetime import datetime
 from fastapi import FastAPI, WebSocket, WebSocketDisconnect, Depends, HTTPException, status, Request
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi.exceptions import RequestValidationError
-from typing import Dict, Set
+from typing import Dict
 from pydantic import BaseModel
-from dotenv import load_dotenv
+from dotenv import dotenv_values, load_dotenv
 
 # Import authentication utilities
 from auth import (
     create_access_token,
     get_current_user,
     get_current_admin_user,
-    verify_password,
-    hash_password
+    hash_password,
+    token_cache,
+    password_verifier,
+    login_throttle,
+    login_client_address
 )
+from poller import ConcurrentPoller
+from scheduler import AdaptivePollScheduler
+from history import PositionHistory, to_points
+from telemetry_store import TelemetryStore
+from track_simplify import simplify
+from device_cache import TTLCache
+from fleet_session import FleetSessionManager, FleetSessionUnavailable
+from fleet_client import FleetApiClient, parse_device_status, parse_timeouts
+from snapshot import DeltaEncoder, SnapshotCache, StateSignal, VersionCounter
+from fanout import FanoutHub, Frames
+from subscriptions import SubscriptionIndex, parse_bbox
+from alias_index import AliasIndex, AmbiguousAlias
+from live_store import LiveStateStore
+from spatial_index import SpatialIndex
+from wire_format import CATALOG_HEADER, MEDIA_TYPE, WireEncoder, accepts_binary
 
 # Load environment variables from .env file
 load_dotenv()
@@ -60,9 +78,15 @@ logging.getLogger("urllib3").setLevel(logging.WARNING)
 USERNAME = os.getenv("FLEET_USERNAME")
 PASSWORD = os.getenv("FLEET_PASSWORD")
 
-# Parse device IDs from comma-separated string
-DEVICE_IDS = os.getenv("DEVICE_IDS", "").split(",")
-DEVICE_IDS = [dev_id.strip() for dev_id in DEVICE_IDS if dev_id.strip()]
+def parse_device_ids(value: str) -> list:
+    """Parse device IDs from a comma-separated string."""
+    return [dev_id.strip() for dev_id in (value or "").split(",") if dev_id.strip()]
+
+
+# Updated in place when the list is reloaded, so every holder sees the change
+DEVICE_IDS = parse_device_ids(os.getenv("DEVICE_IDS", ""))
+# Seconds between re-reads of DEVICE_IDS from .env (0 = only read at startup)
+DEVICE_IDS_RELOAD_INTERVAL = float(os.getenv("DEVICE_IDS_RELOAD_INTERVAL", "60"))
 
 BASE_URL = os.getenv("BASE_URL", "http://fleet.lagaam.in")
 API_HOST = os.getenv("API_HOST", "0.0.0.0")
@@ -74,6 +98,64 @@ ALLOWED_ORIGINS = [origin.strip() for origin in ALLOWED_ORIGINS if origin.strip(
 
 ENVIRONMENT = os.getenv("ENVIRONMENT", "development")
 
+# Fleet API session: refresh before the upstream expires it; result codes meaning "session expired"
+FLEET_SESSION_MAX_AGE = float(os.getenv("FLEET_SESSION_MAX_AGE", "3000"))
+FLEET_SESSION_EXPIRED_CODES = [
+    int(code) for code in os.getenv("FLEET_SESSION_EXPIRED_CODES", "7").split(",") if code.strip()
+]
+
+# Fleet API HTTP client: keep-alive pool size and per-action read timeouts (e.g. "getDeviceStatus=5,login=10")
+FLEET_POOL_SIZE = int(os.getenv("FLEET_POOL_SIZE", "32"))
+FLEET_TIMEOUT = float(os.getenv("FLEET_TIMEOUT", "10"))
+FLEET_TIMEOUTS = parse_timeouts(os.getenv("FLEET_TIMEOUTS", "getDeviceStatus=8"))
+
+# GPS poller tuning
+GPS_POLL_INTERVAL = float(os.getenv("GPS_POLL_INTERVAL", "5"))
+GPS_POLL_CONCURRENCY = int(os.getenv("GPS_POLL_CONCURRENCY", "16"))
+GPS_POLL_DEADLINE = float(os.getenv("GPS_POLL_DEADLINE", "8"))
+# Devices per getDeviceStatus call; 1 keeps one request per device
+GPS_BATCH_SIZE = int(os.getenv("GPS_BATCH_SIZE", "1"))
+# "fixed" polls every device each interval; "adaptive" schedules each device by motion/online state
+GPS_SCHEDULER = os.getenv("GPS_SCHEDULER", "fixed")
+# Poller processes for large fleets (0 = poll in-process); shards use fixed-interval polling
+GPS_SHARDS = int(os.getenv("GPS_SHARDS", "0"))
+GPS_MAX_RPS = float(os.getenv("GPS_MAX_RPS", "20"))
+GPS_MOVING_INTERVAL = float(os.getenv("GPS_MOVING_INTERVAL", "2"))
+GPS_PARKED_INTERVAL = float(os.getenv("GPS_PARKED_INTERVAL", "300"))
+GPS_OFFLINE_INTERVAL = float(os.getenv("GPS_OFFLINE_INTERVAL", "120"))
+
+# Recent fixes kept in memory per device for /api/history
+HISTORY_CAPACITY = int(os.getenv("HISTORY_CAPACITY", "2880"))
+
+# Seconds a simplified history response stays cached
+TRACK_CACHE_TTL = float(os.getenv("TRACK_CACHE_TTL", "30"))
+
+# Stop ETAs: meters from the route before a bus counts as off-route, upcoming stops sent per bus on /ws/live
+ETA_OFF_ROUTE_DISTANCE = float(os.getenv("ETA_OFF_ROUTE_DISTANCE", "300"))
+ETA_WS_STOPS = int(os.getenv("ETA_WS_STOPS", "3"))
+
+# Persistent append-only GPS log (one segment per UTC day)
+TELEMETRY_ENABLED = os.getenv("TELEMETRY_ENABLED", "true").lower() == "true"
+TELEMETRY_DIR = os.getenv("TELEMETRY_DIR", os.path.join(os.path.dirname(__file__), "data", "telemetry"))
+TELEMETRY_RETENTION_DAYS = int(os.getenv("TELEMETRY_RETENTION_DAYS", "30"))
+TELEMETRY_COMPACT_AFTER_DAYS = int(os.getenv("TELEMETRY_COMPACT_AFTER_DAYS", "7"))
+
+# Device info (getDeviceByVehicle) cache
+DEVICE_INFO_TTL = float(os.getenv("DEVICE_INFO_TTL", "600"))
+DEVICE_INFO_CACHE_SIZE = int(os.getenv("DEVICE_INFO_CACHE_SIZE", "2048"))
+
+# WebSocket fan-out
+WS_MAX_QUEUE = int(os.getenv("WS_MAX_QUEUE", "16"))
+WS_MAX_LAG_SECONDS = float(os.getenv("WS_MAX_LAG_SECONDS", "15"))
+WS_SEND_TIMEOUT = float(os.getenv("WS_SEND_TIMEOUT", "10"))
+BROADCAST_DEBOUNCE = float(os.getenv("BROADCAST_DEBOUNCE", "0.25"))
+BROADCAST_MAX_INTERVAL = float(os.getenv("BROADCAST_MAX_INTERVAL", "30"))
+
+# Multi-worker deployments: "elected" makes exactly one worker poll and publish fixes to the others
+CLUSTER_MODE = os.getenv("CLUSTER_MODE", "off").lower()
+CLUSTER_LOCK_FILE = os.getenv("CLUSTER_LOCK_FILE", os.path.join(os.path.dirname(__file__), "data", "poller.lock"))
+CLUSTER_SOCKET = os.getenv("CLUSTER_SOCKET", os.path.join(os.path.dirname(__file__), "data", "poller.sock"))
+
 # Validate required configuration
 if not USERNAME or not PASSWORD:
     raise ValueError("FLEET_USERNAME and FLEET_PASSWORD must be set in .env file")
@@ -111,7 +193,8 @@ async def http_exception_handler(request: Request, exc: HTTPException):
             "status_code": exc.status_code,
             "path": str(request.url.path),
             "timestamp": datetime.utcnow().isoformat()
-        }
+        },
+        headers=exc.headers,
     )
 
 @app.exception_handler(RequestValidationError)
@@ -189,38 +272,59 @@ class TokenResponse(BaseModel):
     token_type: str
     user: dict
 
-live_state: Dict = {
-    dev_id: {
-        "device_id": dev_id,
-        "online": False,
-        "latitude": 28.6139,   
-        "longitude": 77.2090,
-        "speed_kmh": 0.0,
-        "last_update": time.time(),
-        "plate_number": f"BUS-{i+1}"
-    } for i, dev_id in enumerate(DEVICE_IDS)
-}
+# Placeholder plates until each device reports its GPS VID
+initial_plates = {dev_id: f"BUS-{i+1}" for i, dev_id in enumerate(DEVICE_IDS)}
+
+# Latest fix per device in array-backed columns; readers take copy-on-write snapshots
+live_state = LiveStateStore(DEVICE_IDS, plates=initial_plates)
+
+# Grid index over the latest valid fixes, for nearby-bus queries
+spatial_index = SpatialIndex()
 
-websocket_clients: Set[WebSocket] = set()
-current_jsession = None
-jsession_lock = threading.Lock()
+# VID / plate / ERP id -> device id, kept current by the poller
+alias_index = AliasIndex()
+for _dev_id, _plate in initial_plates.items():
+    alias_index.update(_dev_id, _plate)
+
+# Bumped on every live_state change; snapshots are rebuilt only when it moves
+state_version = VersionCounter()
+# Wakes the broadcaster as soon as the poller commits new positions
+state_signal = StateSignal(state_version)
+
+# Ring buffer of recent fixes per device, appended by the poller
+position_history = PositionHistory(HISTORY_CAPACITY)
+
+# On-disk fix log for history older than the in-memory buffer
+telemetry_store = TelemetryStore(
+    TELEMETRY_DIR,
+    retention_days=TELEMETRY_RETENTION_DAYS,
+    compact_after_days=TELEMETRY_COMPACT_AFTER_DAYS,
+) if TELEMETRY_ENABLED else None
+
+delta_clients: Dict[WebSocket, int] = {}  # delta-protocol sockets -> last sequence number sent
+binary_clients: Dict[WebSocket, int] = {}  # binary-format sockets -> last catalog id sent
 start_time = time.time()  # Track server start time for uptime
 
 # ------------------ AUTH & HELPERS ------------------
 
+# Shared pooled client used for every Fleet API call
+fleet_client = FleetApiClient(
+    BASE_URL,
+    pool_size=FLEET_POOL_SIZE,
+    default_timeout=FLEET_TIMEOUT,
+    timeouts=FLEET_TIMEOUTS,
+)
+
+
 def get_jsession():
     """Authenticate and return new jsession token."""
-    global current_jsession
     try:
         logger.debug("Requesting new Fleet API session token...")
-        url = f"{BASE_URL}/StandardApiAction_login.action"
         params = {"account": USERNAME, "password": PASSWORD}
-        r = requests.get(url, params=params, verify=False, timeout=10)
-        data = r.json()
+        data = fleet_client.request("StandardApiAction_login.action", params, authenticated=False)
         if "jsession" in data:
             logger.info(f"✓ Fleet API authentication successful: {data['jsession'][:20]}...")
-            current_jsession = data["jsession"]
-            return current_jsession
+            return data["jsession"]
         else:
             logger.error(f"✗ Fleet API login failed: {data}")
             return None
@@ -229,21 +333,33 @@ def get_jsession():
         return None
 
 
+# Single owner of the jsession: proactive refresh, expiry detection, single-flight re-login
+fleet_session = FleetSessionManager(
+    get_jsession,
+    max_age=FLEET_SESSION_MAX_AGE,
+    expired_codes=FLEET_SESSION_EXPIRED_CODES,
+)
+fleet_client.session_manager = fleet_session
+
+
 def build_rtsp_url(device_id: str, channel: int, stream: int):
     """Construct RTSP streaming URL for a given device/channel/stream."""
-    global current_jsession
-    if not current_jsession:
-        current_jsession = get_jsession()
-        if not current_jsession:
-            return None
+    try:
+        jsession = fleet_session.get()
+    except FleetSessionUnavailable:
+        return None
     return (
         f"rtsp://fleet.lagaam.in:6604/3/3?"
-        f"AVType=1&jsession={current_jsession}&DevIDNO={device_id}&Channel={channel}&Stream={stream}"
+        f"AVType=1&jsession={jsession}&DevIDNO={device_id}&Channel={channel}&Stream={stream}"
     )
 
-import re
 import firebase_admin
 from firebase_admin import credentials, firestore
+from erp_sync import ErpSyncWorker
+from bus_index import BusIndex
+from route_eta import EtaEngine
+from cluster import ClusterNode
+from shard_pool import ShardedPoller
 
 # Initialize Firebase Admin
 try:
@@ -262,90 +378,36 @@ try:
 except Exception as e:
     logger.error(f"Failed to initialize Firebase Admin: {e}")
 
-def sync_erp_id(device_id: str, plate: str, vid: str):
-    """
-    Auto-Map ERP ID:
-    1. Extract digits from vid (e.g. "Bus26" -> "26").
-    2. Check Firestore for this bus.
-    3. If erpId is missing or different, update it.
-    """
-    try:
-        if not firebase_admin._apps: return
-        
-        # Extract ID (digits only from vid)
-        match = re.search(r'\d+', vid)
-        if not match:
-             # Fallback to whole vid if no digits
-             erp_id = vid
-        else:
-             erp_id = match.group()
-        
-        if not erp_id: return
-
-        db = firestore.client()
-        # The frontend stores public data in artifacts/{APP_ID}/public/data/buses
-        # We need APP_ID. Let's assume it matches the project structure or specific path.
-        # Actually, the path is `artifacts/{APP_ID}/public/data/buses`
-        # We need to find the correct collection.
-        # Let's search recursively or assume a standard path if we know APP_ID.
-        # Frontend uses config.app.id. We can try to guess or use a wild card query if possible?
-        # NO, Firestore Admin requires exact path.
-        # HACK: We will list collections in 'artifacts' to find the app id dynamically if needed, 
-        # or just use the one from env if we set it.
-        # Let's try the standard path from the deleted file logs:
-        # "artifacts/1:512166176631:web:736a1cfffc46b3e2b0a372/public/data/buses"
-        app_id_from_json = json.loads(os.getenv("FIREBASE_SERVICE_ACCOUNT_JSON", "{}")).get("client_id") 
-        # Wait, APP_ID is in .env.local as NEXT_PUBLIC_FIREBASE_APP_ID!
-        # But we didn't copy that to backend .env.
-        # Let's rely on querying the 'buses' collection if we can find it.
-        # Or better, just ask user to restart backend after I add APP_ID to .env?
-        # For now, let's look for the document with busId == device_id in ALL 'buses' collections? No.
-        
-        # We'll use a hardcoded path prefix based on the known App ID from previous steps or env.
-        # Re-reading .env.local: NEXT_PUBLIC_FIREBASE_APP_ID=1:512166176631:web:736a1cfffc46b3e2b0a372
-        app_id = "1:512166176631:web:736a1cfffc46b3e2b0a372" 
-        
-        buses_ref = db.collection(f"artifacts/{app_id}/public/data/buses")
-        
-        # Check if bus exists
-        docs = buses_ref.where("busId", "==", device_id).limit(1).get()
-        
-        if docs:
-            bus_doc = docs[0]
-            current_data = bus_doc.to_dict()
-            if current_data.get("erpId") != erp_id:
-                logger.info(f"🔄 Auto-Mapping: Updating {device_id} ({vid}) -> ERP ID: {erp_id}")
-                bus_doc.reference.update({"erpId": erp_id})
-        else:
-            # Create new bus document if missing
-            logger.info(f"🆕 Auto-Mapping: Creating new bus for {device_id} ({vid}) -> ERP ID: {erp_id}")
-            new_bus_ref = buses_ref.document()
-            new_bus_ref.set({
-                "busId": device_id,
-                "erpId": erp_id,
-                "plateNumber": erp_id,  # Use ERP ID (e.g. "26") as display name/plate
-                "device_type": "GPS_TRACKER",
-                "createdAt": firestore.SERVER_TIMESTAMP,
-                "model": "Generic Bus",
-                "capacity": "40"
-            })
+# The frontend stores public data in artifacts/{APP_ID}/public/data/buses
+FIREBASE_APP_ID = os.getenv("FIREBASE_APP_ID", "1:512166176631:web:736a1cfffc46b3e2b0a372")
+BUSES_COLLECTION = f"artifacts/{FIREBASE_APP_ID}/public/data/buses"
+ROUTES_COLLECTION = f"artifacts/{FIREBASE_APP_ID}/public/data/routes"
+ASSIGNMENTS_COLLECTION = f"artifacts/{FIREBASE_APP_ID}/public/data/busAssignments"
 
-    except Exception as e:
-        logger.error(f"Auto-Map Error: {e}")
+# Local mirror of the buses collection, kept current by a Firestore snapshot listener
+bus_index = BusIndex()
 
-def fetch_device_info(dev_id: str):
-    """Fetch plate (vid) and raw device info for a device from the fleet API."""
-    global current_jsession
+# Route progress and stop ETAs, fed by the poller; routes/assignments mirrored from Firestore
+eta_engine = EtaEngine(off_route_distance=ETA_OFF_ROUTE_DISTANCE)
+
+# Auto-Map ERP ID: one background worker, Firestore is only touched when a VID changes
+erp_sync = ErpSyncWorker(firestore.client, BUSES_COLLECTION, index=bus_index)
+
+# Device info published by the cluster leader, keyed by device id
+cluster_device_info: Dict[str, tuple] = {}
+
+
+def load_device_info(dev_id: str):
+    """
+    Fetch plate (vid) and raw device info for a device from the fleet API.
+
+    In cluster mode only the leader calls upstream and publishes what it
+    fetched; followers answer from the records the leader published.
+    """
+    if cluster_node is not None and not cluster_node.is_leader:
+        return cluster_device_info.get(dev_id, (None, None))
     try:
-        if not current_jsession:
-            current_jsession = get_jsession()
-            if not current_jsession:
-                logger.warning(f"Cannot fetch device info for {dev_id}: No valid session")
-                return None, None
-        url = f"{BASE_URL}/StandardApiAction_getDeviceByVehicle.action"
-        params = {"jsession": current_jsession, "devIdno": dev_id}
-        response = requests.get(url, params=params, verify=False, timeout=10)
-        data = response.json()
+        data = fleet_client.request("StandardApiAction_getDeviceByVehicle.action", {"devIdno": dev_id})
         if data.get("result") == 0 and data.get("devices"):
             device_data = data["devices"][0]
             plate = device_data.get("vid") or device_data.get("vehi_idno")
@@ -358,155 +420,509 @@ def fetch_device_info(dev_id: str):
             # -----------------
             
             logger.debug(f"Fetched device info for {dev_id}: plate={plate}")
+            if cluster_node is not None:
+                cluster_node.publish_device_info(dev_id, plate, device_data)
             return plate, device_data
         else:
             logger.warning(f"No device info found for {dev_id}: {data.get('result')}")
+    except FleetSessionUnavailable as e:
+        logger.warning(f"Cannot fetch device info for {dev_id}: {e}")
     except Exception as e:
         logger.error(f"Failed to fetch device info for {dev_id}: {e}")
     return None, None
 
 
+# Device metadata rarely changes; serve it from a TTL cache instead of calling upstream every time
+device_info_cache = TTLCache(
+    load_device_info,
+    ttl=DEVICE_INFO_TTL,
+    max_size=DEVICE_INFO_CACHE_SIZE,
+    is_valid=lambda value: value[1] is not None,
+    name="device-info",
+)
+
+
+def fetch_device_info(dev_id: str):
+    """Return (plate, device_info) for a device, served from the device info cache."""
+    return device_info_cache.get(dev_id) or (None, None)
+
+
+def receive_device_info(dev_id: str, plate: str | None, device_info: dict):
+    """Follower side of cluster mode: cache device info published by the leader."""
+    cluster_device_info[dev_id] = (plate, device_info)
+    device_info_cache.put(dev_id, (plate, device_info))
+
+
+def record_fix(dev_id: str, ts: float, lat: float, lng: float, speed: float, online: bool, gps_vid: str | None):
+    """Apply one valid GPS fix to live_state and every index derived from it."""
+    if dev_id not in live_state:
+        return
+    # GPS VID doubles as the plate number
+    if live_state.update(dev_id, lat, lng, speed, online, ts, gps_vid) and gps_vid:
+        alias_index.update(dev_id, gps_vid)
+    spatial_index.update(dev_id, lat, lng)
+    eta_engine.update(dev_id, lat, lng, speed, ts)
+    position_history.append(dev_id, ts, lat, lng, speed, online)
+    state_signal.publish()
+
+
+def apply_device_status(dev_id: str, device_status: dict) -> bool:
+    """Apply one getDeviceStatus `status[]` entry to live_state."""
+    lat, lng, speed, online, gps_vid = parse_device_status(device_status)
+
+    # --- AUTO-SYNC (Moved here to use GPS VID) ---
+    if gps_vid and firebase_admin._apps:
+        erp_sync.submit(dev_id, gps_vid)
+    # ---------------------------------------------
+
+    if lat != 0 and lng != 0:
+        commit_fix(dev_id, time.time(), lat, lng, speed, online, gps_vid)
+        logger.debug(f"Updated GPS for {dev_id}: lat={lat}, lng={lng}, vid={gps_vid}")
+        return True
+
+    logger.warning(f"Invalid coordinates for {dev_id}: lat={lat}, lng={lng}")
+    return False
+
+
+def commit_fix(dev_id: str, ts: float, lat: float, lng: float, speed: float, online: bool, gps_vid: str | None):
+    """Apply a fix polled by this process (or one of its shards), then persist and publish it."""
+    record_fix(dev_id, ts, lat, lng, speed, online, gps_vid)
+    if telemetry_store is not None:
+        telemetry_store.append(dev_id, ts, lat, lng, speed, online)
+    if cluster_node is not None:
+        cluster_node.publish([dev_id, ts, lat, lng, speed, online, gps_vid])
+
+
+def submit_erp_sync(dev_id: str, gps_vid: str):
+    """ERP auto-mapping hook for VIDs reported by poller shards."""
+    if firebase_admin._apps:
+        erp_sync.submit(dev_id, gps_vid)
+
+
+def request_device_status(dev_idno: str) -> dict:
+    """Call getDeviceStatus for one device or a comma-separated list of devices."""
+    params = {
+        "devIdno": dev_idno,
+        "toMap": 1,
+        "language": "en"
+    }
+    return fleet_client.request("StandardApiAction_getDeviceStatus.action", params)
+
+
+def update_device_gps(dev_id: str) -> bool:
+    """Fetch GPS status for a single device and apply it to live_state."""
+    try:
+        data = request_device_status(dev_id)
+
+        if data.get("result") == 0 and "status" in data and data["status"]:
+            return apply_device_status(dev_id, data["status"][0])
+        else:
+            logger.warning(f"No GPS status data for {dev_id}: result={data.get('result')}")
+
+    except FleetSessionUnavailable as e:
+        logger.error(f"Cannot fetch GPS data for {dev_id}: {e}")
+    except requests.exceptions.Timeout:
+        logger.error(f"GPS update timeout for {dev_id}")
+    except requests.exceptions.RequestException as e:
+        logger.error(f"GPS update network error for {dev_id}: {e}")
+    except Exception as e:
+        logger.exception(f"GPS update unexpected error for {dev_id}: {e}")
+    return False
+
+
+def update_device_batch(batch: str) -> int:
+    """
+    Fetch GPS status for a comma-separated batch of devices in one call.
+
+    The `status[]` entries are fanned back out to live_state by their `id`.
+    If the upstream rejects the batch, every device in it falls back to a
+    per-device call; devices simply missing from the response are retried
+    individually as well.
+
+    Returns:
+        Number of devices in the batch that were updated
+    """
+    dev_ids = batch.split(",")
+    try:
+        data = request_device_status(batch)
+    except Exception as e:
+        logger.warning(f"GPS batch request failed for {len(dev_ids)} device(s), falling back to per-device calls: {e}")
+        data = None
+
+    if not data or data.get("result") != 0 or not isinstance(data.get("status"), list):
+        if data is not None:
+            logger.warning(f"GPS batch rejected (result={data.get('result')}), falling back to per-device calls")
+        return sum(1 for dev_id in dev_ids if update_device_gps(dev_id))
+
+    statuses = {}
+    for device_status in data["status"]:
+        status_id = str(device_status.get("id") or "")
+        if status_id in live_state:
+            statuses[status_id] = device_status
+
+    updated = 0
+    for dev_id in dev_ids:
+        device_status = statuses.get(dev_id)
+        if device_status is None:
+            logger.debug(f"{dev_id} missing from batch response, retrying individually")
+            updated += bool(update_device_gps(dev_id))
+            continue
+        try:
+            updated += bool(apply_device_status(dev_id, device_status))
+        except Exception as e:
+            logger.exception(f"GPS update unexpected error for {dev_id}: {e}")
+    return updated
+
+
+def gps_poll_keys(device_ids: list = DEVICE_IDS) -> list:
+    """Poll keys for one cycle: device IDs, or comma-joined chunks in batch mode."""
+    if GPS_BATCH_SIZE <= 1:
+        return list(device_ids)  # a copy: DEVICE_IDS may be reloaded mid-cycle
+    return [
+        ",".join(device_ids[i:i + GPS_BATCH_SIZE])
+        for i in range(0, len(device_ids), GPS_BATCH_SIZE)
+    ]
+
+
+# CLUSTER_MODE=elected: the lock holder polls, the other workers apply its published fixes
+cluster_node = ClusterNode(
+    CLUSTER_LOCK_FILE,
+    CLUSTER_SOCKET,
+    on_fix=record_fix,
+    on_promote=lambda: start_polling(),
+    on_device_info=receive_device_info,
+) if CLUSTER_MODE == "elected" else None
+
+
+# Shared poller: one upstream call per device (or per batch), run concurrently with a cycle deadline
+gps_poller = ConcurrentPoller(
+    update_device_batch if GPS_BATCH_SIZE > 1 else update_device_gps,
+    max_workers=GPS_POLL_CONCURRENCY,
+    deadline=GPS_POLL_DEADLINE,
+)
+
+
 def fetch_gps_data():
     """Fetch GPS data for all buses."""
-    global current_jsession
-    if not current_jsession:
-        current_jsession = get_jsession()
-        if not current_jsession:
-            logger.error("Cannot fetch GPS data: No valid Fleet API session")
-            return
-
-    for dev_id in DEVICE_IDS:
-        url = f"{BASE_URL}/StandardApiAction_getDeviceStatus.action"
-        params = {
-            "jsession": current_jsession,
-            "devIdno": dev_id,
-            "toMap": 1,
-            "language": "en"
-        }
-        try:
-            response = requests.get(url, params=params, verify=False, timeout=10)
-            data = response.json()
-
-            if data.get("result") == 0 and "status" in data and data["status"]:
-                device_status = data["status"][0]
-                lng = float(device_status.get("mlng", 0))
-                lat = float(device_status.get("mlat", 0))
-                speed = float(device_status.get("sp", 0)) / 10.0
-                online = device_status.get("ol") == 1
-                gps_vid = device_status.get("vid")  # Extract VID from GPS status (e.g. "Bus26")
-
-                # --- AUTO-SYNC (Moved here to use GPS VID) ---
-                if gps_vid:
-                    threading.Thread(target=sync_erp_id, args=(dev_id, gps_vid, gps_vid)).start()
-                # ---------------------------------------------
-
-                if lat != 0 and lng != 0:
-                    live_state[dev_id].update({
-                        "online": online,
-                        "latitude": lat,
-                        "longitude": lng,
-                        "speed_kmh": speed,
-                        "last_update": time.time(),
-                        "vid": gps_vid,           # Store VID
-                        "plate_number": gps_vid   # Use GPS VID as plate number
-                    })
-                    logger.debug(f"Updated GPS for {dev_id}: lat={lat}, lng={lng}, vid={gps_vid}")
-                else:
-                    logger.warning(f"Invalid coordinates for {dev_id}: lat={lat}, lng={lng}")
+    try:
+        fleet_session.get()
+    except FleetSessionUnavailable as e:
+        logger.error(f"Cannot fetch GPS data: No valid Fleet API session ({e})")
+        return
+
+    gps_poller.poll(gps_poll_keys())
+
+
+# GPS_SHARDS > 0: devices split across poller processes by consistent hashing
+sharded_poller = ShardedPoller(
+    DEVICE_IDS,
+    GPS_SHARDS,
+    config={
+        "base_url": BASE_URL,
+        "pool_size": max(4, FLEET_POOL_SIZE // max(1, GPS_SHARDS)),
+        "default_timeout": FLEET_TIMEOUT,
+        "timeouts": FLEET_TIMEOUTS,
+        "expired_codes": list(FLEET_SESSION_EXPIRED_CODES),
+        "batch_size": GPS_BATCH_SIZE,
+        "interval": GPS_POLL_INTERVAL,
+        "concurrency": GPS_POLL_CONCURRENCY,
+        "deadline": GPS_POLL_DEADLINE,
+    },
+    on_fix=commit_fix,
+    on_vid=submit_erp_sync,
+    session=fleet_session,
+) if GPS_SHARDS > 0 else None
+
+
+# Per-device poll times for GPS_SCHEDULER=adaptive
+gps_scheduler = AdaptivePollScheduler(
+    DEVICE_IDS,
+    max_rps=GPS_MAX_RPS,
+    moving_interval=GPS_MOVING_INTERVAL,
+    idle_interval=GPS_POLL_INTERVAL,
+    parked_interval=GPS_PARKED_INTERVAL,
+    offline_interval=GPS_OFFLINE_INTERVAL,
+)
+
+
+def adaptive_gps_worker():
+    """
+    Poll each device when the adaptive scheduler says it is due.
+
+    Polls are dispatched to the shared poller without waiting, so a slow
+    device never delays the others. When a call finishes, the device is
+    rescheduled from its new fix, or retried at its current interval if the
+    call produced none.
+    """
+    logger.info("Starting adaptive GPS worker thread...")
+    request_cost = 1.0 / max(1, GPS_BATCH_SIZE)
+
+    def finished(key: str, seen: dict):
+        for dev_id in key.split(","):
+            state = live_state.get(dev_id)
+            if state is not None and state["last_update"] > seen.get(dev_id, 0):
+                gps_scheduler.observe(dev_id, state["latitude"], state["longitude"], state["speed_kmh"], state["online"])
             else:
-                logger.warning(f"No GPS status data for {dev_id}: result={data.get('result')}")
+                gps_scheduler.retry(dev_id)
 
-        except requests.exceptions.Timeout:
-            logger.error(f"GPS update timeout for {dev_id}")
-        except requests.exceptions.RequestException as e:
-            logger.error(f"GPS update network error for {dev_id}: {e}")
+    while True:
+        try:
+            due = gps_scheduler.due(cost=request_cost)
+            if due:
+                try:
+                    fleet_session.get()
+                except FleetSessionUnavailable as e:
+                    logger.error(f"Cannot fetch GPS data: No valid Fleet API session ({e})")
+                    for dev_id in due:
+                        gps_scheduler.retry(dev_id)
+                else:
+                    # Fix timestamps before the call, to tell fresh fixes from old ones
+                    seen = {dev_id: (live_state.get(dev_id) or {}).get("last_update", 0) for dev_id in due}
+                    # Bind this pass's baseline: a call may finish after the next pass rebinds `seen`
+                    skipped = gps_poller.dispatch(
+                        gps_poll_keys(due), lambda key, ok, seen=seen: finished(key, seen)
+                    )
+                    for key in skipped:
+                        finished(key, seen)
         except Exception as e:
-            logger.exception(f"GPS update unexpected error for {dev_id}: {e}")
+            logger.exception(f"Critical GPS worker error: {e}")
+        # Floor keeps the loop from spinning while the request budget refills
+        wait = gps_scheduler.seconds_until_next()
+        time.sleep(min(1.0, max(0.05, wait)) if wait is not None else 1.0)
 
 
 def gps_worker():
     """Continuously fetch GPS data in background."""
     logger.info("Starting GPS worker thread...")
     while True:
+        cycle_start = time.time()
         try:
             fetch_gps_data()
         except Exception as e:
             logger.exception(f"Critical GPS worker error: {e}")
-        time.sleep(5)
+        # Fixed-rate polling: the interval includes the time spent in the cycle
+        time.sleep(max(0.0, GPS_POLL_INTERVAL - (time.time() - cycle_start)))
+
+
+def apply_device_ids(device_ids: list):
+    """
+    Switch the fleet to `device_ids`: track added devices and drop removed ones.
+
+    Added devices get a placeholder plate and are polled right away; with
+    GPS_SHARDS the poller re-assigns only the shards whose devices changed.
+    """
+    wanted = set(device_ids)
+    added = [dev for dev in device_ids if dev not in live_state]
+    removed = [dev for dev in DEVICE_IDS if dev not in wanted]
+    if not added and not removed and device_ids == DEVICE_IDS:
+        return
+
+    for dev in removed:
+        live_state.remove(dev)
+        spatial_index.remove(dev)
+        alias_index.remove(dev)
+        eta_engine.remove(dev)
+        gps_scheduler.remove(dev)
+    for dev in added:
+        plate = f"BUS-{device_ids.index(dev) + 1}"
+        live_state.add(dev, plate)
+        alias_index.update(dev, plate)
+        gps_scheduler.add(dev)
+    DEVICE_IDS[:] = device_ids
+    if sharded_poller is not None:
+        sharded_poller.set_devices(DEVICE_IDS)
+    state_signal.publish()
+    logger.info(f"Device list reloaded: {len(DEVICE_IDS)} device(s), {len(added)} added, {len(removed)} removed")
+
+
+def device_ids_watcher():
+    """Re-read DEVICE_IDS from .env every DEVICE_IDS_RELOAD_INTERVAL seconds and apply changes."""
+    while True:
+        time.sleep(DEVICE_IDS_RELOAD_INTERVAL)
+        try:
+            device_ids = parse_device_ids(dotenv_values().get("DEVICE_IDS"))
+            if not device_ids:
+                continue  # a missing or empty entry never empties the fleet
+            apply_device_ids(device_ids)
+        except Exception as e:
+            logger.exception(f"Device list reload failed: {e}")
 
 # ------------------ BROADCASTING ------------------
 
+def build_fleet_payload() -> list:
+    """Build the fleet array shared by /ws/live and /api/liveplate_all."""
+    state = live_state.snapshot()
+    result = []
+    for dev in list(DEVICE_IDS):
+        gps_data = state.get(dev) or {}
+        plate, device_info = fetch_device_info(dev)
+        # Prefer GPS-derived plate ("Bus26") over "BusNo.6"
+        final_plate = gps_data.get("plate_number") or plate
+        entry = {
+            "gps": gps_data,
+            "plate_number": final_plate,
+            "device_info": device_info,
+            "device_id": dev,
+            "device_name": dev,
+        }
+        eta = eta_engine.for_bus(dev, limit=ETA_WS_STOPS)
+        if eta is not None:
+            entry["eta"] = eta
+        result.append(entry)
+    return result
+
+
+# Encoded once per state change and reused by every endpoint and socket
+fleet_snapshot = SnapshotCache(
+    build_fleet_payload,
+    lambda: (state_version.value, device_info_cache.generation, eta_engine.generation),
+)
+delta_encoder = DeltaEncoder()
+wire_encoder = WireEncoder()
+subscriptions = SubscriptionIndex()
+live_snapshot = SnapshotCache(
+    lambda: live_state.snapshot().to_dict(),
+    lambda: state_version.value,
+)
+
+
+def next_frame_for(websocket: WebSocket, snapshot) -> Frames | None:
+    """
+    Pick the frame to send a client for `snapshot`.
+
+    Legacy clients get the plain fleet array. Delta-mode clients get a delta
+    when they hold the previous sequence number, a full snapshot frame when
+    they are further behind, and nothing when they are already current.
+    Subscribed clients only see the devices matching their subscription.
+    Binary-format clients get the catalog whenever its id changes, then the
+    binary position frame.
+    """
+    subscribed = websocket in subscriptions
+    if websocket in binary_clients:
+        frame = wire_encoder.advance(snapshot)
+        frames = []
+        if binary_clients[websocket] != frame.catalog_id:
+            binary_clients[websocket] = frame.catalog_id
+            frames.append(frame.catalog_text)
+        if subscribed:
+            matched = subscriptions.match(snapshot).get(websocket, [])
+            frames.append(frame.select(entry["device_id"] for entry in matched))
+        else:
+            frames.append(frame.body)
+        return frames
+    if websocket not in delta_clients:
+        return subscriptions.encode(snapshot, websocket) if subscribed else snapshot.text
+    frame = delta_encoder.advance(snapshot)
+    last_seq = delta_clients[websocket]
+    if last_seq == frame.seq:
+        return None
+    delta_clients[websocket] = frame.seq
+    if frame.delta_text is not None and last_seq == frame.seq - 1:
+        return subscriptions.delta_frame(snapshot, websocket, frame) if subscribed else frame.delta_text
+    return subscriptions.full_frame(snapshot, websocket, frame.seq) if subscribed else frame.full_text
+
+
+def handle_client_message(websocket: WebSocket, request: dict) -> bool:
+    """
+    Apply a control message from a /ws/live client.
+
+    Returns:
+        True if the client should be sent a fresh full frame
+    """
+    message_type = request.get("type")
+    if message_type == "subscribe":
+        try:
+            bbox = parse_bbox(request.get("bbox"))
+        except (TypeError, ValueError) as e:
+            logger.warning(f"Ignoring invalid WebSocket subscription: {e}")
+            # Queued behind the client's frames; a client that cannot drain it is evicted
+            websocket_clients.send(websocket, json.dumps({"type": "error", "error": f"invalid subscription: {e}"}))
+            return False
+        aliases = list(request.get("vids") or []) + list(request.get("plates") or [])
+        subscriptions.subscribe(websocket, request.get("device_ids") or [], aliases, bbox)
+        return True
+    if message_type == "unsubscribe":
+        subscriptions.unsubscribe(websocket)
+        return True
+    return message_type == "resync" and (websocket in delta_clients or websocket in binary_clients)
+
+
+# Per-client outbound queues; frames are rendered by each client's writer task
+websocket_clients = FanoutHub(
+    next_frame_for,
+    max_queue=WS_MAX_QUEUE,
+    max_lag=WS_MAX_LAG_SECONDS,
+    send_timeout=WS_SEND_TIMEOUT,
+    on_remove=lambda websocket: (
+        delta_clients.pop(websocket, None),
+        binary_clients.pop(websocket, None),
+        subscriptions.unsubscribe(websocket),
+    ),
+)
+
+
 async def broadcast_update():
     """Broadcast live state updates to WebSocket clients."""
     if websocket_clients:
-        # Convert live_state dict to array format matching /api/liveplate_all
-        result = []
-        for dev in DEVICE_IDS:
-            gps_data = live_state.get(dev, {})
-            plate, device_info = fetch_device_info(dev)
-            final_plate = gps_data.get("plate_number") or plate
-            entry = {
-                "gps": gps_data,
-                "plate_number": final_plate,
-                "device_info": device_info,
-                "device_id": dev,
-                "device_name": dev,
-            }
-            result.append(entry)
-        
-        message = json.dumps(result)
-        disconnected_clients = []
-
-        for client in websocket_clients:
-            try:
-                await client.send_text(message)
-            except Exception:
-                disconnected_clients.append(client)
-
-        for client in disconnected_clients:
-            websocket_clients.remove(client)
+        # A rebuild may have to load device info from upstream; keep it off the event loop
+        websocket_clients.publish(await fleet_client.run(fleet_snapshot.get))
 
 # ------------------ WEBSOCKET ------------------
 
 @app.websocket("/ws/live")
 async def websocket_endpoint(websocket: WebSocket):
+    """
+    Live fleet updates.
+
+    By default every frame is the full fleet array. Connect with
+    `?protocol=delta` to receive `{"type": "snapshot", "seq", "data"}` first
+    and then `{"type": "delta", "seq", "changed", "removed"}` frames carrying
+    only changed fields; send `{"type": "resync"}` after a sequence gap to
+    get a fresh snapshot frame.
+
+    Connect with `?format=binary` for the compact encoding (see
+    `wire_format`): a JSON catalog text frame with the static fields, sent
+    again only when it changes, followed by binary position frames. Send
+    `{"type": "resync"}` to have the catalog resent.
+
+    Send `{"type": "subscribe", "device_ids": [...], "vids": [...],
+    "plates": [...], "bbox": [min_lat, min_lng, max_lat, max_lng]}` (any
+    subset) to receive only matching devices, and `{"type": "unsubscribe"}`
+    to go back to the whole fleet.
+    """
     await websocket.accept()
-    websocket_clients.add(websocket)
+    if websocket.query_params.get("format") == "binary":
+        binary_clients[websocket] = -1
+    elif websocket.query_params.get("protocol") == "delta":
+        delta_clients[websocket] = 0
+    # Initial data (array format matching /api/liveplate_all, or a snapshot frame)
+    # is delivered by the client's writer like any other broadcast
+    websocket_clients.register(websocket).publish(await fleet_client.run(fleet_snapshot.get))
     try:
-        # Send initial data in array format matching /api/liveplate_all
-        result = []
-        for dev in DEVICE_IDS:
-            gps_data = live_state.get(dev, {})
-            plate, device_info = fetch_device_info(dev)
-            final_plate = gps_data.get("plate_number") or plate
-            entry = {
-                "gps": gps_data,
-                "plate_number": final_plate,
-                "device_info": device_info,
-                "device_id": dev,
-                "device_name": dev,
-            }
-            result.append(entry)
-        # Safely send initial snapshot; handle clients that disconnect immediately
-        try:
-            await websocket.send_text(json.dumps(result))
-        except WebSocketDisconnect:
-            # Client disconnected before initial send completed
-            return
-        except Exception:
-            # Any other send error; stop handling this websocket
-            return
-        
         while True:
-            await asyncio.sleep(1)
             try:
-                _ = await websocket.receive_text()
+                raw = await websocket.receive_text()
             except WebSocketDisconnect:
                 break
             except Exception:
                 break
+
+            try:
+                request = json.loads(raw)
+            except ValueError:
+                continue
+            if isinstance(request, dict) and handle_client_message(websocket, request):
+                if websocket in delta_clients:
+                    # Forget the client's sequence so its next frame is a full snapshot
+                    delta_clients[websocket] = -1
+                if websocket in binary_clients:
+                    binary_clients[websocket] = -1
+                snapshot = await fleet_client.run(fleet_snapshot.get)
+                channel = websocket_clients.channels.get(websocket)
+                if channel is not None:
+                    channel.publish(snapshot)
     finally:
-        websocket_clients.discard(websocket)
+        websocket_clients.unregister(websocket)
 
 # ------------------ API ENDPOINTS ------------------
 
@@ -518,6 +934,10 @@ async def root():
             "login": "/auth/login",
             "live_data": "/api/live",
             "device_gps": "/api/gps/{device_id}",
+            "device_history": "/api/history/{device_id}?since=&until=&tolerance=&max_points=",
+            "nearby": "/api/nearby?lat=&lng=&k=",
+            "bus_eta": "/api/eta/{device_id}",
+            "stop_eta": "/api/eta/stop/{stop_id}",
             "video_stream": "/api/video/{device_id}/{channel}/{stream}"
         },
         "available_devices": DEVICE_IDS,
@@ -527,7 +947,7 @@ async def root():
 # ------------------ AUTHENTICATION ENDPOINTS ------------------
 
 @app.post("/auth/login", response_model=TokenResponse)
-async def login(credentials: LoginRequest):
+async def login(credentials: LoginRequest, request: Request):
     """
     Authenticate user and return JWT access token.
     
@@ -537,16 +957,35 @@ async def login(credentials: LoginRequest):
     - parent/parent123 (parent access)
     """
     logger.info(f"Login attempt for user: {credentials.username}")
+    client = login_client_address(request)
+    user_key = f"{client}:{credentials.username}"
+    client_key = f"{client}:*"
+
+    # Refuse repeated failures before spending any bcrypt work on them
+    retry_after = login_throttle.retry_after(user_key) or login_throttle.retry_after(
+        client_key, limit=4 * login_throttle.max_failures
+    )
+    if retry_after is not None:
+        logger.warning(f"Throttled login attempt for user: {credentials.username} from {client}")
+        raise HTTPException(
+            status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+            detail="Too many failed login attempts, please try again later",
+            headers={"Retry-After": str(max(1, int(retry_after)))},
+        )
+
     user = USERS_DB.get(credentials.username)
     
-    if not user or not verify_password(credentials.password, user["hashed_password"]):
+    if not user or not await password_verifier.verify(credentials.password, user["hashed_password"]):
         logger.warning(f"Failed login attempt for user: {credentials.username}")
+        login_throttle.failed(user_key)
+        login_throttle.failed(client_key)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    login_throttle.succeeded(user_key)
     logger.info(f"Successful login for user: {credentials.username} (role: {user['role']})")
     
     # Create access token with user info
@@ -583,7 +1022,7 @@ async def get_current_user_info(current_user: dict = Depends(get_current_user)):
 @app.get("/api/live")
 async def api_live(current_user: dict = Depends(get_current_user)):
     """Get live GPS data for all devices (requires authentication)."""
-    return JSONResponse(content=live_state)
+    return Response(content=live_snapshot.get().body, media_type="application/json")
 
 @app.get("/api/gps/{device_id}")
 async def api_gps_device(device_id: str, current_user: dict = Depends(get_current_user)):
@@ -593,7 +1032,185 @@ async def api_gps_device(device_id: str, current_user: dict = Depends(get_curren
             content={"error": "Device not found", "valid_ids": DEVICE_IDS},
             status_code=404
         )
-    return JSONResponse(content=live_state[device_id])
+    return JSONResponse(content=live_state.get(device_id))
+
+def load_history(device_id: str, since: float | None, until: float | None):
+    """
+    Read a device's fixes for a time range.
+
+    Ranges covered by the in-memory buffer are served from it; older ranges
+    are read from the on-disk telemetry log.
+
+    Returns:
+        (source, columns) where source is "memory" or "disk"
+    """
+    oldest = position_history.oldest(device_id)
+    if telemetry_store is not None and since is not None and (oldest is None or since < oldest):
+        return "disk", telemetry_store.query(device_id, since, until)
+    return "memory", position_history.query(device_id, since, until)
+
+
+def load_simplified_track(key: tuple):
+    """Cache loader: (device_id, since, until, tolerance, max_points) -> (source, original_count, columns)."""
+    device_id, since, until, tolerance, max_points = key
+    source, columns = load_history(device_id, since, until)
+    return source, len(columns["ts"]), simplify(columns, tolerance, max_points)
+
+
+# Simplified tracks for repeated admin-map queries
+track_cache = TTLCache(
+    load_simplified_track,
+    ttl=TRACK_CACHE_TTL,
+    max_size=256,
+    refresh_ahead=0,
+    name="track-simplify",
+)
+
+
+@app.get("/api/history/{device_id}")
+def api_history(
+    device_id: str,
+    since: float | None = None,
+    until: float | None = None,
+    tolerance: float | None = None,
+    max_points: int | None = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get positions for a device (requires authentication).
+
+    `since` / `until` are Unix timestamps in seconds; both are optional.
+    `tolerance` (meters) applies Douglas-Peucker simplification and
+    `max_points` downsamples by time buckets; simplified results are cached
+    when `until` is before the device's latest fix.
+    """
+    if device_id not in live_state:
+        return JSONResponse(
+            content={"error": "Device not found", "valid_ids": DEVICE_IDS},
+            status_code=404
+        )
+    if since is not None and until is not None and since > until:
+        return JSONResponse(
+            content={"error": "since must not be after until"},
+            status_code=400
+        )
+    if (tolerance is not None and tolerance < 0) or (max_points is not None and max_points < 2):
+        return JSONResponse(
+            content={"error": "tolerance must be >= 0 and max_points >= 2"},
+            status_code=400
+        )
+
+    # A range reaching the live tail keeps growing with new fixes; only closed ranges are cached
+    closed = until is not None and until < (live_state.get(device_id) or {}).get("last_update", 0)
+    if (tolerance or max_points) and closed:
+        source, original_count, columns = track_cache.get((device_id, since, until, tolerance, max_points))
+    elif tolerance or max_points:
+        source, original_count, columns = load_simplified_track((device_id, since, until, tolerance, max_points))
+    else:
+        source, columns = load_history(device_id, since, until)
+        original_count = len(columns["ts"])
+
+    points = to_points(columns)
+    return JSONResponse(content={
+        "device_id": device_id,
+        "source": source,
+        "since": since,
+        "until": until,
+        "original_count": original_count,
+        "count": len(points),
+        "points": points,
+    })
+
+MAX_NEARBY_RESULTS = 100
+MAX_NEARBY_RADIUS_M = 50000
+
+def nearby_response(matches: list) -> JSONResponse:
+    """Build the /api/nearby payload from `(device_id, distance_m)` pairs."""
+    state = live_state.snapshot()
+    buses = []
+    for dev_id, distance in matches:
+        gps_data = state.get(dev_id)
+        if gps_data is None:
+            continue
+        buses.append({
+            "device_id": dev_id,
+            "plate_number": gps_data["plate_number"],
+            "distance_m": round(distance, 1) if distance is not None else None,
+            "gps": gps_data,
+        })
+    return JSONResponse(content={"count": len(buses), "buses": buses})
+
+def invalid_point(lat: float, lng: float) -> JSONResponse | None:
+    if not (-90 <= lat <= 90 and -180 <= lng <= 180):
+        return JSONResponse(content={"error": "lat must be in [-90, 90] and lng in [-180, 180]"}, status_code=400)
+    return None
+
+@app.get("/api/nearby")
+def api_nearby(
+    lat: float,
+    lng: float,
+    k: int = 5,
+    max_distance: float | None = None,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the `k` buses nearest to a point, nearest first (requires authentication).
+
+    `max_distance` (meters) optionally ignores buses further away.
+    """
+    error = invalid_point(lat, lng)
+    if error is not None:
+        return error
+    if not 1 <= k <= MAX_NEARBY_RESULTS:
+        return JSONResponse(content={"error": f"k must be between 1 and {MAX_NEARBY_RESULTS}"}, status_code=400)
+    return nearby_response(spatial_index.nearest(lat, lng, k, max_radius_m=max_distance))
+
+@app.get("/api/nearby/radius")
+def api_nearby_radius(
+    lat: float,
+    lng: float,
+    radius: float,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the buses within `radius` meters of a point, nearest first (requires authentication)."""
+    error = invalid_point(lat, lng)
+    if error is not None:
+        return error
+    if not 0 < radius <= MAX_NEARBY_RADIUS_M:
+        return JSONResponse(content={"error": f"radius must be in (0, {MAX_NEARBY_RADIUS_M}] meters"}, status_code=400)
+    return nearby_response(spatial_index.within_radius(lat, lng, radius))
+
+@app.get("/api/nearby/bbox")
+def api_nearby_bbox(
+    min_lat: float,
+    min_lng: float,
+    max_lat: float,
+    max_lng: float,
+    current_user: dict = Depends(get_current_user)
+):
+    """Get the buses inside a bounding box (requires authentication)."""
+    try:
+        bbox = parse_bbox([min_lat, min_lng, max_lat, max_lng])
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
+    return nearby_response([(dev_id, None) for dev_id in spatial_index.within_bbox(*bbox)])
+
+@app.get("/api/eta/{device_id}")
+def api_eta(device_id: str, current_user: dict = Depends(get_current_user)):
+    """Get a bus's route progress and ETAs for its upcoming stops (requires authentication)."""
+    if device_id not in live_state:
+        return JSONResponse(
+            content={"error": "Device not found", "valid_ids": DEVICE_IDS},
+            status_code=404
+        )
+    eta = eta_engine.for_bus(device_id)
+    if eta is None:
+        return JSONResponse(content={"error": "No route assigned to this bus"}, status_code=404)
+    return JSONResponse(content={"device_id": device_id, **eta})
+
+@app.get("/api/eta/stop/{stop_id}")
+def api_stop_eta(stop_id: str, current_user: dict = Depends(get_current_user)):
+    """Get the buses heading to a stop with their ETAs, soonest first (requires authentication)."""
+    buses = eta_engine.for_stop(stop_id)
+    return JSONResponse(content={"stop_id": stop_id, "count": len(buses), "buses": buses})
 
 @app.get("/api/video/{device_id}/{channel}/{stream}")
 async def api_video_stream(
@@ -621,7 +1238,8 @@ async def api_video_stream(
             status_code=400
         )
 
-    rtsp_url = build_rtsp_url(device_id, channel, stream)
+    # Getting the session may log in upstream; keep it off the event loop
+    rtsp_url = await fleet_client.run(build_rtsp_url, device_id, channel, stream)
     if not rtsp_url:
         return JSONResponse(
             content={"error": "Failed to generate RTSP URL"},
@@ -641,16 +1259,16 @@ async def health_check():
     """Enhanced health check endpoint with system metrics."""
     try:
         # Count online devices
-        devices_online = sum(1 for dev in live_state.values() if dev["online"])
+        state = live_state.snapshot()
+        devices_online = state.online_count()
         
         # Calculate last update times
-        last_updates = [dev.get("last_update", 0) for dev in live_state.values()]
-        oldest_update = min(last_updates) if last_updates else 0
-        newest_update = max(last_updates) if last_updates else 0
+        oldest_update, newest_update = state.update_range()
         time_since_last_update = time.time() - newest_update if newest_update else 0
         
         # Check Fleet API session
-        has_session = current_jsession is not None
+        session_stats = fleet_session.stats()
+        has_session = session_stats["has_session"]
         
         # Overall health status
         is_healthy = (
@@ -665,7 +1283,9 @@ async def health_check():
             "uptime_seconds": time.time() - start_time,
             "fleet_api": {
                 "connected": has_session,
-                "session_valid": has_session
+                "session_valid": has_session,
+                "session": session_stats,
+                "client": fleet_client.stats()
             },
             "devices": {
                 "total": len(DEVICE_IDS),
@@ -679,8 +1299,35 @@ async def health_check():
                 "is_fresh": time_since_last_update < 30
             },
             "websocket": {
-                "active_connections": len(websocket_clients)
+                **websocket_clients.stats(),
+                "delta_connections": len(delta_clients),
+                "delta_seq": delta_encoder.seq,
+                "binary_connections": len(binary_clients),
+                "wire_format": wire_encoder.stats(),
+                "state_version": state_version.value,
+                "state_notifications": state_signal.notifications,
+                "subscriptions": subscriptions.stats()
             },
+            "poller": gps_poller.stats(),
+            "shards": sharded_poller.stats() if sharded_poller is not None else None,
+            "scheduler": gps_scheduler.stats() if GPS_SCHEDULER == "adaptive" else {"mode": GPS_SCHEDULER},
+            "device_info_cache": device_info_cache.stats(),
+            "snapshot": fleet_snapshot.stats(),
+            "erp_sync": erp_sync.stats(),
+            "live_state": live_state.stats(),
+            "bus_index": bus_index.stats(),
+            "alias_index": alias_index.stats(),
+            "spatial_index": spatial_index.stats(),
+            "eta": eta_engine.stats(),
+            "auth": {
+                "token_cache": token_cache.stats(),
+                "password_verifier": password_verifier.stats(),
+                "login_throttle": login_throttle.stats(),
+            },
+            "cluster": cluster_node.stats() if cluster_node is not None else {"role": "standalone"},
+            "history": position_history.stats(),
+            "telemetry": telemetry_store.stats() if telemetry_store is not None else None,
+            "track_cache": track_cache.stats(),
             "environment": ENVIRONMENT
         }
         
@@ -705,22 +1352,34 @@ def api_live_with_plate(device_id: str | None = None, current_user: dict = Depen
     if dev and dev in live_state:
         target_dev_id = dev
     else:
-        # 2. Try looking up by VID / Plate / ERP ID
+        # 2. Try the Firestore bus index (ERP ID / plate number), an in-memory lookup
         target_dev_id = None
-        for d_id, data in live_state.items():
-            # Check vid, plate_number, or even fuzzy match
-            if str(data.get("vid")) == str(dev) or \
-               str(data.get("plate_number")) == str(dev) or \
-               str(data.get("vid")).replace("BusNo.", "") == str(dev):
-                target_dev_id = d_id
-                break
+        try:
+            bus_id = bus_index.resolve_bus_id(dev)
+        except AmbiguousAlias as e:
+            return JSONResponse(
+                content={"error": "ambiguous device_id", "candidates": e.candidates},
+                status_code=409,
+            )
+        if bus_id in live_state:
+            target_dev_id = bus_id
+
+        # 3. Try the alias index (VID / plate / ERP id / "BusNo." forms)
+        if not target_dev_id:
+            try:
+                target_dev_id = alias_index.resolve(dev)
+            except AmbiguousAlias as e:
+                return JSONResponse(
+                    content={"error": "ambiguous device_id", "candidates": e.candidates},
+                    status_code=409,
+                )
     
     if not target_dev_id:
         return JSONResponse(content={"error": "unknown device_id"}, status_code=404)
         
     plate, device_info = fetch_device_info(target_dev_id)
     # Prefer GPS-derived plate ("Bus26") over "BusNo.6"
-    gps_data = live_state[target_dev_id]
+    gps_data = live_state.get(target_dev_id)
     final_plate = gps_data.get("plate_number") or plate
 
     return JSONResponse(content={
@@ -732,24 +1391,33 @@ def api_live_with_plate(device_id: str | None = None, current_user: dict = Depen
     })
 
 @app.get("/api/liveplate_all")
-def api_liveplate_all(current_user: dict = Depends(get_current_user)):
-    """Get live GPS data for all devices with plate numbers (requires authentication)."""
-    result = []
-    for dev in DEVICE_IDS:
-        gps_data = live_state.get(dev, {})
-        plate, device_info = fetch_device_info(dev)
-        # Prefer GPS-derived plate ("Bus26") over "BusNo.6"
-        final_plate = gps_data.get("plate_number") or plate
-        
-        entry = {
-            "gps": gps_data,
-            "plate_number": final_plate,
-            "device_info": device_info,
-            "device_id": dev,
-            "device_name": dev,
-        }
-        result.append(entry)
-    return JSONResponse(content=result)
+def api_liveplate_all(request: Request, current_user: dict = Depends(get_current_user)):
+    """
+    Get live GPS data for all devices with plate numbers (requires authentication).
+
+    With `Accept: application/vnd.bustrack.fleet+binary` the response is a
+    binary position frame; its `X-Fleet-Catalog` header names the catalog
+    (from `/api/liveplate_all/catalog`) that its record indexes refer to.
+    """
+    snapshot = fleet_snapshot.get()
+    if accepts_binary(request.headers.get("accept")):
+        frame = wire_encoder.advance(snapshot)
+        return Response(
+            content=frame.body,
+            media_type=MEDIA_TYPE,
+            headers={CATALOG_HEADER: str(frame.catalog_id), "Vary": "Accept"},
+        )
+    return Response(content=snapshot.body, media_type="application/json", headers={"Vary": "Accept"})
+
+@app.get("/api/liveplate_all/catalog")
+def api_liveplate_all_catalog(current_user: dict = Depends(get_current_user)):
+    """Static per-device fields for decoding binary fleet frames (requires authentication)."""
+    frame = wire_encoder.advance(fleet_snapshot.get())
+    return Response(
+        content=frame.catalog_text,
+        media_type="application/json",
+        headers={CATALOG_HEADER: str(frame.catalog_id)},
+    )
 
 # ------------------ STARTUP ------------------
 
@@ -764,10 +1432,31 @@ async def startup_event():
     logger.info(f"API running on: http://{API_HOST}:{API_PORT}")
     logger.info("=" * 60)
     
-    # Start GPS worker thread
-    logger.info("Starting GPS worker thread...")
-    gps_thread = threading.Thread(target=gps_worker, daemon=True)
-    gps_thread.start()
+    # Let the poller thread wake the broadcaster on this event loop
+    state_signal.bind(asyncio.get_running_loop())
+
+    # Start Firestore listeners (read-only, every worker keeps its own mirror)
+    if firebase_admin._apps:
+        try:
+            bus_index.start(firestore.client().collection(BUSES_COLLECTION))
+        except Exception as e:
+            logger.error(f"Failed to start bus index listener: {e}")
+        try:
+            db = firestore.client()
+            eta_engine.start(db.collection(ROUTES_COLLECTION), db.collection(ASSIGNMENTS_COLLECTION))
+        except Exception as e:
+            logger.error(f"Failed to start ETA engine listeners: {e}")
+
+    # Every worker follows .env changes to the device list
+    if DEVICE_IDS_RELOAD_INTERVAL > 0:
+        threading.Thread(target=device_ids_watcher, daemon=True, name="device-ids-watcher").start()
+
+    # Poll here, or only if this worker wins the poller election
+    if cluster_node is not None:
+        logger.info(f"Cluster mode: electing GPS poller via {CLUSTER_LOCK_FILE}")
+        cluster_node.start()
+    else:
+        start_polling()
 
     # Start WebSocket broadcast task
     logger.info("Starting WebSocket broadcast task...")
@@ -775,15 +1464,54 @@ async def startup_event():
     
     logger.info("✓ All services started successfully")
 
+def start_polling():
+    """Start the services owned by the polling worker: GPS worker, ERP sync and telemetry writer."""
+    if sharded_poller is not None:
+        sharded_poller.start()
+    else:
+        logger.info("Starting GPS worker thread...")
+        worker = adaptive_gps_worker if GPS_SCHEDULER == "adaptive" else gps_worker
+        gps_thread = threading.Thread(target=worker, daemon=True)
+        gps_thread.start()
+
+    # ERP auto-mapping writes to Firestore, so only the poller runs it
+    if firebase_admin._apps:
+        erp_sync.start()
+
+    # Start telemetry log writer
+    if telemetry_store is not None:
+        telemetry_store.start()
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release pooled upstream connections and flush buffered telemetry."""
+    gps_poller.shutdown()
+    if sharded_poller is not None:
+        sharded_poller.shutdown()
+    fleet_client.close()
+    if telemetry_store is not None:
+        telemetry_store.flush()
+
 async def periodic_broadcast():
-    """Broadcast GPS updates to WebSocket clients every 5 seconds."""
+    """
+    Broadcast GPS updates to WebSocket clients whenever live state changes.
+
+    Wakes on the poller's state signal, waits BROADCAST_DEBOUNCE seconds so
+    updates landing in the same poll cycle go out together, and still
+    broadcasts every BROADCAST_MAX_INTERVAL seconds when nothing changes.
+    """
     logger.info("WebSocket broadcast task started")
+    seen_version = state_version.value
     while True:
         try:
-            await asyncio.sleep(5)
+            changed = await state_signal.wait(seen_version, timeout=BROADCAST_MAX_INTERVAL)
+            if changed and BROADCAST_DEBOUNCE > 0:
+                await asyncio.sleep(BROADCAST_DEBOUNCE)
+            seen_version = state_version.value
             await broadcast_update()
         except Exception as e:
             logger.exception(f"Error in periodic broadcast: {e}")
+            await asyncio.sleep(1)
 
 # ------------------ MAIN ------------------
 
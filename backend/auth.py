@@ -1,12 +1,18 @@
 """
 JWT Authentication Module for Bus Tracking API
 """
+import asyncio
+import hashlib
 import os
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 from jose import JWTError, jwt
 import bcrypt
-from fastapi import Depends, HTTPException, status
+from fastapi import Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from dotenv import load_dotenv
 
@@ -16,6 +22,18 @@ load_dotenv()
 SECRET_KEY = os.getenv("JWT_SECRET_KEY")
 ALGORITHM = os.getenv("JWT_ALGORITHM", "HS256")
 ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("JWT_ACCESS_TOKEN_EXPIRE_MINUTES", "30"))
+# Verified tokens remembered until their `exp` (0 disables the cache)
+TOKEN_CACHE_SIZE = int(os.getenv("JWT_CACHE_SIZE", "4096"))
+
+# Password hashing runs off the event loop on a small dedicated pool
+BCRYPT_WORKERS = int(os.getenv("BCRYPT_WORKERS", "2"))
+BCRYPT_MAX_PENDING = int(os.getenv("BCRYPT_MAX_PENDING", "32"))
+# Failed logins per client+username (and 4x that per client) before attempts are refused
+LOGIN_MAX_FAILURES = int(os.getenv("LOGIN_MAX_FAILURES", "5"))
+LOGIN_FAILURE_WINDOW = float(os.getenv("LOGIN_FAILURE_WINDOW", "300"))
+# Header a trusted reverse proxy sets to the real client address (e.g. X-Real-IP);
+# empty means throttle on the socket peer address
+LOGIN_CLIENT_IP_HEADER = os.getenv("LOGIN_CLIENT_IP_HEADER", "").strip()
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
@@ -47,9 +65,94 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     return encoded_jwt
 
 
+class VerifiedTokenCache:
+    """
+    Bounded LRU of already-verified token payloads.
+
+    Keys are SHA-256 digests of the token, so raw bearer tokens are not kept
+    in memory. An entry is only served until the token's own `exp`, after
+    which the token is decoded (and rejected) as usual. Tokens without an
+    `exp` claim are never cached.
+    """
+
+    def __init__(self, max_size: int = 4096):
+        self.max_size = max_size
+        self._entries: "OrderedDict[bytes, Tuple[float, dict]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.evictions = 0
+        self.decodes = 0
+        self.decode_seconds = 0.0
+
+    @staticmethod
+    def key(token: str) -> bytes:
+        return hashlib.sha256(token.encode("utf-8")).digest()
+
+    def get(self, key: bytes) -> Optional[dict]:
+        """Cached payload for a token digest, or None on a miss / expired entry."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            if time.time() >= entry[0]:
+                del self._entries[key]
+                self.expired += 1
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: bytes, payload: dict):
+        """Remember a verified payload until its `exp`."""
+        exp = payload.get("exp")
+        if self.max_size <= 0 or not isinstance(exp, (int, float)):
+            return
+        with self._lock:
+            self._entries[key] = (float(exp), payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def record_decode(self, seconds: float):
+        with self._lock:
+            self.decodes += 1
+            self.decode_seconds += seconds
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self) -> Dict:
+        """Return size, hit rate and average decode cost."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "expired": self.expired,
+                "evictions": self.evictions,
+                "decodes": self.decodes,
+                "avg_decode_us": round(self.decode_seconds / self.decodes * 1e6, 1) if self.decodes else None,
+            }
+
+
+token_cache = VerifiedTokenCache(TOKEN_CACHE_SIZE)
+
+
 def verify_token(token: str) -> dict:
     """
     Verify and decode a JWT token.
+
+    Tokens verified before are served from `token_cache` until they expire,
+    skipping the signature check and JSON parse.
     
     Args:
         token: JWT token string
@@ -60,15 +163,23 @@ def verify_token(token: str) -> dict:
     Raises:
         HTTPException: If token is invalid or expired
     """
+    key = token_cache.key(token)
+    payload = token_cache.get(key)
+    if payload is not None:
+        return dict(payload)
+    started = time.perf_counter()
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
-        return payload
+        token_cache.put(key, payload)
+        return dict(payload)
     except JWTError as e:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=f"Could not validate credentials: {str(e)}",
             headers={"WWW-Authenticate": "Bearer"},
         )
+    finally:
+        token_cache.record_decode(time.perf_counter() - started)
 
 
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> dict:
@@ -153,3 +264,153 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     except Exception as e:
         print(f"Password verification error: {e}")
         return False
+
+
+class PasswordVerifier:
+    """
+    Runs bcrypt checks on a bounded thread pool instead of the event loop.
+
+    At most `max_pending` checks may be queued or running; further logins
+    are refused immediately rather than piling up behind a burst.
+    """
+
+    def __init__(self, workers: int = 2, max_pending: int = 32):
+        self.workers = max(1, workers)
+        self.max_pending = max(1, max_pending)
+        self._executor = ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="bcrypt")
+        self._lock = threading.Lock()
+        self.pending = 0
+        self.calls = 0
+        self.rejected = 0
+        self.queue_seconds = 0.0
+        self.max_queue_seconds = 0.0
+        self.hash_seconds = 0.0
+
+    def _check(self, submitted: float, plain_password: str, hashed_password: str) -> bool:
+        started = time.perf_counter()
+        try:
+            return verify_password(plain_password, hashed_password)
+        finally:
+            queued = started - submitted
+            with self._lock:
+                self.calls += 1
+                self.queue_seconds += queued
+                self.max_queue_seconds = max(self.max_queue_seconds, queued)
+                self.hash_seconds += time.perf_counter() - started
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        """
+        Verify a password on the bcrypt pool.
+
+        Raises:
+            HTTPException: 503 if too many checks are already pending
+        """
+        with self._lock:
+            if self.pending >= self.max_pending:
+                self.rejected += 1
+                raise HTTPException(
+                    status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                    detail="Too many login attempts in progress, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._check, time.perf_counter(), plain_password, hashed_password
+            )
+        finally:
+            with self._lock:
+                self.pending -= 1
+
+    def stats(self) -> Dict:
+        """Return pool size, backlog and queue/hash timings."""
+        with self._lock:
+            return {
+                "workers": self.workers,
+                "max_pending": self.max_pending,
+                "pending": self.pending,
+                "calls": self.calls,
+                "rejected": self.rejected,
+                "avg_queue_ms": round(self.queue_seconds / self.calls * 1000, 1) if self.calls else None,
+                "max_queue_ms": round(self.max_queue_seconds * 1000, 1),
+                "avg_hash_ms": round(self.hash_seconds / self.calls * 1000, 1) if self.calls else None,
+            }
+
+
+class FailedLoginThrottle:
+    """
+    Counts failed logins per key in a sliding window.
+
+    Keys over the limit are refused before any password hashing happens.
+    """
+
+    def __init__(self, max_failures: int = 5, window: float = 300.0, max_keys: int = 10000):
+        self.max_failures = max_failures
+        self.window = window
+        self.max_keys = max_keys
+        self._failures: "OrderedDict[str, list]" = OrderedDict()  # least recently failed first
+        self._lock = threading.Lock()
+        self.blocked = 0
+        self.evictions = 0
+
+    def retry_after(self, key: str, limit: Optional[int] = None) -> Optional[float]:
+        """Seconds until `key` may try again, or None if it is not throttled."""
+        limit = limit or self.max_failures
+        now = time.time()
+        with self._lock:
+            times = self._failures.get(key)
+            if not times:
+                return None
+            times[:] = [t for t in times if now - t < self.window]
+            if len(times) < limit:
+                return None
+            self.blocked += 1
+            return times[-limit] + self.window - now
+
+    def failed(self, key: str):
+        now = time.time()
+        with self._lock:
+            if key not in self._failures and len(self._failures) >= self.max_keys:
+                # Drop keys whose failures have all aged out, then the least recently failed
+                for stale in [k for k, times in self._failures.items() if not times or now - times[-1] >= self.window]:
+                    del self._failures[stale]
+                while len(self._failures) >= self.max_keys:
+                    self._failures.popitem(last=False)
+                    self.evictions += 1
+            self._failures.setdefault(key, []).append(now)
+            self._failures.move_to_end(key)
+
+    def succeeded(self, key: str):
+        with self._lock:
+            self._failures.pop(key, None)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                "tracked_keys": len(self._failures),
+                "blocked": self.blocked,
+                "evictions": self.evictions,
+                "max_failures": self.max_failures,
+                "window_seconds": self.window,
+            }
+
+
+def login_client_address(request: Request) -> str:
+    """
+    Address failed logins are counted against.
+
+    Behind a reverse proxy every request comes from the proxy itself, so the
+    address is read from `LOGIN_CLIENT_IP_HEADER` when configured. Only the
+    last hop of a comma-separated list is used: that is the one appended by
+    the proxy, the rest are client-supplied.
+    """
+    if LOGIN_CLIENT_IP_HEADER:
+        forwarded = request.headers.get(LOGIN_CLIENT_IP_HEADER)
+        if forwarded:
+            return forwarded.rsplit(",", 1)[-1].strip()
+    return request.client.host if request.client else "unknown"
+
+
+password_verifier = PasswordVerifier(BCRYPT_WORKERS, BCRYPT_MAX_PENDING)
+login_throttle = FailedLoginThrottle(LOGIN_MAX_FAILURES, LOGIN_FAILURE_WINDOW)
@@ -0,0 +1,86 @@
+"""
+Spatial Index Benchmark for Bus Tracking API
+
+Compares SpatialIndex queries against a linear scan over all positions for
+growing fleet sizes, and checks that both return the same buses.
+
+Usage:
+    python bench_spatial_index.py [--sizes 1000,10000,50000] [--queries 500]
+"""
+import argparse
+import random
+import time
+
+from spatial_index import SpatialIndex, haversine_m
+
+# Fleet spread over a ~50 km square around Delhi
+CENTER = (28.6139, 77.2090)
+SPREAD = 0.25
+
+
+def linear_nearest(positions, lat, lng, k):
+    distances = sorted((haversine_m(lat, lng, p_lat, p_lng), dev) for dev, (p_lat, p_lng) in positions.items())
+    return [dev for _, dev in distances[:k]]
+
+
+def linear_radius(positions, lat, lng, radius_m):
+    return {dev for dev, (p_lat, p_lng) in positions.items() if haversine_m(lat, lng, p_lat, p_lng) <= radius_m}
+
+
+def timed(func, queries):
+    start = time.perf_counter()
+    results = [func(lat, lng) for lat, lng in queries]
+    return (time.perf_counter() - start) / len(queries) * 1000, results
+
+
+def run(size: int, query_count: int, k: int, radius_m: float):
+    rng = random.Random(size)
+    positions = {
+        f"dev{i}": (CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+        for i in range(size)
+    }
+    index = SpatialIndex()
+    start = time.perf_counter()
+    for dev, (lat, lng) in positions.items():
+        index.update(dev, lat, lng)
+    build_ms = (time.perf_counter() - start) * 1000
+
+    queries = [
+        (CENTER[0] + rng.uniform(-SPREAD, SPREAD), CENTER[1] + rng.uniform(-SPREAD, SPREAD))
+        for _ in range(query_count)
+    ]
+    # Linear scans are slow at large sizes; time them on a subset
+    linear_queries = queries[:max(1, min(query_count, 200_000 // size))]
+
+    index_knn_ms, knn = timed(lambda lat, lng: [dev for dev, _ in index.nearest(lat, lng, k)], queries)
+    linear_knn_ms, knn_expected = timed(lambda lat, lng: linear_nearest(positions, lat, lng, k), linear_queries)
+    index_radius_ms, radius = timed(lambda lat, lng: {dev for dev, _ in index.within_radius(lat, lng, radius_m)}, queries)
+    linear_radius_ms, radius_expected = timed(lambda lat, lng: linear_radius(positions, lat, lng, radius_m), linear_queries)
+
+    knn_ok = all(
+        [haversine_m(lat, lng, *positions[d]) for d in got] == [haversine_m(lat, lng, *positions[d]) for d in want]
+        for (lat, lng), got, want in zip(linear_queries, knn, knn_expected)
+    )
+    radius_ok = all(got == want for got, want in zip(radius, radius_expected))
+
+    print(
+        f"{size:>7} devices | build {build_ms:8.1f} ms | "
+        f"k={k} nearest {index_knn_ms:7.3f} ms vs scan {linear_knn_ms:8.3f} ms | "
+        f"{radius_m:.0f} m radius {index_radius_ms:7.3f} ms vs scan {linear_radius_ms:8.3f} ms | "
+        f"match {'ok' if knn_ok and radius_ok else 'MISMATCH'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="1000,10000,50000")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--radius", type=float, default=1000.0)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.queries, args.k, args.radius)
+
+
+if __name__ == "__main__":
+    main()
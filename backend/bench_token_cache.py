@@ -0,0 +1,45 @@
+"""
+JWT Verification Benchmark for Bus Tracking API
+
+Simulates parents polling `/api/live` with the same bearer token every few
+seconds and compares `verify_token` with and without the verified-token
+cache. Prints the per-call cost and the cache counters.
+
+Usage:
+    python bench_token_cache.py [--users 500] [--requests 50000]
+"""
+import argparse
+import os
+import random
+import time
+
+os.environ.setdefault("JWT_SECRET_KEY", "benchmark-secret-key-that-is-at-least-32-chars")
+
+import auth  # noqa: E402  (needs JWT_SECRET_KEY set first)
+
+
+def run(users: int, requests: int, cache_size: int) -> float:
+    auth.token_cache = auth.VerifiedTokenCache(cache_size)
+    tokens = [auth.create_access_token({"sub": f"parent{i}", "role": "parent"}) for i in range(users)]
+    rng = random.Random(0)
+    start = time.perf_counter()
+    for _ in range(requests):
+        auth.verify_token(tokens[rng.randrange(users)])
+    return (time.perf_counter() - start) / requests * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=500, help="Distinct tokens in rotation")
+    parser.add_argument("--requests", type=int, default=50000)
+    args = parser.parse_args()
+
+    uncached = run(args.users, args.requests, 0)
+    print(f"no cache : {uncached:8.2f} us/verify  {auth.token_cache.stats()}")
+    cached = run(args.users, args.requests, 4096)
+    print(f"cached   : {cached:8.2f} us/verify  {auth.token_cache.stats()}")
+    print(f"speedup  : {uncached / cached:.1f}x")
+
+
+if __name__ == "__main__":
+    main()
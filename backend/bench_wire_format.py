@@ -0,0 +1,138 @@
+"""
+Wire Format Benchmark for Bus Tracking API
+
+Compares the JSON fleet array sent on `/ws/live` and `/api/liveplate_all`
+with the binary position frame from `wire_format`: bytes per frame (raw
+and zlib-compressed, as with permessage-deflate), encode time and decode
+time, plus the one-off catalog size. Also checks that decoded positions
+round-trip within the fixed-point precision.
+
+Usage:
+    python bench_wire_format.py [--sizes 10,100,1000,10000] [--frames 50]
+"""
+import argparse
+import json
+import random
+import time
+import zlib
+
+from snapshot import Snapshot
+from wire_format import COORD_SCALE, WireEncoder, decode_frame
+
+CENTER = (28.6139, 77.2090)
+SPREAD = 0.25
+
+
+def device_info(i: int, vid: str) -> dict:
+    # Shape of a getDeviceByVehicle record
+    return {
+        "id": i,
+        "vid": vid,
+        "vehi_idno": vid,
+        "devIdno": f"{1000000 + i}",
+        "devType": 1,
+        "chnCount": 4,
+        "chnName": "CH1,CH2,CH3,CH4",
+        "ioInCount": 4,
+        "ioInName": "IO_1,IO_2,IO_3,IO_4",
+        "tempCount": 0,
+        "pid": 1,
+        "pname": "School Transport",
+        "sim": f"98{i:08d}",
+        "icon": 1,
+    }
+
+
+def fleet_payload(size: int, rng: random.Random, now: float) -> list:
+    payload = []
+    for i in range(size):
+        vid = f"Bus{i}"
+        payload.append({
+            "gps": {
+                "device_id": f"{1000000 + i}",
+                "online": rng.random() > 0.1,
+                "latitude": round(CENTER[0] + rng.uniform(-SPREAD, SPREAD), 6),
+                "longitude": round(CENTER[1] + rng.uniform(-SPREAD, SPREAD), 6),
+                "speed_kmh": round(rng.uniform(0, 60), 1),
+                "last_update": now - rng.uniform(0, 30),
+                "vid": vid,
+                "plate_number": vid,
+            },
+            "plate_number": vid,
+            "device_info": device_info(i, vid),
+            "device_id": f"{1000000 + i}",
+            "device_name": f"{1000000 + i}",
+        })
+    return payload
+
+
+def move(payload: list, rng: random.Random, now: float) -> list:
+    moved = []
+    for entry in payload:
+        gps = dict(entry["gps"])
+        gps["latitude"] = round(gps["latitude"] + rng.uniform(-0.0005, 0.0005), 6)
+        gps["longitude"] = round(gps["longitude"] + rng.uniform(-0.0005, 0.0005), 6)
+        gps["speed_kmh"] = round(rng.uniform(0, 60), 1)
+        gps["last_update"] = now - rng.uniform(0, 5)
+        moved.append({**entry, "gps": gps})
+    return moved
+
+
+def run(size: int, frame_count: int):
+    rng = random.Random(size)
+    now = time.time()
+    payloads = [fleet_payload(size, rng, now)]
+    for n in range(1, frame_count):
+        payloads.append(move(payloads[-1], rng, now + n))
+
+    start = time.perf_counter()
+    snapshots = [Snapshot(n, payload) for n, payload in enumerate(payloads)]
+    json_encode_ms = (time.perf_counter() - start) / frame_count * 1000
+
+    encoder = WireEncoder()
+    start = time.perf_counter()
+    frames = [encoder.advance(snapshot) for snapshot in snapshots]
+    binary_encode_ms = (time.perf_counter() - start) / frame_count * 1000
+
+    start = time.perf_counter()
+    for snapshot in snapshots:
+        json.loads(snapshot.text)
+    json_decode_ms = (time.perf_counter() - start) / frame_count * 1000
+
+    start = time.perf_counter()
+    decoded = [decode_frame(frame.body) for frame in frames]
+    binary_decode_ms = (time.perf_counter() - start) / frame_count * 1000
+
+    tolerance = 1 / COORD_SCALE
+    exact = all(
+        abs(record["latitude"] - entry["gps"]["latitude"]) <= tolerance
+        and abs(record["longitude"] - entry["gps"]["longitude"]) <= tolerance
+        and abs(record["speed_kmh"] - entry["gps"]["speed_kmh"]) <= 0.01
+        and abs(record["last_update"] - entry["gps"]["last_update"]) <= 0.1
+        for (_, _, records), payload in zip(decoded, payloads)
+        for record, entry in zip(records, payload)
+    )
+
+    json_bytes = len(snapshots[-1].body)
+    binary_bytes = len(frames[-1].body)
+    print(
+        f"{size:>6} devices | json {json_bytes:>9} B ({len(zlib.compress(snapshots[-1].body)):>8} deflated) | "
+        f"binary {binary_bytes:>7} B ({len(zlib.compress(frames[-1].body)):>7} deflated) = {json_bytes / binary_bytes:5.1f}x smaller | "
+        f"catalog {len(frames[-1].catalog_text):>8} B once ({encoder.catalogs} sent) | "
+        f"encode {json_encode_ms:7.2f} vs {binary_encode_ms:6.2f} ms | "
+        f"decode {json_decode_ms:7.2f} vs {binary_decode_ms:6.2f} ms | "
+        f"round-trip {'ok' if exact else 'MISMATCH'}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10,100,1000,10000")
+    parser.add_argument("--frames", type=int, default=50)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.frames)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,154 @@
+"""
+Firestore Bus Index for Bus Tracking API
+
+In-process mirror of the `artifacts/{appId}/public/data/buses` collection,
+kept current by a Firestore real-time snapshot listener. Lookups by
+`busId`, `erpId` and `plateNumber` are in-memory dict reads with no
+per-request Firestore round-trip. Several documents may share a value;
+resolving a name that maps to more than one bus is reported as ambiguous
+rather than answered with whichever document was written last.
+
+The index only depends on `on_snapshot` and on change objects exposing
+`type.name` and `document` (`id`, `to_dict()`), so it works the same
+against production Firestore, the emulator, or an in-memory fake that
+calls `apply` directly.
+"""
+import logging
+import threading
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from alias_index import AmbiguousAlias
+
+logger = logging.getLogger(__name__)
+
+INDEXED_FIELDS = ("busId", "erpId", "plateNumber")
+
+
+def _key(value: Any) -> Optional[str]:
+    if value is None:
+        return None
+    key = str(value).strip()
+    return key or None
+
+
+class BusIndex:
+    """Thread-safe index of bus documents keyed by busId, erpId and plateNumber."""
+
+    def __init__(self):
+        self._docs: Dict[str, Dict] = {}  # document id -> data
+        self._fields: Dict[str, Dict[str, Set[str]]] = {field: {} for field in INDEXED_FIELDS}  # field -> value -> doc ids
+        self._lock = threading.Lock()
+        self._watch = None
+        self.ready = threading.Event()  # set after the first snapshot is applied
+
+        self.snapshots = 0
+        self.changes = 0
+
+    def start(self, collection_ref):
+        """
+        Attach a real-time listener to the buses collection.
+
+        Args:
+            collection_ref: Firestore CollectionReference (or anything with `on_snapshot`)
+        """
+        if self._watch is None:
+            self._watch = collection_ref.on_snapshot(self._on_snapshot)
+            logger.info("✓ Bus index listening for Firestore changes")
+
+    def stop(self):
+        """Detach the listener."""
+        if self._watch is not None:
+            self._watch.unsubscribe()
+            self._watch = None
+
+    def _on_snapshot(self, docs, changes, read_time):
+        try:
+            for change in changes:
+                document = change.document
+                self.apply(change.type.name, document.id, document.to_dict() or {})
+            self.snapshots += 1
+            self.ready.set()
+        except Exception as e:
+            logger.exception(f"Bus index failed to apply snapshot: {e}")
+
+    def apply(self, kind: str, doc_id: str, data: Optional[Dict] = None):
+        """
+        Apply one document change.
+
+        Args:
+            kind: "ADDED", "MODIFIED" or "REMOVED"
+            doc_id: Firestore document id
+            data: Document data (ignored for REMOVED)
+        """
+        with self._lock:
+            old = self._docs.pop(doc_id, None)
+            if old is not None:
+                for field in INDEXED_FIELDS:
+                    key = _key(old.get(field))
+                    doc_ids = self._fields[field].get(key)
+                    if doc_ids is not None:
+                        doc_ids.discard(doc_id)
+                        if not doc_ids:
+                            del self._fields[field][key]
+            if kind != "REMOVED":
+                data = dict(data or {})
+                self._docs[doc_id] = data
+                for field in INDEXED_FIELDS:
+                    key = _key(data.get(field))
+                    if key is not None:
+                        self._fields[field].setdefault(key, set()).add(doc_id)
+            self.changes += 1
+
+    def _matches(self, field: str, value: Any) -> List[Tuple[str, Dict]]:
+        key = _key(value)
+        if key is None:
+            return []
+        with self._lock:
+            return [(doc_id, self._docs[doc_id]) for doc_id in sorted(self._fields[field].get(key, ()))]
+
+    def _lookup(self, field: str, value: Any) -> Optional[Tuple[str, Dict]]:
+        # Lowest document id when several share the value, so repeated lookups agree
+        matches = self._matches(field, value)
+        return matches[0] if matches else None
+
+    def by_bus_id(self, bus_id: Any) -> Optional[Tuple[str, Dict]]:
+        """Return (doc_id, data) for the bus with this device id."""
+        return self._lookup("busId", bus_id)
+
+    def by_erp_id(self, erp_id: Any) -> Optional[Tuple[str, Dict]]:
+        """Return (doc_id, data) for the bus with this ERP id."""
+        return self._lookup("erpId", erp_id)
+
+    def by_plate(self, plate: Any) -> Optional[Tuple[str, Dict]]:
+        """Return (doc_id, data) for the bus with this plate number."""
+        return self._lookup("plateNumber", plate)
+
+    def resolve_bus_id(self, alias: Any) -> Optional[str]:
+        """
+        Map an ERP id or plate number to the bus's device id (`busId`).
+
+        Fields are tried in order (busId, erpId, plateNumber); the first one
+        whose matching documents name a bus decides.
+
+        Raises:
+            AmbiguousAlias: If documents matching that field name different buses
+        """
+        for field in ("busId", "erpId", "plateNumber"):
+            bus_ids = sorted({
+                str(data["busId"]) for _, data in self._matches(field, alias) if data.get("busId")
+            })
+            if len(bus_ids) == 1:
+                return bus_ids[0]
+            if bus_ids:
+                raise AmbiguousAlias(str(alias), bus_ids)
+        return None
+
+    def stats(self) -> Dict:
+        """Return index size and listener counters."""
+        with self._lock:
+            return {
+                "ready": self.ready.is_set(),
+                "documents": len(self._docs),
+                "snapshots": self.snapshots,
+                "changes": self.changes,
+            }
@@ -0,0 +1,225 @@
+"""
+Single-Poller Cluster Mode for Bus Tracking API
+
+When uvicorn runs several worker processes, exactly one of them should
+poll the Fleet API. Workers race for an exclusive `flock` on a lock file;
+the holder becomes the leader, polls, and publishes every GPS fix over a
+Unix domain socket. The other workers subscribe to that socket and apply
+the fixes to their own live state, so each one can serve REST and fan out
+WebSockets without adding upstream traffic. Device info (plate and raw
+`getDeviceByVehicle` record) travels on the same socket, so followers
+never look it up upstream either.
+
+The OS releases the lock when the leader process exits, so a follower that
+loses its connection simply tries to take the lock and, if it wins, starts
+polling itself. New subscribers receive the device info and latest fix of
+every device before the live stream.
+
+Each line on the socket is either a JSON array of fixes or a JSON object
+`{"device_info": {device_id: [plate, info]}}`.
+"""
+import fcntl
+import json
+import logging
+import os
+import select
+import socket
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fix tuple layout on the wire: [device_id, ts, lat, lng, speed_kmh, online, vid]
+Fix = List
+
+
+class ClusterNode:
+    """Leader election plus fix pub/sub between the workers on one host."""
+
+    def __init__(
+        self,
+        lock_path: str,
+        socket_path: str,
+        on_fix: Callable[..., None],
+        on_promote: Callable[[], None],
+        on_device_info: Optional[Callable[[str, Optional[str], Dict], None]] = None,
+        flush_interval: float = 0.1,
+        retry_interval: float = 2.0,
+    ):
+        """
+        Args:
+            lock_path: File whose exclusive lock marks the leader
+            socket_path: Unix socket the leader publishes fixes on
+            on_fix: Called with `(device_id, ts, lat, lng, speed_kmh, online, vid)` for each received fix
+            on_promote: Called once when this worker becomes the leader (starts polling)
+            on_device_info: Called with `(device_id, plate, info)` for each received device info record
+            flush_interval: Maximum seconds a fix is held before being sent to followers
+            retry_interval: Seconds between follower reconnect / election attempts
+        """
+        self.lock_path = lock_path
+        self.socket_path = socket_path
+        self.on_fix = on_fix
+        self.on_promote = on_promote
+        self.on_device_info = on_device_info
+        self.flush_interval = flush_interval
+        self.retry_interval = retry_interval
+        for path in (lock_path, socket_path):
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+        self.role = "starting"
+        self._lock_fd: Optional[int] = None
+        self._pending: List[Fix] = []
+        self._latest: Dict[str, Fix] = {}
+        self._pending_info: Dict[str, list] = {}
+        self._device_info: Dict[str, list] = {}
+        self._pending_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+
+        self.published = 0
+        self.received = 0
+        self.followers = 0
+
+    def start(self):
+        """Start the election / subscription thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="cluster-node")
+            self._thread.start()
+
+    @property
+    def is_leader(self) -> bool:
+        return self.role == "leader"
+
+    # ------------------ ELECTION ------------------
+
+    def _try_lead(self) -> bool:
+        fd = os.open(self.lock_path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            os.close(fd)
+            return False
+        os.ftruncate(fd, 0)
+        os.write(fd, str(os.getpid()).encode())
+        self._lock_fd = fd
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self._lock_fd is not None or self._try_lead():
+                    if self.role != "leader":
+                        self.role = "leader"
+                        logger.info(f"🗳️ Worker {os.getpid()} elected GPS poller leader")
+                        self.on_promote()
+                    self._serve()  # only returns on error; the lock is kept and serving retried
+                else:
+                    self.role = "follower"
+                    self._follow()
+            except Exception as e:
+                logger.exception(f"Cluster node error ({self.role}): {e}")
+            time.sleep(self.retry_interval)
+
+    # ------------------ LEADER ------------------
+
+    def publish(self, fix: Fix):
+        """Queue a fix for the followers (leader only; cheap, called from poller threads)."""
+        with self._pending_lock:
+            self._pending.append(fix)
+            self._latest[fix[0]] = fix
+
+    def publish_device_info(self, device_id: str, plate: Optional[str], info: Dict):
+        """Queue a device's plate and raw device info for the followers (leader only)."""
+        with self._pending_lock:
+            self._pending_info[device_id] = self._device_info[device_id] = [plate, info]
+
+    def _serve(self):
+        if os.path.exists(self.socket_path):
+            os.unlink(self.socket_path)  # left behind by a previous leader
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        followers: List[socket.socket] = []
+        try:
+            server.bind(self.socket_path)
+            server.listen(64)
+            server.setblocking(False)
+            logger.info(f"Publishing GPS fixes on {self.socket_path}")
+
+            while True:
+                readable, _, _ = select.select([server] + followers, [], [], self.flush_interval)
+                for sock in readable:
+                    if sock is server:
+                        conn, _ = server.accept()
+                        with self._pending_lock:
+                            device_info = dict(self._device_info)
+                            latest = list(self._latest.values())
+                        if device_info and not self._send(conn, {"device_info": device_info}):
+                            continue
+                        if latest and not self._send(conn, latest):
+                            continue
+                        followers.append(conn)
+                    else:
+                        # Followers never send; readable means the peer closed
+                        followers.remove(sock)
+                        sock.close()
+
+                with self._pending_lock:
+                    pending, self._pending = self._pending, []
+                    pending_info, self._pending_info = self._pending_info, {}
+                if pending_info:
+                    followers = [conn for conn in followers if self._send(conn, {"device_info": pending_info})]
+                if pending:
+                    followers = [conn for conn in followers if self._send(conn, pending)]
+                    self.published += len(pending)
+                self.followers = len(followers)
+        finally:
+            # Followers see EOF and re-run the election; _run retries serving on a fresh socket
+            for sock in [server] + followers:
+                sock.close()
+            self.followers = 0
+            try:
+                os.unlink(self.socket_path)
+            except FileNotFoundError:
+                pass
+
+    @staticmethod
+    def _send(conn: socket.socket, message) -> bool:
+        try:
+            conn.settimeout(5.0)  # a stuck follower is dropped instead of stalling the others
+            conn.sendall(json.dumps(message, separators=(",", ":")).encode() + b"\n")
+            return True
+        except OSError:
+            conn.close()
+            return False
+
+    # ------------------ FOLLOWER ------------------
+
+    def _follow(self):
+        conn = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            conn.connect(self.socket_path)
+        except OSError:
+            conn.close()
+            return
+        logger.info(f"Worker {os.getpid()} following the GPS poller leader")
+        with conn, conn.makefile("rb") as stream:
+            for line in stream:
+                message = json.loads(line)
+                if isinstance(message, dict):
+                    if self.on_device_info is not None:
+                        for device_id, (plate, info) in message.get("device_info", {}).items():
+                            self.on_device_info(device_id, plate, info)
+                    continue
+                for fix in message:
+                    self.on_fix(*fix)
+                    self.received += 1
+        logger.warning("Lost connection to the GPS poller leader, re-running election")
+
+    def stats(self) -> Dict:
+        """Return role and pub/sub counters."""
+        return {
+            "role": self.role,
+            "pid": os.getpid(),
+            "published": self.published,
+            "received": self.received,
+            "followers": self.followers,
+        }
@@ -0,0 +1,175 @@
+"""
+Device Info Cache for Bus Tracking API
+
+TTL + LRU cache in front of the Fleet API `getDeviceByVehicle` lookup, with
+single-flight loading so concurrent misses for the same device share one
+upstream call, and refresh-ahead so hot entries are renewed before expiry.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class _Flight:
+    """An in-progress load that other callers can wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.value: Any = None
+
+
+class TTLCache:
+    """
+    Thread-safe TTL cache with LRU eviction and single-flight loading.
+
+    Values for which `is_valid` returns False (e.g. a failed upstream lookup)
+    are returned to callers but never stored, so the next request retries.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[Hashable], Any],
+        ttl: float = 300.0,
+        max_size: int = 1024,
+        refresh_ahead: float = 0.2,
+        is_valid: Optional[Callable[[Any], bool]] = None,
+        name: str = "cache",
+    ):
+        """
+        Args:
+            loader: Function that loads the value for a key on a miss
+            ttl: Seconds an entry stays fresh
+            max_size: Maximum number of entries before LRU eviction
+            refresh_ahead: Fraction of `ttl` before expiry at which a hit triggers a background refresh
+            is_valid: Optional predicate deciding whether a loaded value may be cached
+            name: Name used in log messages and refresh thread names
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.max_size = max(1, max_size)
+        self.refresh_window = ttl * refresh_ahead
+        self.is_valid = is_valid or (lambda value: value is not None)
+        self.name = name
+
+        self._entries: "OrderedDict[Hashable, tuple]" = OrderedDict()  # key -> (value, expires_at)
+        self._flights: Dict[Hashable, _Flight] = {}
+        self._refreshing: set = set()
+        self._lock = threading.Lock()
+
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+        self.refreshes = 0
+        self.load_errors = 0
+        self.generation = 0  # bumped whenever a stored value changes
+
+    def get(self, key: Hashable) -> Any:
+        """
+        Return the cached value for `key`, loading it on a miss.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Cached or freshly loaded value
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[1] > now:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                if entry[1] - now <= self.refresh_window and key not in self._refreshing:
+                    self._refreshing.add(key)
+                    threading.Thread(
+                        target=self._refresh, args=(key,), daemon=True, name=f"{self.name}-refresh"
+                    ).start()
+                return entry[0]
+
+            self.misses += 1
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            return flight.value
+
+        try:
+            flight.value = self._load(key)
+        finally:
+            with self._lock:
+                self._flights.pop(key, None)
+            flight.event.set()
+        return flight.value
+
+    def _load(self, key: Hashable) -> Any:
+        try:
+            value = self.loader(key)
+        except Exception as e:
+            logger.error(f"{self.name}: load failed for {key}: {e}")
+            with self._lock:
+                self.load_errors += 1
+            return None
+        if self.is_valid(value):
+            self._store(key, value)
+        return value
+
+    def put(self, key: Hashable, value: Any):
+        """Store a value obtained elsewhere (e.g. pushed by another process) as if it had been loaded."""
+        if self.is_valid(value):
+            self._store(key, value)
+
+    def _store(self, key: Hashable, value: Any):
+        with self._lock:
+            previous = self._entries.get(key)
+            if previous is None or previous[0] != value:
+                self.generation += 1
+            self._entries[key] = (value, time.time() + self.ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def _refresh(self, key: Hashable):
+        try:
+            self._load(key)
+            with self._lock:
+                self.refreshes += 1
+            logger.debug(f"{self.name}: refreshed {key} ahead of expiry")
+        finally:
+            with self._lock:
+                self._refreshing.discard(key)
+
+    def invalidate(self, key: Optional[Hashable] = None):
+        """Drop one entry, or the whole cache when `key` is None."""
+        with self._lock:
+            if key is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(key, None)
+
+    def stats(self) -> Dict:
+        """Return cache size and hit/miss counters."""
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "max_size": self.max_size,
+                "ttl_seconds": self.ttl,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else None,
+                "coalesced_misses": self.coalesced,
+                "evictions": self.evictions,
+                "refreshes": self.refreshes,
+                "load_errors": self.load_errors,
+            }
@@ -0,0 +1,179 @@
+"""
+ERP Auto-Mapping Worker for Bus Tracking API
+
+Keeps each bus document's `erpId` in Firestore in line with the VID reported
+by its GPS device. A single background thread drains a deduplicating queue,
+remembers what it last synced, and only touches Firestore when a device's
+VID actually changes, grouping creates and updates into batched writes.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+from firebase_admin import firestore
+
+from alias_index import extract_erp_id
+
+logger = logging.getLogger(__name__)
+
+# Firestore limits: 30 values per "in" filter, 500 writes per batch
+QUERY_CHUNK_SIZE = 30
+MAX_BATCH_WRITES = 500
+
+
+class ErpSyncWorker:
+    """
+    Single-threaded, batched ERP id sync.
+
+    `submit` is cheap and safe to call from the poller on every cycle: it is
+    a dict lookup when the mapping is unchanged, and repeated submissions for
+    the same device before the next flush collapse into one.
+    """
+
+    def __init__(
+        self,
+        db_factory: Callable[[], object],
+        collection_path: str,
+        flush_interval: float = 2.0,
+        index=None,
+    ):
+        """
+        Args:
+            db_factory: Returns a Firestore client (called once, lazily)
+            collection_path: Path of the buses collection
+            flush_interval: Seconds to gather submissions before writing
+            index: Optional BusIndex; once ready it replaces the Firestore lookup queries
+        """
+        self.db_factory = db_factory
+        self.collection_path = collection_path
+        self.flush_interval = flush_interval
+        self.index = index
+
+        self._db = None
+        self._synced: Dict[str, Tuple[str, str]] = {}  # device_id -> (vid, erp_id)
+        self._pending: Dict[str, str] = {}  # device_id -> latest vid
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+
+        self.submitted = 0
+        self.skipped = 0
+        self.queries = 0
+        self.creates = 0
+        self.updates = 0
+        self.batches = 0
+        self.errors = 0
+
+    def start(self):
+        """Start the background sync thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="erp-sync")
+            self._thread.start()
+            logger.info("ERP auto-mapping worker started")
+
+    def submit(self, device_id: str, vid: str):
+        """Queue a device's current VID for syncing if it differs from the last sync."""
+        erp_id = extract_erp_id(vid)
+        if not erp_id:
+            return
+        with self._lock:
+            self.submitted += 1
+            if self._synced.get(device_id) == (vid, erp_id):
+                self.skipped += 1
+                return
+            self._pending[device_id] = vid
+        self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let submissions from the rest of the poll cycle accumulate
+            time.sleep(self.flush_interval)
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                continue
+            try:
+                self._flush(pending)
+            except Exception as e:
+                self.errors += 1
+                logger.error(f"Auto-Map Error: {e}")
+
+    def _collection(self):
+        if self._db is None:
+            self._db = self.db_factory()
+        return self._db.collection(self.collection_path)
+
+    def _flush(self, pending: Dict[str, str]):
+        buses_ref = self._collection()
+        device_ids = list(pending)
+
+        existing = {}  # device_id -> (document ref, data)
+        if self.index is not None and self.index.ready.is_set():
+            for device_id in device_ids:
+                found = self.index.by_bus_id(device_id)
+                if found is not None:
+                    existing[device_id] = (buses_ref.document(found[0]), found[1])
+        else:
+            for i in range(0, len(device_ids), QUERY_CHUNK_SIZE):
+                chunk = device_ids[i:i + QUERY_CHUNK_SIZE]
+                self.queries += 1
+                for doc in buses_ref.where("busId", "in", chunk).get():
+                    data = doc.to_dict()
+                    existing.setdefault(data.get("busId"), (doc.reference, data))
+
+        writes: List[Tuple[str, object, Dict]] = []  # (kind, document ref, data)
+        synced = {}
+        for device_id, vid in pending.items():
+            erp_id = extract_erp_id(vid)
+            synced[device_id] = (vid, erp_id)
+            bus_doc = existing.get(device_id)
+            if bus_doc is not None:
+                ref, data = bus_doc
+                if data.get("erpId") != erp_id:
+                    logger.info(f"🔄 Auto-Mapping: Updating {device_id} ({vid}) -> ERP ID: {erp_id}")
+                    writes.append(("update", ref, {"erpId": erp_id}))
+            else:
+                # Create new bus document if missing
+                logger.info(f"🆕 Auto-Mapping: Creating new bus for {device_id} ({vid}) -> ERP ID: {erp_id}")
+                writes.append(("create", buses_ref.document(), {
+                    "busId": device_id,
+                    "erpId": erp_id,
+                    "plateNumber": erp_id,  # Use ERP ID (e.g. "26") as display name/plate
+                    "device_type": "GPS_TRACKER",
+                    "createdAt": firestore.SERVER_TIMESTAMP,
+                    "model": "Generic Bus",
+                    "capacity": "40"
+                }))
+
+        for i in range(0, len(writes), MAX_BATCH_WRITES):
+            batch = self._db.batch()
+            for kind, ref, data in writes[i:i + MAX_BATCH_WRITES]:
+                if kind == "create":
+                    batch.set(ref, data)
+                    self.creates += 1
+                else:
+                    batch.update(ref, data)
+                    self.updates += 1
+            batch.commit()
+            self.batches += 1
+
+        with self._lock:
+            self._synced.update(synced)
+
+    def stats(self) -> Dict:
+        """Return queue size and Firestore traffic counters."""
+        with self._lock:
+            return {
+                "tracked_devices": len(self._synced),
+                "pending": len(self._pending),
+                "submitted": self.submitted,
+                "skipped_unchanged": self.skipped,
+                "queries": self.queries,
+                "creates": self.creates,
+                "updates": self.updates,
+                "batches": self.batches,
+                "errors": self.errors,
+            }
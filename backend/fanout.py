@@ -0,0 +1,218 @@
+"""
+WebSocket Fan-out for Bus Tracking API
+
+Gives every connected client its own outbound queue and writer task, so one
+slow socket never delays delivery to the others. Snapshot frames are
+coalesced per client (only the newest is kept), so a client that skips a
+few updates just receives the latest one; a client is only disconnected
+when a snapshot has waited longer than `max_lag` seconds for its writer.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Callable, Dict, List, Optional, Union
+
+from fastapi import WebSocket
+
+logger = logging.getLogger(__name__)
+
+# Close code sent to evicted slow consumers ("Try Again Later")
+SLOW_CONSUMER_CLOSE_CODE = 1013
+
+# What a renderer returns: one text or binary frame, or several sent in order
+Frames = Union[str, bytes, List[Union[str, bytes]]]
+
+
+class ClientChannel:
+    """Outbound queue and writer task for a single WebSocket."""
+
+    def __init__(
+        self,
+        websocket: WebSocket,
+        render: Callable[[WebSocket, Any], Optional[Frames]],
+        max_queue: int,
+        send_timeout: float,
+    ):
+        self.websocket = websocket
+        self.render = render
+        self.max_queue = max_queue
+        self.send_timeout = send_timeout
+
+        self._messages: deque = deque()
+        self._latest: Any = None
+        self._waiting_since: Optional[float] = None  # when the pending snapshot slot was filled
+        self._wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+
+        self.sent = 0
+        self.coalesced = 0
+
+    @property
+    def depth(self) -> int:
+        return len(self._messages) + (1 if self._latest is not None else 0)
+
+    def lag(self, now: float) -> float:
+        """Seconds the pending snapshot has waited for the writer (0 if none is pending)."""
+        return now - self._waiting_since if self._waiting_since is not None else 0.0
+
+    def publish(self, snapshot: Any, now: float) -> float:
+        """Queue `snapshot`, replacing any unsent one; returns the current lag in seconds."""
+        if self._latest is not None:
+            self.coalesced += 1
+        else:
+            self._waiting_since = now
+        self._latest = snapshot
+        self._wakeup.set()
+        return self.lag(now)
+
+    def send(self, text: str) -> bool:
+        """Queue a one-off message; returns False if the queue is full."""
+        if len(self._messages) >= self.max_queue:
+            return False
+        self._messages.append(text)
+        self._wakeup.set()
+        return True
+
+    async def run(self):
+        """Writer loop: drain direct messages first, then the latest snapshot."""
+        while not self.closed:
+            await self._wakeup.wait()
+            self._wakeup.clear()
+            while self._messages or self._latest is not None:
+                if self._messages:
+                    frames = [self._messages.popleft()]
+                else:
+                    snapshot, self._latest = self._latest, None
+                    self._waiting_since = None
+                    frames = self.render(self.websocket, snapshot)
+                    if frames is None:
+                        continue
+                    if not isinstance(frames, list):
+                        frames = [frames]
+                for frame in frames:
+                    await self._send(frame)
+
+    async def _send(self, frame: Union[str, bytes]):
+        send = self.websocket.send_bytes if isinstance(frame, bytes) else self.websocket.send_text
+        await asyncio.wait_for(send(frame), timeout=self.send_timeout)
+        self.sent += 1
+
+
+class FanoutHub:
+    """
+    Registry of client channels with concurrent, per-client delivery.
+
+    `publish` never awaits a socket: it only drops the snapshot into each
+    client's slot, so broadcasting costs O(clients) regardless of how slow
+    any individual connection is.
+    """
+
+    def __init__(
+        self,
+        render: Callable[[WebSocket, Any], Optional[Frames]],
+        max_queue: int = 16,
+        max_lag: float = 15.0,
+        send_timeout: float = 10.0,
+        on_remove: Optional[Callable[[WebSocket], None]] = None,
+    ):
+        """
+        Args:
+            render: Turns a snapshot into the frame(s) for one client (None to skip)
+            max_queue: Maximum queued one-off messages per client
+            max_lag: Seconds a pending snapshot may wait for a client's writer before the client is evicted
+            send_timeout: Seconds a single send may take before the client is dropped
+            on_remove: Callback run when a client is removed for any reason
+        """
+        self.render = render
+        self.max_queue = max_queue
+        self.max_lag = max_lag
+        self.send_timeout = send_timeout
+        self.on_remove = on_remove
+        self.channels: Dict[WebSocket, ClientChannel] = {}
+
+        self.evictions = 0
+        self.send_failures = 0
+        self.total_sent = 0
+        self.total_coalesced = 0
+
+    def __len__(self) -> int:
+        return len(self.channels)
+
+    def register(self, websocket: WebSocket) -> ClientChannel:
+        """Create a channel for `websocket` and start its writer task."""
+        channel = ClientChannel(websocket, self.render, self.max_queue, self.send_timeout)
+        channel.task = asyncio.create_task(self._run(channel))
+        self.channels[websocket] = channel
+        return channel
+
+    async def _run(self, channel: ClientChannel):
+        try:
+            await channel.run()
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            self.send_failures += 1
+            logger.warning(f"WebSocket send failed, dropping client: {e}")
+            await self._close(channel.websocket)
+        finally:
+            self.unregister(channel.websocket)
+
+    def unregister(self, websocket: WebSocket):
+        """Remove a client and stop its writer."""
+        channel = self.channels.pop(websocket, None)
+        if channel is None:
+            return
+        channel.closed = True
+        self.total_sent += channel.sent
+        self.total_coalesced += channel.coalesced
+        if channel.task and channel.task is not asyncio.current_task():
+            channel.task.cancel()
+        if self.on_remove:
+            self.on_remove(websocket)
+
+    def publish(self, snapshot: Any):
+        """Hand `snapshot` to every client, evicting those that lag too far behind."""
+        now = time.monotonic()
+        for websocket, channel in list(self.channels.items()):
+            lag = channel.publish(snapshot, now)
+            if lag > self.max_lag:
+                self.evict(websocket, f"{lag:.1f}s behind")
+
+    def send(self, websocket: WebSocket, text: str):
+        """Queue a one-off message for a client, evicting it if its queue is full."""
+        channel = self.channels.get(websocket)
+        if channel is not None and not channel.send(text):
+            self.evict(websocket, "outbound queue full")
+
+    def evict(self, websocket: WebSocket, reason: str):
+        """Disconnect a slow consumer."""
+        if websocket not in self.channels:
+            return
+        self.evictions += 1
+        logger.warning(f"Evicting slow WebSocket client: {reason}")
+        self.unregister(websocket)
+        asyncio.create_task(self._close(websocket, SLOW_CONSUMER_CLOSE_CODE))
+
+    async def _close(self, websocket: WebSocket, code: int = 1011):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass
+
+    def stats(self) -> Dict:
+        """Return connection count, queue depths and drop/eviction counters."""
+        channels = list(self.channels.values())
+        depths = [channel.depth for channel in channels]
+        now = time.monotonic()
+        return {
+            "active_connections": len(channels),
+            "max_queue_depth": max(depths) if depths else 0,
+            "max_lag_seconds": round(max((channel.lag(now) for channel in channels), default=0.0), 2),
+            "queued_frames": sum(depths),
+            "frames_sent": self.total_sent + sum(channel.sent for channel in channels),
+            "frames_coalesced": self.total_coalesced + sum(channel.coalesced for channel in channels),
+            "evictions": self.evictions,
+            "send_failures": self.send_failures,
+        }
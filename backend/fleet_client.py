@@ -0,0 +1,188 @@
+"""
+Fleet API Client for Bus Tracking API
+
+One shared, pooled HTTP client for every Fleet API call. Connections are
+kept alive in a bounded urllib3 pool, each action has its own timeout, the
+session token is injected (and refreshed on expiry) through the attached
+FleetSessionManager, and an async interface runs calls on a dedicated
+I/O executor so upstream latency never blocks the event loop.
+"""
+import asyncio
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+
+logger = logging.getLogger(__name__)
+
+# Connect timeout is kept short; the read timeout comes from the per-action table
+CONNECT_TIMEOUT = 5.0
+
+
+def parse_timeouts(value: str) -> Dict[str, float]:
+    """
+    Parse per-action timeouts from "getDeviceStatus=5,login=10".
+
+    Keys are matched against the action name without the
+    `StandardApiAction_` prefix and `.action` suffix.
+    """
+    timeouts = {}
+    for item in value.split(","):
+        if "=" not in item:
+            continue
+        name, seconds = item.split("=", 1)
+        if name.strip():
+            timeouts[name.strip()] = float(seconds)
+    return timeouts
+
+
+def action_name(action: str) -> str:
+    """"StandardApiAction_getDeviceStatus.action" -> "getDeviceStatus"."""
+    name = action
+    if name.startswith("StandardApiAction_"):
+        name = name[len("StandardApiAction_"):]
+    if name.endswith(".action"):
+        name = name[:-len(".action")]
+    return name
+
+
+def parse_device_status(status: Dict) -> Tuple[float, float, float, bool, Optional[str]]:
+    """
+    Decode one getDeviceStatus `status[]` entry.
+
+    Returns:
+        (lat, lng, speed_kmh, online, vid); lat/lng are 0 when the device has no fix
+    """
+    return (
+        float(status.get("mlat", 0)),
+        float(status.get("mlng", 0)),
+        float(status.get("sp", 0)) / 10.0,  # reported in 0.1 km/h
+        status.get("ol") == 1,
+        status.get("vid"),  # e.g. "Bus26"
+    )
+
+
+class FleetApiClient:
+    """Pooled, keep-alive Fleet API client with sync and async interfaces."""
+
+    def __init__(
+        self,
+        base_url: str,
+        pool_size: int = 32,
+        default_timeout: float = 10.0,
+        timeouts: Optional[Dict[str, float]] = None,
+        max_workers: Optional[int] = None,
+        verify: bool = False,
+    ):
+        """
+        Args:
+            base_url: Fleet API base URL
+            pool_size: Maximum pooled keep-alive connections to the upstream host
+            default_timeout: Read timeout for actions without an explicit entry
+            timeouts: Per-action read timeouts keyed by short action name
+            max_workers: Threads in the async I/O executor (defaults to `pool_size`)
+            verify: Verify TLS certificates
+        """
+        self.base_url = base_url.rstrip("/")
+        self.pool_size = pool_size
+        self.default_timeout = default_timeout
+        self.timeouts = dict(timeouts or {})
+        self.session_manager = None  # FleetSessionManager, attached after construction
+
+        self._http = requests.Session()
+        self._http.verify = verify
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self._http.mount("http://", adapter)
+        self._http.mount("https://", adapter)
+
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers or pool_size, thread_name_prefix="fleet-io"
+        )
+        self._stats: Dict[str, Dict[str, float]] = {}
+        self._lock = threading.Lock()
+
+    def timeout_for(self, action: str):
+        """Return the (connect, read) timeout tuple for an action."""
+        read = self.timeouts.get(action_name(action), self.default_timeout)
+        return min(CONNECT_TIMEOUT, read), read
+
+    def _record(self, action: str, started: float, ok: bool):
+        elapsed_ms = (time.time() - started) * 1000
+        with self._lock:
+            stats = self._stats.setdefault(action_name(action), {"calls": 0, "errors": 0, "total_ms": 0.0})
+            stats["calls"] += 1
+            stats["total_ms"] += elapsed_ms
+            if not ok:
+                stats["errors"] += 1
+
+    def _get(self, action: str, params: Dict) -> Dict:
+        started = time.time()
+        ok = False
+        try:
+            response = self._http.get(
+                f"{self.base_url}/{action}", params=params, timeout=self.timeout_for(action)
+            )
+            data = response.json()
+            ok = True
+            return data
+        finally:
+            self._record(action, started, ok)
+
+    def request(self, action: str, params: Optional[Dict] = None, authenticated: bool = True) -> Dict:
+        """
+        Call a Fleet API action and return the decoded JSON.
+
+        Authenticated calls carry the current jsession; if the response says
+        the session has expired, it is dropped and the call retried once.
+
+        Raises:
+            FleetSessionUnavailable: If no session can be obtained
+            requests.exceptions.RequestException: On network errors or timeouts
+        """
+        params = dict(params or {})
+        if not authenticated or self.session_manager is None:
+            return self._get(action, params)
+
+        for _ in range(2):
+            jsession = self.session_manager.get()
+            data = self._get(action, {**params, "jsession": jsession})
+            if not self.session_manager.is_expired(data):
+                return data
+            self.session_manager.invalidate(jsession)
+        return data
+
+    async def run(self, func: Callable[..., Any], *args) -> Any:
+        """Run a blocking, upstream-bound function on the client's I/O executor."""
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, func, *args)
+
+    async def arequest(self, action: str, params: Optional[Dict] = None, authenticated: bool = True) -> Dict:
+        """Async version of `request`; never blocks the event loop."""
+        return await self.run(self.request, action, params, authenticated)
+
+    def stats(self) -> Dict:
+        """Return pool configuration and per-action call counts and mean latency."""
+        with self._lock:
+            actions = {
+                name: {
+                    "calls": int(s["calls"]),
+                    "errors": int(s["errors"]),
+                    "avg_ms": round(s["total_ms"] / s["calls"], 2) if s["calls"] else None,
+                }
+                for name, s in self._stats.items()
+            }
+        return {
+            "pool_size": self.pool_size,
+            "default_timeout": self.default_timeout,
+            "timeouts": self.timeouts,
+            "actions": actions,
+        }
+
+    def close(self):
+        """Close pooled connections and stop the I/O executor."""
+        self._executor.shutdown(wait=False)
+        self._http.close()
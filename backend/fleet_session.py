@@ -0,0 +1,164 @@
+"""
+Fleet API Session Manager for Bus Tracking API
+
+Owns the Fleet API `jsession` token: logs in lazily, refreshes proactively
+before the token ages out, recognizes expired-session result codes, makes
+concurrent callers share one in-flight login, and backs off when logins fail.
+"""
+import logging
+import threading
+import time
+from typing import Callable, Dict, Iterable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Fleet API result code for "Session expired or invalid"
+DEFAULT_EXPIRED_CODES = (7,)
+
+
+class FleetSessionUnavailable(Exception):
+    """Raised when no Fleet API session can be obtained (login failing or backing off)."""
+
+
+class FleetSessionManager:
+    """
+    Thread-safe, single-flight holder of the Fleet API session token.
+
+    While a login is in flight, callers that already have a (possibly old)
+    token keep using it; only callers with no token at all wait for the
+    login to finish.
+    """
+
+    def __init__(
+        self,
+        login: Callable[[], Optional[str]],
+        max_age: float = 3000.0,
+        expired_codes: Iterable[int] = DEFAULT_EXPIRED_CODES,
+        backoff_initial: float = 1.0,
+        backoff_max: float = 60.0,
+        login_timeout: float = 30.0,
+    ):
+        """
+        Args:
+            login: Performs a Fleet API login and returns the jsession (or None on failure)
+            max_age: Seconds after which the token is refreshed proactively
+            expired_codes: Result codes that mean the session is no longer valid
+            backoff_initial: First retry delay after a failed login
+            backoff_max: Upper bound for the exponential retry delay
+            login_timeout: Maximum seconds a caller waits for another caller's login
+        """
+        self.login = login
+        self.max_age = max_age
+        self.expired_codes = set(expired_codes)
+        self.backoff_initial = backoff_initial
+        self.backoff_max = backoff_max
+        self.login_timeout = login_timeout
+
+        self._token: Optional[str] = None
+        self._issued_at = 0.0
+        self._logging_in = False
+        self._failures = 0
+        self._retry_at = 0.0
+        self._cond = threading.Condition()
+
+        self.logins = 0
+        self.refreshes = 0
+        self.login_failures = 0
+        self.expirations = 0
+        self.last_login_ms: Optional[float] = None
+
+    @property
+    def token(self) -> Optional[str]:
+        """Current token without triggering a login."""
+        return self._token
+
+    def get(self) -> str:
+        """
+        Return a usable session token, logging in if needed.
+
+        Raises:
+            FleetSessionUnavailable: If there is no token and login is failing
+        """
+        with self._cond:
+            while True:
+                now = time.time()
+                fresh = self._token is not None and now - self._issued_at < self.max_age
+                if fresh:
+                    return self._token
+                if self._logging_in:
+                    if self._token is not None:
+                        return self._token  # old token stays usable while the refresh runs
+                    if not self._cond.wait(timeout=self.login_timeout):
+                        raise FleetSessionUnavailable("Timed out waiting for Fleet API login")
+                    continue
+                if now < self._retry_at:
+                    if self._token is not None:
+                        return self._token
+                    raise FleetSessionUnavailable(
+                        f"Fleet API login backing off for {self._retry_at - now:.1f}s"
+                    )
+                self._logging_in = True
+                refreshing = self._token is not None
+                break
+
+        started = time.time()
+        token = None
+        try:
+            token = self.login()
+        except Exception as e:
+            logger.exception(f"✗ Error getting Fleet API session: {e}")
+        finally:
+            with self._cond:
+                self._logging_in = False
+                self.last_login_ms = round((time.time() - started) * 1000, 2)
+                if token:
+                    self._token = token
+                    self._issued_at = time.time()
+                    self._failures = 0
+                    self._retry_at = 0.0
+                    self.logins += 1
+                    if refreshing:
+                        self.refreshes += 1
+                else:
+                    self._failures += 1
+                    self.login_failures += 1
+                    delay = min(self.backoff_max, self.backoff_initial * (2 ** (self._failures - 1)))
+                    self._retry_at = time.time() + delay
+                    logger.warning(f"Fleet API login failed ({self._failures} in a row), retrying in {delay:.1f}s")
+                self._cond.notify_all()
+
+        with self._cond:
+            if self._token is None:
+                raise FleetSessionUnavailable("Fleet API login failed")
+            return self._token
+
+    def is_expired(self, data: Dict) -> bool:
+        """True if a Fleet API response says the session is expired or invalid."""
+        return isinstance(data, dict) and data.get("result") in self.expired_codes
+
+    def invalidate(self, token: Optional[str]):
+        """
+        Drop `token` so the next `get` logs in again.
+
+        Only the token the caller actually used is dropped, so a burst of
+        expired responses triggers a single re-login.
+        """
+        with self._cond:
+            if token is not None and token == self._token:
+                logger.warning("Fleet API session expired, will log in again")
+                self._token = None
+                self.expirations += 1
+
+    def stats(self) -> Dict:
+        """Return session age and login counters."""
+        with self._cond:
+            return {
+                "has_session": self._token is not None,
+                "session_age_seconds": round(time.time() - self._issued_at, 2) if self._token else None,
+                "logins": self.logins,
+                "refreshes": self.refreshes,
+                "login_failures": self.login_failures,
+                "expirations": self.expirations,
+                "last_login_ms": self.last_login_ms,
+                "backing_off": time.time() < self._retry_at,
+            }
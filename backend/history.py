@@ -0,0 +1,146 @@
+"""
+In-Memory Position History for Bus Tracking API
+
+Fixed-capacity ring buffer of recent fixes per device, stored column-wise in
+`array` buffers (timestamp, lat, lng, speed, online). Time-range reads use
+binary search on the timestamps, so a recent-trail request is served from
+memory without an upstream `queryTrackDetail` round-trip.
+"""
+import threading
+from array import array
+from bisect import bisect_left, bisect_right
+from typing import Dict, List, Optional
+
+
+class _LogicalTimestamps:
+    """Sequence view of a ring buffer's timestamps in chronological order (for bisect)."""
+
+    __slots__ = ("ring",)
+
+    def __init__(self, ring: "PositionRing"):
+        self.ring = ring
+
+    def __len__(self) -> int:
+        return self.ring.count
+
+    def __getitem__(self, index: int) -> float:
+        return self.ring.ts[self.ring.physical(index)]
+
+
+class PositionRing:
+    """Ring buffer of fixes for one device; timestamps are strictly increasing."""
+
+    __slots__ = ("capacity", "ts", "lat", "lng", "speed", "online", "start", "count")
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.ts = array("d", bytes(8 * capacity))
+        self.lat = array("d", bytes(8 * capacity))
+        self.lng = array("d", bytes(8 * capacity))
+        self.speed = array("f", bytes(4 * capacity))
+        self.online = array("b", bytes(capacity))
+        self.start = 0  # physical index of the oldest fix
+        self.count = 0
+
+    def physical(self, index: int) -> int:
+        return (self.start + index) % self.capacity
+
+    def append(self, ts: float, lat: float, lng: float, speed: float, online: bool) -> bool:
+        """Append a fix; fixes not newer than the last one are ignored."""
+        if self.count and ts <= self.ts[self.physical(self.count - 1)]:
+            return False
+        if self.count < self.capacity:
+            i = self.physical(self.count)
+            self.count += 1
+        else:
+            i = self.start
+            self.start = (self.start + 1) % self.capacity
+        self.ts[i] = ts
+        self.lat[i] = lat
+        self.lng[i] = lng
+        self.speed[i] = speed
+        self.online[i] = 1 if online else 0
+        return True
+
+    def slice(self, since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, list]:
+        """Return the fixes with `since <= ts <= until` as column lists."""
+        view = _LogicalTimestamps(self)
+        lo = bisect_left(view, since) if since is not None else 0
+        hi = bisect_right(view, until) if until is not None else self.count
+        columns = {"ts": [], "lat": [], "lng": [], "speed": [], "online": []}
+        if lo >= hi:
+            return columns
+        a, b = self.physical(lo), self.physical(hi - 1) + 1
+        if a < b:
+            ranges = [(a, b)]
+        else:
+            ranges = [(a, self.capacity), (0, b)]
+        for x, y in ranges:
+            columns["ts"].extend(self.ts[x:y])
+            columns["lat"].extend(self.lat[x:y])
+            columns["lng"].extend(self.lng[x:y])
+            columns["speed"].extend(self.speed[x:y])
+            columns["online"].extend(self.online[x:y])
+        return columns
+
+
+class PositionHistory:
+    """Per-device position rings, safe for concurrent appends from poller threads."""
+
+    def __init__(self, capacity: int = 2880):
+        """
+        Args:
+            capacity: Fixes kept per device (2880 = 4 hours at a 5 s poll interval)
+        """
+        self.capacity = max(1, capacity)
+        self._rings: Dict[str, PositionRing] = {}
+        self._lock = threading.Lock()
+        self.appended = 0
+
+    def append(self, device_id: str, ts: float, lat: float, lng: float, speed: float, online: bool):
+        """Record a fix for a device."""
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                ring = self._rings[device_id] = PositionRing(self.capacity)
+            if ring.append(ts, lat, lng, speed, online):
+                self.appended += 1
+
+    def query(self, device_id: str, since: Optional[float] = None, until: Optional[float] = None) -> Dict[str, list]:
+        """Return a device's fixes in `[since, until]` as column lists (empty if none)."""
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None:
+                return {"ts": [], "lat": [], "lng": [], "speed": [], "online": []}
+            return ring.slice(since, until)
+
+    def oldest(self, device_id: str) -> Optional[float]:
+        """Timestamp of the oldest fix held for a device (None if there are none)."""
+        with self._lock:
+            ring = self._rings.get(device_id)
+            if ring is None or not ring.count:
+                return None
+            return ring.ts[ring.start]
+
+    def stats(self) -> Dict:
+        """Return device count, stored fixes and approximate buffer memory."""
+        with self._lock:
+            stored = sum(ring.count for ring in self._rings.values())
+            devices = len(self._rings)
+        return {
+            "devices": devices,
+            "capacity_per_device": self.capacity,
+            "stored_fixes": stored,
+            "appended": self.appended,
+            "buffer_bytes": devices * self.capacity * 29,
+        }
+
+
+def to_points(columns: Dict[str, list]) -> List[Dict]:
+    """Convert column lists into the per-point dicts served by /api/history."""
+    return [
+        {"t": t, "lat": lat, "lng": lng, "speed": round(speed, 1), "online": bool(online)}
+        for t, lat, lng, speed, online in zip(
+            columns["ts"], columns["lat"], columns["lng"], columns["speed"], columns["online"]
+        )
+    ]
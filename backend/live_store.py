@@ -0,0 +1,238 @@
+"""
+Live State Store for Bus Tracking API
+
+Latest fix of every device, kept column-wise in `array` buffers (lat, lng,
+speed, online, last_update) with a device id -> row index, instead of one
+dict per device. Memory grows by a few dozen bytes per device and fleet-wide
+scans (health, broadcasts) run over flat buffers.
+
+Readers take a `snapshot()`, an immutable view that shares the columns with
+the store. The store copies its columns before the next write after a
+snapshot was taken (copy-on-write), so the poller threads and the event
+loop never share mutable state and taking a snapshot costs O(1).
+"""
+import threading
+import time
+from array import array
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple
+
+# Placeholder position until a device reports its first valid fix
+DEFAULT_LATITUDE = 28.6139
+DEFAULT_LONGITUDE = 77.2090
+
+
+class _Columns:
+    """One generation of the column buffers."""
+
+    __slots__ = ("ids", "rows", "lat", "lng", "speed", "online", "last_update", "vid", "plate")
+
+    def __init__(self):
+        self.ids: List[str] = []
+        self.rows: Dict[str, int] = {}
+        self.lat = array("d")
+        self.lng = array("d")
+        self.speed = array("f")
+        self.online = array("b")
+        self.last_update = array("d")
+        self.vid: List[Optional[str]] = []
+        self.plate: List[Optional[str]] = []
+
+    def nbytes(self) -> int:
+        """Bytes held by the numeric column buffers."""
+        return sum(
+            column.itemsize * len(column)
+            for column in (self.lat, self.lng, self.speed, self.online, self.last_update)
+        )
+
+    def copy(self) -> "_Columns":
+        other = _Columns.__new__(_Columns)
+        other.ids = self.ids
+        other.rows = self.rows  # only replaced (never mutated) when devices are added
+        other.lat = array("d", self.lat)
+        other.lng = array("d", self.lng)
+        other.speed = array("f", self.speed)
+        other.online = array("b", self.online)
+        other.last_update = array("d", self.last_update)
+        other.vid = list(self.vid)
+        other.plate = list(self.plate)
+        return other
+
+
+class LiveStateView:
+    """Immutable point-in-time view of the live state."""
+
+    __slots__ = ("_columns",)
+
+    def __init__(self, columns: _Columns):
+        self._columns = columns
+
+    def __len__(self) -> int:
+        return len(self._columns.ids)
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._columns.rows
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._columns.ids)
+
+    def _entry(self, row: int) -> Dict:
+        c = self._columns
+        return {
+            "device_id": c.ids[row],
+            "online": bool(c.online[row]),
+            "latitude": c.lat[row],
+            "longitude": c.lng[row],
+            "speed_kmh": round(c.speed[row], 1),
+            "last_update": c.last_update[row],
+            "vid": c.vid[row],
+            "plate_number": c.plate[row],
+        }
+
+    def get(self, device_id: str) -> Optional[Dict]:
+        """A device's state as the dict served by the API (None if unknown)."""
+        row = self._columns.rows.get(device_id)
+        return self._entry(row) if row is not None else None
+
+    def position(self, device_id: str) -> Optional[Tuple[float, float, float, bool]]:
+        """A device's `(lat, lng, speed_kmh, online)` without building a dict."""
+        row = self._columns.rows.get(device_id)
+        if row is None:
+            return None
+        c = self._columns
+        return c.lat[row], c.lng[row], c.speed[row], bool(c.online[row])
+
+    def to_dict(self) -> Dict[str, Dict]:
+        """All devices keyed by id (the `/api/live` payload)."""
+        return {device_id: self._entry(row) for row, device_id in enumerate(self._columns.ids)}
+
+    def online_count(self) -> int:
+        return self._columns.online.count(1)
+
+    def update_range(self) -> Tuple[float, float]:
+        """Oldest and newest `last_update` across devices (0, 0 if empty)."""
+        last_update = self._columns.last_update
+        if not last_update:
+            return 0.0, 0.0
+        return min(last_update), max(last_update)
+
+
+class LiveStateStore:
+    """Column store of each device's latest fix, written by poller threads."""
+
+    def __init__(self, device_ids: Iterable[str] = (), plates: Optional[Dict[str, str]] = None):
+        """
+        Args:
+            device_ids: Devices to track
+            plates: Optional placeholder plate per device until its GPS VID is known
+        """
+        self._columns = _Columns()
+        self._shared = False  # a snapshot references the current columns
+        self._lock = threading.Lock()
+        self.writes = 0
+        self.copies = 0
+        for device_id in device_ids:
+            self.add(device_id, (plates or {}).get(device_id))
+
+    def _writable(self) -> _Columns:
+        if self._shared:
+            self._columns = self._columns.copy()
+            self._shared = False
+            self.copies += 1
+        return self._columns
+
+    def add(self, device_id: str, plate: Optional[str] = None):
+        """Start tracking a device (no-op if already tracked)."""
+        with self._lock:
+            if device_id in self._columns.rows:
+                return
+            c = self._writable()
+            c.rows = dict(c.rows)
+            c.rows[device_id] = len(c.ids)
+            c.ids = c.ids + [device_id]
+            c.lat.append(DEFAULT_LATITUDE)
+            c.lng.append(DEFAULT_LONGITUDE)
+            c.speed.append(0.0)
+            c.online.append(0)
+            c.last_update.append(time.time())
+            c.vid.append(None)
+            c.plate.append(plate)
+
+    def remove(self, device_id: str):
+        """Stop tracking a device (no-op if not tracked); later rows move up by one."""
+        with self._lock:
+            old = self._columns
+            row = old.rows.get(device_id)
+            if row is None:
+                return
+            c = _Columns()
+            c.ids = old.ids[:row] + old.ids[row + 1:]
+            c.rows = {dev: index for index, dev in enumerate(c.ids)}
+            for name in ("lat", "lng", "speed", "online", "last_update"):
+                column = getattr(old, name)
+                setattr(c, name, column[:row] + column[row + 1:])
+            c.vid = old.vid[:row] + old.vid[row + 1:]
+            c.plate = old.plate[:row] + old.plate[row + 1:]
+            # Built fresh, so snapshots of the old columns stay valid
+            self._columns = c
+            self._shared = False
+
+    def __contains__(self, device_id: str) -> bool:
+        return device_id in self._columns.rows
+
+    def __len__(self) -> int:
+        return len(self._columns.ids)
+
+    def update(
+        self, device_id: str, lat: float, lng: float, speed_kmh: float, online: bool, ts: float, vid: Optional[str]
+    ) -> bool:
+        """
+        Record a device's latest fix.
+
+        The GPS VID doubles as the plate number once reported.
+
+        Returns:
+            True if the device's VID changed (False for an untracked device)
+        """
+        with self._lock:
+            if device_id not in self._columns.rows:
+                return False  # removed while its poll was in flight
+            c = self._writable()
+            row = c.rows[device_id]
+            c.lat[row] = lat
+            c.lng[row] = lng
+            c.speed[row] = speed_kmh
+            c.online[row] = 1 if online else 0
+            c.last_update[row] = ts
+            self.writes += 1
+            if c.vid[row] == vid and c.plate[row] == vid:
+                return False
+            changed = c.vid[row] != vid
+            c.vid[row] = c.plate[row] = vid
+            return changed
+
+    def snapshot(self) -> LiveStateView:
+        """O(1) immutable view; the next write copies the columns first."""
+        with self._lock:
+            self._shared = True
+            return LiveStateView(self._columns)
+
+    def get(self, device_id: str) -> Optional[Dict]:
+        """One device's state, read under the lock without marking the columns shared."""
+        with self._lock:
+            return LiveStateView(self._columns).get(device_id)
+
+    def position(self, device_id: str) -> Optional[Tuple[float, float, float, bool]]:
+        """One device's `(lat, lng, speed_kmh, online)`, read under the lock."""
+        with self._lock:
+            return LiveStateView(self._columns).position(device_id)
+
+    def stats(self) -> Dict:
+        """Return device count, write/copy counters and column memory."""
+        c = self._columns
+        devices = len(c.ids)
+        return {
+            "devices": devices,
+            "writes": self.writes,
+            "copy_on_write": self.copies,
+            "column_bytes": c.nbytes(),
+        }
@@ -0,0 +1,180 @@
+"""
+Concurrent GPS Poller for Bus Tracking API
+
+Runs the per-device Fleet API calls of one poll cycle in parallel on a
+bounded thread pool, so a full refresh costs roughly one upstream round-trip
+instead of one round-trip per device.
+"""
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, List
+
+logger = logging.getLogger(__name__)
+
+
+class ConcurrentPoller:
+    """
+    Bounded-parallel poller with a per-cycle deadline.
+
+    Each call to `poll` submits one task per device to a shared thread pool
+    and waits at most `deadline` seconds. Devices whose task has not finished
+    by then are reported as late; their task keeps running and its update is
+    still applied whenever it lands, but it does not hold back the cycle.
+    A device that is still in flight from an earlier cycle is not submitted
+    again until that call returns.
+
+    Keys may also be comma-joined batches of device ids; the task then
+    returns how many of them it updated, and a batch counts as failed unless
+    all of them were.
+    """
+
+    def __init__(
+        self,
+        task: Callable[[str], bool],
+        max_workers: int = 16,
+        deadline: float = 8.0,
+        name: str = "gps-poller",
+    ):
+        """
+        Args:
+            task: Callable run once per key; returns True if the device was updated
+                (or, for a batch key, the number of devices updated)
+            max_workers: Maximum number of concurrent upstream calls
+            deadline: Seconds to wait for a cycle before reporting stragglers as late
+            name: Thread name prefix for the worker pool
+        """
+        self.task = task
+        self.max_workers = max(1, max_workers)
+        self.deadline = deadline
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix=name)
+        self._in_flight: Dict[str, float] = {}
+        self._lock = threading.Lock()
+        self.cycles = 0
+        self.dispatched = 0
+        self.last_cycle: Dict = {}
+
+    def _run(self, dev_id: str) -> int:
+        try:
+            return int(self.task(dev_id) or 0)
+        finally:
+            with self._lock:
+                self._in_flight.pop(dev_id, None)
+
+    def poll(self, device_ids: Iterable[str]) -> Dict:
+        """
+        Run one poll cycle over `device_ids`.
+
+        Args:
+            device_ids: Devices to poll in this cycle
+
+        Returns:
+            Summary dict with updated, failed, late and skipped device lists
+            plus the cycle duration in milliseconds
+        """
+        started = time.time()
+        futures = {}
+        skipped: List[str] = []
+
+        for dev_id in device_ids:
+            with self._lock:
+                if dev_id in self._in_flight:
+                    skipped.append(dev_id)
+                    continue
+                self._in_flight[dev_id] = started
+            futures[self._executor.submit(self._run, dev_id)] = dev_id
+
+        done, not_done = wait(futures, timeout=self.deadline)
+
+        updated: List[str] = []
+        failed: List[str] = []
+        updated_devices = 0
+        for future in done:
+            dev_id = futures[future]
+            try:
+                count = future.result()
+                updated_devices += count
+                if count >= dev_id.count(",") + 1:
+                    updated.append(dev_id)
+                else:
+                    failed.append(dev_id)
+            except Exception as e:
+                logger.error(f"Poll task failed for {dev_id}: {e}")
+                failed.append(dev_id)
+
+        late = [futures[future] for future in not_done]
+        duration_ms = (time.time() - started) * 1000
+
+        self.cycles += 1
+        self.last_cycle = {
+            "started_at": started,
+            "duration_ms": round(duration_ms, 2),
+            "updated": updated_devices,
+            "failed": failed,
+            "late": late,
+            "skipped": skipped,
+        }
+
+        if late:
+            logger.warning(f"GPS poll cycle missed {self.deadline}s deadline for {len(late)} device(s): {', '.join(late)}")
+        if skipped:
+            logger.warning(f"GPS poll skipped {len(skipped)} device(s) still in flight: {', '.join(skipped)}")
+        logger.debug(
+            f"GPS poll cycle: {updated_devices} device(s) updated, {len(failed)} failed, "
+            f"{len(late)} late in {duration_ms:.2f}ms"
+        )
+        return self.last_cycle
+
+    def dispatch(self, device_ids: Iterable[str], on_done: Callable[[str, bool], None]) -> List[str]:
+        """
+        Submit calls without waiting for them (no cycle, no deadline).
+
+        Args:
+            device_ids: Devices (or batch keys) to poll
+            on_done: Called on the worker thread with `(device_id, devices updated)` as each call finishes
+
+        Returns:
+            Devices not submitted because a call for them is still in flight
+        """
+        started = time.time()
+        skipped: List[str] = []
+        for dev_id in device_ids:
+            with self._lock:
+                if dev_id in self._in_flight:
+                    skipped.append(dev_id)
+                    continue
+                self._in_flight[dev_id] = started
+            future = self._executor.submit(self._run, dev_id)
+            future.add_done_callback(lambda f, dev_id=dev_id: self._finish(dev_id, f, on_done))
+            self.dispatched += 1
+        return skipped
+
+    @staticmethod
+    def _finish(dev_id: str, future, on_done: Callable[[str, bool], None]):
+        try:
+            updated = future.result()
+        except Exception as e:
+            logger.error(f"Poll task failed for {dev_id}: {e}")
+            updated = 0
+        try:
+            on_done(dev_id, updated)
+        except Exception as e:
+            logger.exception(f"Poll completion handler failed for {dev_id}: {e}")
+
+    def stats(self) -> Dict:
+        """Return poller configuration and the summary of the last cycle."""
+        with self._lock:
+            in_flight = len(self._in_flight)
+        return {
+            "max_workers": self.max_workers,
+            "deadline_seconds": self.deadline,
+            "cycles": self.cycles,
+            "dispatched": self.dispatched,
+            "in_flight": in_flight,
+            "last_cycle": self.last_cycle,
+        }
+
+    def shutdown(self):
+        """Stop accepting new work; running calls are left to finish."""
+        self._executor.shutdown(wait=False)
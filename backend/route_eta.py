@@ -0,0 +1,321 @@
+"""
+Stop ETA Engine for Bus Tracking API
+
+Turns live positions into "arrives at stop X in N minutes". Each route's
+stop sequence from Firestore (`routes/{routeId}.stops`, ordered by `order`)
+is precomputed once into a projected polyline with cumulative distances.
+On every GPS fix the bus is snapped to its route — searching only a few
+segments around its previous position — and ETAs are recomputed for the
+stops still ahead of it, using an exponentially smoothed along-route speed.
+
+Bus -> route assignments come from the `busAssignments` collection. Both
+collections are mirrored with Firestore snapshot listeners, like the bus
+index, so no Firestore reads happen on the GPS path.
+"""
+import logging
+import math
+import threading
+from bisect import bisect_right
+from typing import Dict, List, Optional, Set, Tuple
+
+logger = logging.getLogger(__name__)
+
+METERS_PER_DEGREE = 111320.0
+# Segments searched on either side of the last snapped segment before a full re-snap
+SNAP_WINDOW = 3
+# A stop counts as reached once the bus is this close along the route
+ARRIVAL_RADIUS_M = 30.0
+
+
+class RouteGeometry:
+    """Stop sequence of one route, projected to meters with cumulative distances."""
+
+    __slots__ = ("route_id", "name", "stops", "xs", "ys", "cum", "lat0", "lng0", "scale_x")
+
+    def __init__(self, route_id: str, data: Dict):
+        self.route_id = route_id
+        self.name = data.get("name")
+        stops = [
+            stop for stop in (data.get("stops") or [])
+            if stop.get("isActive", True) and stop.get("latitude") is not None and stop.get("longitude") is not None
+        ]
+        stops.sort(key=lambda stop: stop.get("order", 0))
+        self.stops = [
+            {"stop_id": str(stop.get("id")), "name": stop.get("name"), "order": stop.get("order")}
+            for stop in stops
+        ]
+        lats = [float(stop["latitude"]) for stop in stops]
+        lngs = [float(stop["longitude"]) for stop in stops]
+        self.lat0 = lats[0] if lats else 0.0
+        self.lng0 = lngs[0] if lngs else 0.0
+        self.scale_x = METERS_PER_DEGREE * math.cos(math.radians(self.lat0))
+        self.xs = [(lng - self.lng0) * self.scale_x for lng in lngs]
+        self.ys = [(lat - self.lat0) * METERS_PER_DEGREE for lat in lats]
+        self.cum = [0.0]
+        for i in range(1, len(stops)):
+            self.cum.append(self.cum[-1] + math.hypot(self.xs[i] - self.xs[i - 1], self.ys[i] - self.ys[i - 1]))
+
+    @property
+    def segments(self) -> int:
+        return max(0, len(self.stops) - 1)
+
+    def _project_segment(self, i: int, x: float, y: float) -> Tuple[float, float]:
+        """(distance from segment i, along-route distance of the closest point)."""
+        ax, ay = self.xs[i], self.ys[i]
+        dx, dy = self.xs[i + 1] - ax, self.ys[i + 1] - ay
+        length_sq = dx * dx + dy * dy
+        t = 0.0 if length_sq == 0 else max(0.0, min(1.0, ((x - ax) * dx + (y - ay) * dy) / length_sq))
+        px, py = ax + t * dx, ay + t * dy
+        return math.hypot(x - px, y - py), self.cum[i] + t * (self.cum[i + 1] - self.cum[i])
+
+    def snap(self, lat: float, lng: float, hint: Optional[int] = None) -> Tuple[int, float, float]:
+        """
+        Snap a position onto the route.
+
+        Args:
+            lat, lng: Position
+            hint: Segment the bus was last snapped to; only nearby segments are searched
+
+        Returns:
+            (segment index, along-route distance in meters, off-route distance in meters)
+        """
+        x = (lng - self.lng0) * self.scale_x
+        y = (lat - self.lat0) * METERS_PER_DEGREE
+        if hint is None:
+            candidates = range(self.segments)
+        else:
+            candidates = range(max(0, hint - SNAP_WINDOW), min(self.segments, hint + SNAP_WINDOW + 1))
+        best = (math.inf, 0.0, 0)
+        for i in candidates:
+            offset, along = self._project_segment(i, x, y)
+            if offset < best[0]:
+                best = (offset, along, i)
+        return best[2], best[1], best[0]
+
+
+class _BusProgress:
+    __slots__ = ("route_id", "segment", "along", "speed", "fixed_at", "off_route", "etas")
+
+    def __init__(self, route_id: str):
+        self.route_id = route_id
+        self.segment: Optional[int] = None
+        self.along = 0.0
+        self.speed: Optional[float] = None  # m/s
+        self.fixed_at = 0.0
+        self.off_route = False
+        self.etas: List[Dict] = []
+
+
+class EtaEngine:
+    """Per-bus route progress and downstream stop ETAs."""
+
+    def __init__(
+        self,
+        off_route_distance: float = 300.0,
+        smoothing: float = 0.3,
+        min_speed: float = 2.0,
+        default_speed: float = 5.5,
+    ):
+        """
+        Args:
+            off_route_distance: Meters from the route beyond which a bus has no ETAs
+            smoothing: EWMA weight of the newest speed sample (0..1)
+            min_speed: Speed floor in m/s so buses dwelling at a stop keep finite ETAs
+            default_speed: Speed in m/s assumed before a bus has any history (~20 km/h)
+        """
+        self.off_route_distance = off_route_distance
+        self.smoothing = smoothing
+        self.min_speed = min_speed
+        self.default_speed = default_speed
+
+        self._routes: Dict[str, RouteGeometry] = {}
+        self._assignments: Dict[str, Tuple[str, str]] = {}  # assignment doc id -> (bus id, route id)
+        self._bus_route: Dict[str, str] = {}
+        self._stop_routes: Dict[str, Set[str]] = {}
+        self._progress: Dict[str, _BusProgress] = {}
+        self._lock = threading.Lock()
+        self._watches: List = []
+
+        self.generation = 0  # bumped when routes or assignments change
+        self.updates = 0
+        self.resnaps = 0
+
+    # ------------------ FIRESTORE MIRROR ------------------
+
+    def start(self, routes_ref, assignments_ref):
+        """Attach snapshot listeners to the routes and busAssignments collections."""
+        if not self._watches:
+            self._watches.append(routes_ref.on_snapshot(self._listener(self.apply_route)))
+            self._watches.append(assignments_ref.on_snapshot(self._listener(self.apply_assignment)))
+            logger.info("✓ ETA engine listening for route and assignment changes")
+
+    def stop(self):
+        """Detach the listeners."""
+        for watch in self._watches:
+            watch.unsubscribe()
+        self._watches = []
+
+    @staticmethod
+    def _listener(apply):
+        def on_snapshot(docs, changes, read_time):
+            try:
+                for change in changes:
+                    apply(change.type.name, change.document.id, change.document.to_dict() or {})
+            except Exception as e:
+                logger.exception(f"ETA engine failed to apply snapshot: {e}")
+        return on_snapshot
+
+    def apply_route(self, kind: str, route_id: str, data: Optional[Dict] = None):
+        """Apply one `routes` document change ("ADDED", "MODIFIED" or "REMOVED")."""
+        geometry = RouteGeometry(route_id, data or {}) if kind != "REMOVED" else None
+        with self._lock:
+            old = self._routes.pop(route_id, None)
+            if old is not None:
+                for stop in old.stops:
+                    self._stop_routes.get(stop["stop_id"], set()).discard(route_id)
+            if geometry is not None and geometry.segments:
+                self._routes[route_id] = geometry
+                for stop in geometry.stops:
+                    self._stop_routes.setdefault(stop["stop_id"], set()).add(route_id)
+            # Stop sequence changed: buses on this route re-snap from scratch
+            for progress in self._progress.values():
+                if progress.route_id == route_id:
+                    progress.segment = None
+                    progress.etas = []
+            self.generation += 1
+
+    def apply_assignment(self, kind: str, doc_id: str, data: Optional[Dict] = None):
+        """Apply one `busAssignments` document change."""
+        with self._lock:
+            old = self._assignments.pop(doc_id, None)
+            if old is not None and self._bus_route.get(old[0]) == old[1]:
+                del self._bus_route[old[0]]
+                self._progress.pop(old[0], None)
+            data = data or {}
+            if kind != "REMOVED" and data.get("isActive", True) and data.get("busId") and data.get("routeId"):
+                bus_id, route_id = str(data["busId"]), str(data["routeId"])
+                self._assignments[doc_id] = (bus_id, route_id)
+                self._bus_route[bus_id] = route_id
+                progress = self._progress.get(bus_id)
+                if progress is not None and progress.route_id != route_id:
+                    del self._progress[bus_id]
+            self.generation += 1
+
+    # ------------------ GPS UPDATES ------------------
+
+    def update(self, device_id: str, lat: float, lng: float, speed_kmh: float, ts: float) -> bool:
+        """
+        Snap a new fix to the bus's route and refresh its downstream ETAs.
+
+        Costs O(snap window + stops ahead); a full route scan only happens on
+        the first fix, after a route change, or when the bus leaves the
+        searched window.
+
+        Returns:
+            True if the bus is on an assigned route
+        """
+        with self._lock:
+            route_id = self._bus_route.get(device_id)
+            route = self._routes.get(route_id) if route_id else None
+            if route is None:
+                self._progress.pop(device_id, None)
+                return False
+            progress = self._progress.get(device_id)
+            if progress is None or progress.route_id != route_id:
+                progress = self._progress[device_id] = _BusProgress(route_id)
+
+            segment, along, offset = route.snap(lat, lng, progress.segment)
+            if progress.segment is not None and offset > self.off_route_distance:
+                segment, along, offset = route.snap(lat, lng)
+                self.resnaps += 1
+            self.updates += 1
+
+            if offset > self.off_route_distance:
+                progress.off_route = True
+                progress.segment = None
+                progress.etas = []
+                return False
+
+            if progress.speed is None or progress.off_route:
+                progress.speed = speed_kmh / 3.6 if speed_kmh > 0 else self.default_speed
+            elif ts > progress.fixed_at:
+                sample = max(0.0, along - progress.along) / (ts - progress.fixed_at)
+                progress.speed += self.smoothing * (sample - progress.speed)
+            progress.off_route = False
+            progress.segment, progress.along, progress.fixed_at = segment, along, ts
+
+            speed = max(self.min_speed, progress.speed)
+            first = bisect_right(route.cum, along + ARRIVAL_RADIUS_M)
+            progress.etas = [
+                {
+                    **route.stops[i],
+                    "distance_m": round(route.cum[i] - along),
+                    "eta_s": round((route.cum[i] - along) / speed),
+                }
+                for i in range(first, len(route.stops))
+            ]
+            return True
+
+    def remove(self, device_id: str):
+        """Forget a bus's progress."""
+        with self._lock:
+            self._progress.pop(device_id, None)
+
+    # ------------------ QUERIES ------------------
+
+    def for_bus(self, device_id: str, limit: Optional[int] = None) -> Optional[Dict]:
+        """
+        A bus's route progress and upcoming stop ETAs.
+
+        Returns:
+            None if the bus has no assigned route
+        """
+        with self._lock:
+            route_id = self._bus_route.get(device_id)
+            if route_id is None:
+                return None
+            route = self._routes.get(route_id)
+            progress = self._progress.get(device_id)
+            etas = progress.etas if progress is not None else []
+            return {
+                "route_id": route_id,
+                "route_name": route.name if route is not None else None,
+                "off_route": progress.off_route if progress is not None else False,
+                "along_m": round(progress.along) if progress is not None and progress.segment is not None else None,
+                "speed_kmh": round(progress.speed * 3.6, 1) if progress is not None and progress.speed is not None else None,
+                "updated_at": progress.fixed_at if progress is not None else None,
+                "stops": etas[:limit] if limit is not None else list(etas),
+            }
+
+    def for_stop(self, stop_id: str) -> List[Dict]:
+        """Buses heading to a stop with their ETA, soonest first."""
+        found = []
+        with self._lock:
+            routes = self._stop_routes.get(stop_id, ())
+            for device_id, progress in self._progress.items():
+                if progress.route_id not in routes:
+                    continue
+                for eta in progress.etas:
+                    if eta["stop_id"] == stop_id:
+                        found.append({
+                            "device_id": device_id,
+                            "route_id": progress.route_id,
+                            "distance_m": eta["distance_m"],
+                            "eta_s": eta["eta_s"],
+                            "updated_at": progress.fixed_at,
+                        })
+                        break
+        found.sort(key=lambda item: item["eta_s"])
+        return found
+
+    def stats(self) -> Dict:
+        """Return route/assignment counts and update counters."""
+        with self._lock:
+            return {
+                "routes": len(self._routes),
+                "assigned_buses": len(self._bus_route),
+                "tracking": sum(1 for p in self._progress.values() if p.segment is not None),
+                "off_route": sum(1 for p in self._progress.values() if p.off_route),
+                "updates": self.updates,
+                "resnaps": self.resnaps,
+            }
@@ -0,0 +1,216 @@
+"""
+Adaptive GPS Poll Scheduler for Bus Tracking API
+
+Gives each device its own next-poll time based on how it is behaving:
+moving buses are polled every second or two, buses that have been parked
+for a while back off gradually, and offline devices are checked only every
+few minutes. A global token bucket caps upstream requests per second
+across the whole fleet.
+"""
+import heapq
+import math
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
+
+
+class TokenBucket:
+    """Simple token bucket; `rate` tokens per second, up to `burst` saved."""
+
+    def __init__(self, rate: float, burst: Optional[float] = None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1.0, rate)
+        self._tokens = self.burst
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def try_take(self, cost: float = 1.0) -> bool:
+        """Take `cost` tokens if available."""
+        self._refill(time.monotonic())
+        if self._tokens >= cost:
+            self._tokens -= cost
+            return True
+        return False
+
+
+class _DeviceState:
+    __slots__ = ("lat", "lng", "last_moved", "interval")
+
+    def __init__(self):
+        self.lat: Optional[float] = None
+        self.lng: Optional[float] = None
+        self.last_moved = 0.0
+        self.interval = 0.0
+
+
+class AdaptivePollScheduler:
+    """
+    Priority-queue scheduler of per-device poll times.
+
+    Intervals:
+        moving (online, speed >= `moving_speed`): `moving_interval`, shortened
+            further at higher speeds down to `min_interval`
+        stationary but moved within `settle_after` seconds: `idle_interval`
+        parked longer: doubles per `settle_after` period up to `parked_interval`
+        offline: `offline_interval`
+    """
+
+    def __init__(
+        self,
+        device_ids: List[str],
+        max_rps: float = 20.0,
+        min_interval: float = 1.0,
+        moving_interval: float = 2.0,
+        idle_interval: float = 5.0,
+        parked_interval: float = 300.0,
+        offline_interval: float = 120.0,
+        moving_speed: float = 3.0,
+        settle_after: float = 60.0,
+        move_threshold: float = 0.00005,
+    ):
+        """
+        Args:
+            device_ids: Devices to schedule (all start due immediately)
+            max_rps: Global upstream request budget per second
+            min_interval: Shortest interval for fast-moving buses
+            moving_interval: Interval for a bus moving at `moving_speed`
+            idle_interval: Interval for a stopped bus that moved recently
+            parked_interval: Longest interval for a long-parked bus
+            offline_interval: Interval for devices reported offline
+            moving_speed: Speed in km/h above which a bus counts as moving
+            settle_after: Seconds without movement before backing off beyond `idle_interval`
+            move_threshold: Coordinate change in degrees (~5 m) that counts as movement
+        """
+        self.min_interval = min_interval
+        self.moving_interval = moving_interval
+        self.idle_interval = idle_interval
+        self.parked_interval = parked_interval
+        self.offline_interval = offline_interval
+        self.moving_speed = moving_speed
+        self.settle_after = settle_after
+        self.move_threshold = move_threshold
+
+        self.budget = TokenBucket(max_rps)
+        self._heap: List[Tuple[float, str]] = []
+        self._due_at: Dict[str, float] = {}
+        self._state: Dict[str, _DeviceState] = {}
+        self._lock = threading.Lock()
+
+        self.dispatched = 0
+        self.throttled = 0
+        self.retries = 0
+
+        now = time.time()
+        for dev_id in device_ids:
+            self._state[dev_id] = _DeviceState()
+            self._push(dev_id, now)
+
+    def _push(self, dev_id: str, due: float):
+        self._due_at[dev_id] = due
+        heapq.heappush(self._heap, (due, dev_id))
+
+    def interval_for(self, state: _DeviceState, speed_kmh: float, online: bool, now: float) -> float:
+        """Compute the next poll interval for a device."""
+        if not online:
+            return self.offline_interval
+        if speed_kmh >= self.moving_speed:
+            # e.g. 2 s at walking pace, ~1 s at 50 km/h
+            scaled = self.moving_interval / max(1.0, math.log2(speed_kmh / self.moving_speed + 1))
+            return max(self.min_interval, scaled)
+        still_for = now - state.last_moved
+        if still_for < self.settle_after:
+            return self.idle_interval
+        periods = min(still_for / self.settle_after, 16.0)
+        return min(self.parked_interval, self.idle_interval * (2 ** periods))
+
+    def due(self, cost: float = 1.0) -> List[str]:
+        """
+        Pop devices that are due now, within the request budget.
+
+        Args:
+            cost: Budget tokens one device consumes (1/batch size in batch mode)
+
+        Returns:
+            Device ids to poll now
+        """
+        now = time.time()
+        ready = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due, dev_id = self._heap[0]
+                if self._due_at.get(dev_id) != due:
+                    heapq.heappop(self._heap)  # stale heap entry
+                    continue
+                if not self.budget.try_take(cost):
+                    self.throttled += 1
+                    break
+                heapq.heappop(self._heap)
+                del self._due_at[dev_id]
+                ready.append(dev_id)
+            self.dispatched += len(ready)
+        return ready
+
+    def observe(self, dev_id: str, lat: float, lng: float, speed_kmh: float, online: bool):
+        """Record a device's latest fix and schedule its next poll."""
+        now = time.time()
+        with self._lock:
+            state = self._state.setdefault(dev_id, _DeviceState())
+            if state.lat is None or (
+                abs(lat - state.lat) > self.move_threshold or abs(lng - state.lng) > self.move_threshold
+            ):
+                state.last_moved = now
+            state.lat, state.lng = lat, lng
+            state.interval = self.interval_for(state, speed_kmh, online, now)
+            self._push(dev_id, now + state.interval)
+
+    def retry(self, dev_id: str):
+        """Reschedule a device whose poll produced no fix, keeping its last known state."""
+        now = time.time()
+        with self._lock:
+            state = self._state.get(dev_id)
+            if state is None or dev_id in self._due_at:
+                return
+            self.retries += 1
+            self._push(dev_id, now + (state.interval or self.idle_interval))
+
+    def add(self, dev_id: str):
+        """Start scheduling a device, due immediately (no-op if already scheduled)."""
+        with self._lock:
+            if dev_id in self._state:
+                return
+            self._state[dev_id] = _DeviceState()
+            self._push(dev_id, time.time())
+
+    def remove(self, dev_id: str):
+        """Stop scheduling a device."""
+        with self._lock:
+            self._state.pop(dev_id, None)
+            self._due_at.pop(dev_id, None)
+
+    def seconds_until_next(self) -> Optional[float]:
+        """Seconds until the earliest scheduled poll (None if nothing is scheduled)."""
+        with self._lock:
+            while self._heap and self._due_at.get(self._heap[0][1]) != self._heap[0][0]:
+                heapq.heappop(self._heap)
+            if not self._heap:
+                return None
+            return max(0.0, self._heap[0][0] - time.time())
+
+    def stats(self) -> Dict:
+        """Return scheduled device counts by interval band and budget counters."""
+        with self._lock:
+            intervals = [s.interval for s in self._state.values() if s.interval]
+            return {
+                "devices": len(self._state),
+                "scheduled": len(self._due_at),
+                "max_rps": self.budget.rate,
+                "dispatched": self.dispatched,
+                "throttled": self.throttled,
+                "retries": self.retries,
+                "fast": sum(1 for i in intervals if i <= self.moving_interval),
+                "backed_off": sum(1 for i in intervals if i > self.idle_interval),
+                "mean_interval": round(sum(intervals) / len(intervals), 2) if intervals else None,
+            }
@@ -0,0 +1,459 @@
+"""
+Sharded GPS Poller for Bus Tracking API
+
+Splits the fleet across several poller processes so JSON decoding and
+status parsing are not limited by one interpreter's GIL. Devices are mapped
+to shards with a consistent-hash ring, so adding or removing a device (or a
+shard) only moves the devices that hash next to it. A `DEVICE_IDS` change
+picked up at runtime is applied with `set_devices`, which re-sends only the
+assignments that changed.
+
+Each shard is a separate `python -m shard_pool` process. The API process
+sends it JSON control lines on stdin (device assignment, current Fleet API
+session token) and the shard streams back length-prefixed binary frames on
+stdout:
+
+    F  position records (33 bytes each, devices referenced by index in the
+       shard's current assignment)
+    V  VID changes as a JSON object (rare)
+    X  a session token the Fleet API reported as expired
+
+The API process keeps the only Fleet API login: shards use the token it
+pushes and report expiry back instead of logging in themselves. A
+supervisor thread restarts shards that exit, with exponential backoff for
+shards that keep crashing, and re-sends their assignment.
+"""
+import bisect
+import hashlib
+import json
+import logging
+import os
+import struct
+import subprocess
+import sys
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Frame header: type byte + payload length
+FRAME = struct.Struct("<cI")
+# Position record: assignment index, ts, lat, lng (float64), speed (float32), online (uint8)
+RECORD = struct.Struct("<IdddfB")
+# Frame payloads start with the assignment generation they were packed against
+GENERATION = struct.Struct("<I")
+# Restart delay for a crashing shard doubles from the first to the second value
+RESTART_BACKOFF = (1.0, 60.0)
+# A shard that ran this long before exiting is restarted without delay
+STABLE_UPTIME = 60.0
+
+
+class HashRing:
+    """Consistent-hash ring over shard numbers, with virtual nodes for balance."""
+
+    def __init__(self, shards: int, replicas: int = 64):
+        self.shards = shards
+        points = sorted(
+            (self._hash(f"shard-{shard}-{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [h for h, _ in points]
+        self._owners = [shard for _, shard in points]
+
+    @staticmethod
+    def _hash(key: str) -> int:
+        return int.from_bytes(hashlib.md5(key.encode("utf-8")).digest()[:8], "big")
+
+    def shard_for(self, key: str) -> int:
+        """Shard owning `key`."""
+        i = bisect.bisect(self._hashes, self._hash(key)) % len(self._hashes)
+        return self._owners[i]
+
+    def assign(self, keys: Iterable[str]) -> Dict[int, List[str]]:
+        """Split `keys` by owning shard (every shard gets a list, possibly empty)."""
+        assignment: Dict[int, List[str]] = {shard: [] for shard in range(self.shards)}
+        for key in keys:
+            assignment[self.shard_for(key)].append(key)
+        return assignment
+
+
+class _Shard:
+    __slots__ = (
+        "index", "process", "assignment", "lock", "restarts", "frames", "records",
+        "started_at", "backoff", "restart_at",
+    )
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[subprocess.Popen] = None
+        # (generation, devices), replaced as a whole so the reader never sees a torn pair
+        self.assignment: Tuple[int, List[str]] = (0, [])
+        self.lock = threading.Lock()  # serializes writes to the shard's stdin
+        self.restarts = 0
+        self.frames = 0
+        self.records = 0
+        self.started_at = 0.0
+        self.backoff = 0.0  # current restart delay, 0 while the shard is stable
+        self.restart_at: Optional[float] = None  # when a dead shard will be respawned
+
+
+class ShardedPoller:
+    """Supervises the poller shard processes and applies their updates."""
+
+    def __init__(
+        self,
+        device_ids: List[str],
+        shards: int,
+        config: Dict,
+        on_fix: Callable[..., None],
+        on_vid: Optional[Callable[[str, str], None]] = None,
+        session=None,
+        check_interval: float = 1.0,
+    ):
+        """
+        Args:
+            device_ids: Devices to poll
+            shards: Number of poller processes
+            config: Shard settings passed to each process (see `run_shard`)
+            on_fix: Called with `(device_id, ts, lat, lng, speed_kmh, online, vid)` per position
+            on_vid: Called with `(device_id, vid)` when a device reports a new VID
+            session: FleetSessionManager whose token is pushed to the shards
+            check_interval: Seconds between supervisor health / session checks
+        """
+        self.ring = HashRing(max(1, shards))
+        self.config = config
+        self.on_fix = on_fix
+        self.on_vid = on_vid
+        self.session = session
+        self.check_interval = check_interval
+
+        self._shards = [_Shard(i) for i in range(self.ring.shards)]
+        self._devices = list(device_ids)
+        self._vids: Dict[str, str] = {}
+        self._assign_lock = threading.Lock()  # orders re-assignments from rebalancing and restarts
+        self._token: Optional[str] = None
+        self._wakeup = threading.Event()
+        self._supervisor: Optional[threading.Thread] = None
+        self._stopping = False
+
+    # ------------------ LIFECYCLE ------------------
+
+    def start(self):
+        """Spawn every shard and start the supervisor thread (idempotent)."""
+        if self._supervisor is not None:
+            return
+        with self._assign_lock:
+            for shard, devices in self.ring.assign(self._devices).items():
+                self._shards[shard].assignment = (0, devices)
+        for shard in self._shards:
+            self._spawn(shard)
+        self._supervisor = threading.Thread(target=self._supervise, daemon=True, name="shard-supervisor")
+        self._supervisor.start()
+        logger.info(f"Started {len(self._shards)} GPS poller shard(s) for {len(self._devices)} device(s)")
+
+    def shutdown(self):
+        """Stop every shard process."""
+        self._stopping = True
+        for shard in self._shards:
+            self._send(shard, {"type": "stop"})
+            if shard.process is not None:
+                try:
+                    shard.process.wait(timeout=2)
+                except subprocess.TimeoutExpired:
+                    shard.process.kill()
+
+    def _spawn(self, shard: _Shard):
+        shard.started_at = time.time()
+        shard.restart_at = None
+        shard.process = subprocess.Popen(
+            [sys.executable, "-m", "shard_pool", str(shard.index), json.dumps(self.config)],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            stdin=subprocess.PIPE,
+            stdout=subprocess.PIPE,
+        )
+        with self._assign_lock:
+            self._assign(shard, shard.assignment[1])
+        if self._token is not None:
+            self._send(shard, {"type": "session", "token": self._token})
+        threading.Thread(
+            target=self._read, args=(shard, shard.process), daemon=True, name=f"shard-{shard.index}-reader"
+        ).start()
+
+    # ------------------ REBALANCING ------------------
+
+    def set_devices(self, device_ids: List[str]):
+        """Re-split the fleet; only shards whose device list changed are re-assigned."""
+        with self._assign_lock:
+            self._devices = list(device_ids)
+            for index, devices in self.ring.assign(self._devices).items():
+                shard = self._shards[index]
+                current = shard.assignment[1]
+                if devices != current:
+                    moved = len(set(devices) ^ set(current))
+                    self._assign(shard, devices)
+                    logger.info(f"GPS poller shard {index} rebalanced: {len(devices)} device(s), {moved} moved")
+
+    def _assign(self, shard: _Shard, devices: List[str]):
+        generation = shard.assignment[0] + 1
+        shard.assignment = (generation, devices)
+        self._send(shard, {"type": "assign", "generation": generation, "devices": devices})
+
+    def _send(self, shard: _Shard, message: Dict):
+        with shard.lock:
+            process = shard.process
+            if process is None or process.poll() is not None:
+                return
+            try:
+                process.stdin.write(json.dumps(message).encode() + b"\n")
+                process.stdin.flush()
+            except (BrokenPipeError, OSError):
+                pass  # the supervisor restarts dead shards
+
+    def _supervise(self):
+        while not self._stopping:
+            self._push_session()
+            now = time.time()
+            for shard in self._shards:
+                if shard.process is None or shard.process.poll() is None:
+                    continue
+                if shard.restart_at is None:
+                    if now - shard.started_at >= STABLE_UPTIME:
+                        shard.backoff = 0.0
+                    else:
+                        shard.backoff = min(RESTART_BACKOFF[1], max(RESTART_BACKOFF[0], shard.backoff * 2))
+                    shard.restart_at = now + shard.backoff
+                    logger.error(
+                        f"GPS poller shard {shard.index} exited with code {shard.process.returncode}, "
+                        f"restarting in {shard.backoff:.0f}s"
+                    )
+                if now >= shard.restart_at:
+                    shard.restarts += 1
+                    self._spawn(shard)
+            self._wakeup.wait(self.check_interval)
+            self._wakeup.clear()
+
+    def _push_session(self):
+        if self.session is None:
+            return
+        try:
+            token = self.session.get()
+        except Exception as e:
+            logger.error(f"Cannot refresh Fleet API session for poller shards: {e}")
+            return
+        if token != self._token:
+            self._token = token
+            for shard in self._shards:
+                self._send(shard, {"type": "session", "token": token})
+
+    # ------------------ UPDATES ------------------
+
+    def _read(self, shard: _Shard, process: subprocess.Popen):
+        stream = process.stdout
+        try:
+            while True:
+                header = stream.read(FRAME.size)
+                if len(header) < FRAME.size:
+                    return  # shard exited
+                kind, length = FRAME.unpack(header)
+                payload = stream.read(length)
+                if len(payload) < length:
+                    return
+                self._handle(shard, kind, payload)
+        except Exception as e:
+            logger.exception(f"GPS poller shard {shard.index} reader failed: {e}")
+
+    def _handle(self, shard: _Shard, kind: bytes, payload: bytes):
+        if kind == b"F":
+            (generation,) = GENERATION.unpack_from(payload)
+            current, devices = shard.assignment
+            if generation != current:
+                return  # packed against an assignment that has since changed
+            shard.frames += 1
+            for index, ts, lat, lng, speed, online in RECORD.iter_unpack(memoryview(payload)[GENERATION.size:]):
+                if index < len(devices):
+                    dev_id = devices[index]
+                    self.on_fix(dev_id, ts, lat, lng, speed, bool(online), self._vids.get(dev_id))
+                    shard.records += 1
+        elif kind == b"V":
+            for dev_id, vid in json.loads(payload).items():
+                self._vids[dev_id] = vid
+                if self.on_vid is not None and vid:
+                    self.on_vid(dev_id, vid)
+        elif kind == b"X":
+            token = payload.decode()
+            if self.session is not None:
+                self.session.invalidate(token)
+            self._wakeup.set()
+
+    def stats(self) -> Dict:
+        """Return per-shard device counts, liveness and counters."""
+        return {
+            "shards": [
+                {
+                    "shard": shard.index,
+                    "pid": shard.process.pid if shard.process is not None else None,
+                    "alive": shard.process is not None and shard.process.poll() is None,
+                    "devices": len(shard.assignment[1]),
+                    "restarts": shard.restarts,
+                    "restart_in": round(max(0.0, shard.restart_at - time.time()), 1) if shard.restart_at else None,
+                    "frames": shard.frames,
+                    "records": shard.records,
+                }
+                for shard in self._shards
+            ],
+        }
+
+
+# ------------------ SHARD PROCESS ------------------
+
+class _RelayedSession:
+    """Session manager stand-in for a shard: the token comes from the API process."""
+
+    def __init__(self, expired_codes: Tuple[int, ...], report: Callable[[str], None]):
+        self.expired_codes = expired_codes
+        self._report = report
+        self._token: Optional[str] = None
+        self._cond = threading.Condition()
+
+    def set(self, token: str):
+        with self._cond:
+            self._token = token
+            self._cond.notify_all()
+
+    def get(self) -> str:
+        from fleet_session import FleetSessionUnavailable
+
+        with self._cond:
+            if not self._cond.wait_for(lambda: self._token is not None, timeout=10):
+                raise FleetSessionUnavailable("No Fleet API session from the API process")
+            return self._token
+
+    def is_expired(self, data: Dict) -> bool:
+        return isinstance(data, dict) and data.get("result") in self.expired_codes
+
+    def invalidate(self, token: Optional[str]):
+        with self._cond:
+            if token is None or token != self._token:
+                return
+            self._token = None
+        self._report(token)
+
+
+def run_shard(index: int, config: Dict):
+    """
+    Poll loop of one shard process.
+
+    Config keys: base_url, pool_size, default_timeout, timeouts,
+    expired_codes, batch_size, interval, concurrency, deadline.
+    """
+    from fleet_client import FleetApiClient, parse_device_status
+    from poller import ConcurrentPoller
+
+    out = sys.stdout.buffer
+    out_lock = threading.Lock()
+
+    def send(kind: bytes, payload: bytes):
+        with out_lock:
+            out.write(FRAME.pack(kind, len(payload)) + payload)
+            out.flush()
+
+    client = FleetApiClient(
+        config["base_url"],
+        pool_size=config.get("pool_size", 8),
+        default_timeout=config.get("default_timeout", 10),
+        timeouts=config.get("timeouts"),
+    )
+    session = _RelayedSession(tuple(config.get("expired_codes", (7,))), lambda token: send(b"X", token.encode()))
+    client.session_manager = session
+
+    # (generation, devices, device -> row), swapped as one tuple so the poll loop
+    # never packs records of one generation against another's rows
+    assignment: Tuple[int, List[str], Dict[str, int]] = (0, [], {})
+    stopped = threading.Event()
+
+    def control():
+        nonlocal assignment
+        for line in sys.stdin.buffer:
+            message = json.loads(line)
+            if message["type"] == "assign":
+                devices = message["devices"]
+                assignment = (message["generation"], devices, {dev_id: i for i, dev_id in enumerate(devices)})
+            elif message["type"] == "session":
+                session.set(message["token"])
+            elif message["type"] == "stop":
+                break
+        stopped.set()  # stdin closed or stop requested: the API process is done with us
+
+    threading.Thread(target=control, daemon=True, name="shard-control").start()
+
+    fixes: List[Tuple] = []
+    vids: Dict[str, str] = {}
+    changed_vids: Dict[str, str] = {}
+    results_lock = threading.Lock()
+
+    def collect(dev_id: str, status: Dict) -> bool:
+        lat, lng, speed, online, vid = parse_device_status(status)
+        with results_lock:
+            if vid and vids.get(dev_id) != vid:
+                vids[dev_id] = changed_vids[dev_id] = vid
+            if lat != 0 and lng != 0:
+                fixes.append((dev_id, time.time(), lat, lng, speed, online))
+                return True
+        return False
+
+    def fetch(key: str) -> int:
+        """Poll one device or batch key; returns the number of devices with a fix."""
+        data = client.request("StandardApiAction_getDeviceStatus.action", {"devIdno": key, "toMap": 1, "language": "en"})
+        if data.get("result") != 0 or not isinstance(data.get("status"), list):
+            if "," in key:
+                return sum(fetch(dev_id) for dev_id in key.split(","))
+            return 0
+        wanted = set(key.split(","))
+        updated = 0
+        for status in data["status"]:
+            dev_id = str(status.get("id") or "")
+            if dev_id in wanted:
+                wanted.discard(dev_id)
+                updated += collect(dev_id, status)
+        if "," in key and wanted:
+            updated += sum(fetch(dev_id) for dev_id in wanted)
+        return updated
+
+    poller = ConcurrentPoller(
+        fetch, max_workers=config.get("concurrency", 8), deadline=config.get("deadline", 8.0), name=f"shard-{index}"
+    )
+    batch_size = max(1, config.get("batch_size", 1))
+    interval = config.get("interval", 5.0)
+
+    while not stopped.is_set():
+        cycle_start = time.time()
+        generation, devices, rows = assignment
+        if devices:
+            keys = [",".join(devices[i:i + batch_size]) for i in range(0, len(devices), batch_size)]
+            poller.poll(keys)
+            with results_lock:
+                batch = list(fixes)
+                fixes.clear()
+                new_vids = dict(changed_vids)
+                changed_vids.clear()
+            if new_vids:
+                send(b"V", json.dumps(new_vids).encode())
+            if batch:
+                payload = bytearray(GENERATION.pack(generation))
+                for dev_id, ts, lat, lng, speed, online in batch:
+                    row = rows.get(dev_id)
+                    if row is not None:
+                        payload += RECORD.pack(row, ts, lat, lng, speed, 1 if online else 0)
+                send(b"F", bytes(payload))
+        stopped.wait(max(0.0, interval - (time.time() - cycle_start)))
+    poller.shutdown()
+    client.close()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(
+        level=logging.INFO, stream=sys.stderr, format=f"%(asctime)s - shard {sys.argv[1]} - %(levelname)s - %(message)s"
+    )
+    run_shard(int(sys.argv[1]), json.loads(sys.argv[2]))
@@ -0,0 +1,299 @@
+"""
+Live State Snapshots for Bus Tracking API
+
+Builds the fleet payload once per state change and keeps the encoded JSON,
+so every HTTP request and WebSocket client reuses the same bytes instead of
+rebuilding and re-serializing the list for each reader.
+"""
+import asyncio
+import json
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional
+
+
+class VersionCounter:
+    """Monotonic, thread-safe counter bumped whenever live state changes."""
+
+    def __init__(self):
+        self._value = 0
+        self._lock = threading.Lock()
+
+    def bump(self) -> int:
+        """Increment the version and return the new value."""
+        with self._lock:
+            self._value += 1
+            return self._value
+
+    @property
+    def value(self) -> int:
+        return self._value
+
+
+class StateSignal:
+    """
+    Wakes asyncio waiters when a VersionCounter moves.
+
+    `publish` may be called from any thread (e.g. the GPS poller); the wakeup
+    is marshalled onto the bound event loop with `call_soon_threadsafe`, and
+    at most one wakeup is scheduled at a time.
+    """
+
+    def __init__(self, counter: VersionCounter):
+        self.counter = counter
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._event: Optional[asyncio.Event] = None
+        self._scheduled = False
+        self.notifications = 0
+
+    def bind(self, loop: asyncio.AbstractEventLoop):
+        """Attach the event loop whose waiters should be woken."""
+        self._loop = loop
+        self._event = asyncio.Event()
+
+    def publish(self) -> int:
+        """Bump the version and wake waiters; returns the new version."""
+        version = self.counter.bump()
+        loop = self._loop
+        if loop is not None and not self._scheduled:
+            self._scheduled = True
+            try:
+                loop.call_soon_threadsafe(self._wake)
+            except RuntimeError:
+                # Event loop already closed (shutdown)
+                self._scheduled = False
+        return version
+
+    def _wake(self):
+        self._scheduled = False
+        self.notifications += 1
+        self._event.set()
+
+    async def wait(self, seen: int, timeout: Optional[float] = None) -> bool:
+        """
+        Wait until the version differs from `seen`.
+
+        Args:
+            seen: Version the caller last acted on
+            timeout: Maximum seconds to wait
+
+        Returns:
+            True if the version changed, False on timeout
+        """
+        while self.counter.value == seen:
+            self._event.clear()
+            if self.counter.value != seen:
+                break
+            try:
+                await asyncio.wait_for(self._event.wait(), timeout)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+
+def is_newer(version: Hashable, current: Optional[Hashable]) -> bool:
+    """
+    True if `version` is later than `current`.
+
+    Versions are monotonic counters or tuples of them (e.g. state version plus
+    cache generations); a tuple is newer when any of its counters moved ahead.
+    Encoders use this to ignore a snapshot that was fetched before an await
+    and handed over after a newer one had already been encoded.
+    """
+    if current is None:
+        return True
+    if isinstance(version, tuple) and isinstance(current, tuple):
+        return any(a > b for a, b in zip(version, current))
+    return version > current
+
+
+class Snapshot:
+    """An immutable, pre-encoded view of the payload at one version."""
+
+    __slots__ = ("version", "data", "text", "body", "built_at")
+
+    def __init__(self, version: Hashable, data: Any):
+        self.version = version
+        self.data = data
+        self.text = json.dumps(data)
+        self.body = self.text.encode("utf-8")
+        self.built_at = time.time()
+
+
+class SnapshotCache:
+    """
+    Lazily rebuilt snapshot keyed by a version function.
+
+    `get` returns the cached snapshot while `version()` is unchanged and
+    rebuilds it (once, under a lock) the first time a reader sees a new one.
+    """
+
+    def __init__(self, build: Callable[[], Any], version: Callable[[], Hashable]):
+        """
+        Args:
+            build: Function returning the JSON-serializable payload
+            version: Function returning the current state version
+        """
+        self.build = build
+        self.version = version
+        self._snapshot: Optional[Snapshot] = None
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.reads = 0
+
+    def get(self) -> Snapshot:
+        """Return the snapshot for the current version, rebuilding if stale."""
+        self.reads += 1
+        version = self.version()
+        snapshot = self._snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+
+        with self._lock:
+            snapshot = self._snapshot
+            if snapshot is None or snapshot.version != version:
+                snapshot = Snapshot(version, self.build())
+                self._snapshot = snapshot
+                self.builds += 1
+            return snapshot
+
+    def stats(self) -> Dict:
+        """Return build/read counters and the current snapshot size."""
+        snapshot = self._snapshot
+        return {
+            "builds": self.builds,
+            "reads": self.reads,
+            "version": snapshot.version if snapshot else None,
+            "bytes": len(snapshot.body) if snapshot else 0,
+        }
+
+
+def diff_entry(old: Dict, new: Dict) -> Dict:
+    """
+    Return the fields of `new` that differ from `old`.
+
+    Nested dicts (such as `gps`) are diffed one level deep so a moving bus
+    only ships its changed coordinates rather than the whole sub-object.
+    Keys present in `old` but gone from `new` are listed under
+    `removed_fields`, nested ones as `"parent.key"` (e.g. a dropped `eta`).
+    """
+    changes = {}
+    removed = [key for key in old if key not in new]
+    for key, value in new.items():
+        old_value = old.get(key)
+        if value == old_value and key in old:
+            continue
+        if isinstance(value, dict) and isinstance(old_value, dict):
+            nested = {
+                k: v for k, v in value.items()
+                if k not in old_value or old_value[k] != v
+            }
+            if nested:
+                changes[key] = nested
+            removed.extend(f"{key}.{k}" for k in old_value if k not in value)
+        else:
+            changes[key] = value
+    if removed:
+        changes["removed_fields"] = removed
+    return changes
+
+
+class DeltaFrame:
+    """Full and delta encodings of one sequence number."""
+
+    __slots__ = ("seq", "full_text", "delta_text", "changes", "removed")
+
+    def __init__(
+        self,
+        seq: int,
+        full_text: str,
+        delta_text: Optional[str],
+        changes: Optional[List[Dict]],
+        removed: Optional[List[Any]],
+    ):
+        self.seq = seq
+        self.full_text = full_text
+        self.delta_text = delta_text
+        self.changes = changes
+        self.removed = removed
+
+
+class DeltaEncoder:
+    """
+    Turns successive fleet snapshots into sequenced delta frames.
+
+    Each snapshot that differs from the previous one gets the next sequence
+    number. `delta_text` carries only the changed entries (keyed by
+    `key_field`) and is valid for clients that already hold `seq - 1`;
+    `full_text` is a complete snapshot for new or resyncing clients.
+    """
+
+    def __init__(self, key_field: str = "device_id"):
+        self.key_field = key_field
+        self.seq = 0
+        self._version: Optional[Hashable] = None
+        self._entries: Dict[Any, Dict] = {}
+        self._frame: Optional[DeltaFrame] = None
+        self._lock = threading.Lock()
+
+    def advance(self, snapshot: Snapshot) -> DeltaFrame:
+        """
+        Fold `snapshot` into the sequence and return the current frame.
+
+        Args:
+            snapshot: Latest fleet snapshot (its data must be a list of entries)
+
+        Returns:
+            DeltaFrame for the current sequence number
+        """
+        with self._lock:
+            if self._frame is not None and not is_newer(snapshot.version, self._version):
+                return self._frame  # same or older snapshot: never step the sequence back
+
+            entries = {entry[self.key_field]: entry for entry in snapshot.data}
+            changed = []
+            for key, entry in entries.items():
+                old = self._entries.get(key)
+                if old is None:
+                    changed.append(entry)
+                    continue
+                changes = diff_entry(old, entry)
+                if changes:
+                    changes[self.key_field] = key
+                    changed.append(changes)
+            removed = [key for key in self._entries if key not in entries]
+
+            self._version = snapshot.version
+            self._entries = entries
+            if self._frame is not None and not changed and not removed:
+                # Same content under a new version: keep the sequence number but
+                # serve this snapshot's text to clients that join now
+                frame = self._frame
+                self._frame = DeltaFrame(
+                    frame.seq,
+                    f'{{"type": "snapshot", "seq": {frame.seq}, "data": {snapshot.text}}}',
+                    frame.delta_text,
+                    frame.changes,
+                    frame.removed,
+                )
+                return self._frame
+
+            self.seq += 1
+            full_text = f'{{"type": "snapshot", "seq": {self.seq}, "data": {snapshot.text}}}'
+            delta_text = None
+            has_base = self._frame is not None
+            if has_base:
+                delta_text = json.dumps({
+                    "type": "delta",
+                    "seq": self.seq,
+                    "changed": changed,
+                    "removed": removed,
+                })
+            self._frame = DeltaFrame(
+                self.seq,
+                full_text,
+                delta_text,
+                changed if has_base else None,
+                removed if has_base else None,
+            )
+            return self._frame
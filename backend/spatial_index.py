@@ -0,0 +1,204 @@
+"""
+Spatial Index for Bus Tracking API
+
+Uniform lat/lng grid over the latest bus positions, updated incrementally
+by the poller (a bus only changes buckets when it crosses a cell edge).
+Radius and bounding-box queries visit just the cells overlapping the
+query; k-nearest queries search outward ring by ring and stop as soon as
+no unvisited cell can hold a closer bus, so query cost depends on local
+density rather than fleet size.
+"""
+import heapq
+import math
+import threading
+from collections import defaultdict
+from typing import Dict, List, Optional, Set, Tuple
+
+# Grid cell size in degrees (~1.1 km of latitude)
+DEFAULT_CELL_SIZE = 0.01
+EARTH_RADIUS_M = 6371000.0
+METERS_PER_DEGREE = 111320.0
+
+
+def haversine_m(lat1: float, lng1: float, lat2: float, lng2: float) -> float:
+    """Great-circle distance in meters."""
+    p1, p2 = math.radians(lat1), math.radians(lat2)
+    dp = p2 - p1
+    dl = math.radians(lng2 - lng1)
+    a = math.sin(dp / 2) ** 2 + math.cos(p1) * math.cos(p2) * math.sin(dl / 2) ** 2
+    return 2 * EARTH_RADIUS_M * math.asin(min(1.0, math.sqrt(a)))
+
+
+class SpatialIndex:
+    """Thread-safe grid index of device positions."""
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        """
+        Args:
+            cell_size: Grid cell edge in degrees
+        """
+        self.cell_size = cell_size
+        self._cells: Dict[Tuple[int, int], Set[str]] = defaultdict(set)
+        self._positions: Dict[str, Tuple[float, float, Tuple[int, int]]] = {}
+        self._lock = threading.Lock()
+        self.updates = 0
+        self.moves = 0
+        self.queries = 0
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return int(math.floor(lat / self.cell_size)), int(math.floor(lng / self.cell_size))
+
+    def __len__(self) -> int:
+        return len(self._positions)
+
+    def update(self, device_id: str, lat: float, lng: float):
+        """Record a device's position, moving it between cells if needed."""
+        cell = self._cell(lat, lng)
+        with self._lock:
+            previous = self._positions.get(device_id)
+            if previous is not None and previous[2] != cell:
+                self._discard(device_id, previous[2])
+                self.moves += 1
+            if previous is None or previous[2] != cell:
+                self._cells[cell].add(device_id)
+            self._positions[device_id] = (lat, lng, cell)
+            self.updates += 1
+
+    def remove(self, device_id: str):
+        """Drop a device from the index."""
+        with self._lock:
+            previous = self._positions.pop(device_id, None)
+            if previous is not None:
+                self._discard(device_id, previous[2])
+
+    def _discard(self, device_id: str, cell: Tuple[int, int]):
+        members = self._cells.get(cell)
+        if members is not None:
+            members.discard(device_id)
+            if not members:
+                del self._cells[cell]
+
+    def _bbox_ids(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[str]:
+        """Device ids inside a bounding box (caller holds the lock)."""
+        lo_r, lo_c = self._cell(min_lat, min_lng)
+        hi_r, hi_c = self._cell(max_lat, max_lng)
+        if (hi_r - lo_r + 1) * (hi_c - lo_c + 1) > len(self._cells):
+            # Box covers more cells than are occupied: walk the occupied ones
+            cells = [
+                members for (r, c), members in self._cells.items()
+                if lo_r <= r <= hi_r and lo_c <= c <= hi_c
+            ]
+        else:
+            cells = [
+                self._cells[(r, c)]
+                for r in range(lo_r, hi_r + 1)
+                for c in range(lo_c, hi_c + 1)
+                if (r, c) in self._cells
+            ]
+        found = []
+        for members in cells:
+            for device_id in members:
+                lat, lng, _ = self._positions[device_id]
+                if min_lat <= lat <= max_lat and min_lng <= lng <= max_lng:
+                    found.append(device_id)
+        return found
+
+    def within_bbox(self, min_lat: float, min_lng: float, max_lat: float, max_lng: float) -> List[str]:
+        """Device ids inside a bounding box."""
+        with self._lock:
+            self.queries += 1
+            return self._bbox_ids(min_lat, min_lng, max_lat, max_lng)
+
+    def within_radius(self, lat: float, lng: float, radius_m: float) -> List[Tuple[str, float]]:
+        """
+        Devices within `radius_m` meters of a point.
+
+        Returns:
+            `(device_id, distance_m)` pairs, nearest first
+        """
+        dlat = radius_m / METERS_PER_DEGREE
+        dlng = radius_m / (METERS_PER_DEGREE * max(0.01, math.cos(math.radians(lat))))
+        found = []
+        with self._lock:
+            self.queries += 1
+            for device_id in self._bbox_ids(lat - dlat, lng - dlng, lat + dlat, lng + dlng):
+                p_lat, p_lng, _ = self._positions[device_id]
+                distance = haversine_m(lat, lng, p_lat, p_lng)
+                if distance <= radius_m:
+                    found.append((device_id, distance))
+        found.sort(key=lambda item: item[1])
+        return found
+
+    def nearest(self, lat: float, lng: float, k: int = 5, max_radius_m: Optional[float] = None) -> List[Tuple[str, float]]:
+        """
+        The `k` devices nearest to a point.
+
+        Cells are searched in square rings around the query cell; after ring
+        `r` every unvisited device is at least `r` cell widths away, so the
+        search stops once the k-th best distance is within that bound. Once
+        a ring would be larger than the set of occupied cells, the remaining
+        occupied cells are scanned directly instead.
+
+        Returns:
+            `(device_id, distance_m)` pairs, nearest first
+        """
+        if k <= 0:
+            return []
+        row, col = self._cell(lat, lng)
+        best: List[Tuple[float, str]] = []  # max-heap of (-distance, device_id)
+
+        def consider(members: Set[str]):
+            for device_id in members:
+                p_lat, p_lng, _ = self._positions[device_id]
+                distance = haversine_m(lat, lng, p_lat, p_lng)
+                if max_radius_m is not None and distance > max_radius_m:
+                    continue
+                if len(best) < k:
+                    heapq.heappush(best, (-distance, device_id))
+                elif distance < -best[0][0]:
+                    heapq.heapreplace(best, (-distance, device_id))
+
+        with self._lock:
+            self.queries += 1
+            remaining = len(self._positions)
+            ring = 0
+            while remaining > 0:
+                if 8 * ring > len(self._cells):
+                    for (r, c), members in self._cells.items():
+                        if max(abs(r - row), abs(c - col)) >= ring:
+                            consider(members)
+                    break
+                if ring == 0:
+                    ring_cells = [(row, col)]
+                else:
+                    top, bottom = row - ring, row + ring
+                    ring_cells = [(top, c) for c in range(col - ring, col + ring + 1)]
+                    ring_cells += [(bottom, c) for c in range(col - ring, col + ring + 1)]
+                    ring_cells += [(r, col - ring) for r in range(top + 1, bottom)]
+                    ring_cells += [(r, col + ring) for r in range(top + 1, bottom)]
+                for cell in ring_cells:
+                    members = self._cells.get(cell)
+                    if members:
+                        remaining -= len(members)
+                        consider(members)
+                # Narrowest cell width (in meters) anywhere inside the searched square
+                widest_lat = min(89.9, abs(lat) + (ring + 1) * self.cell_size)
+                bound = ring * self.cell_size * METERS_PER_DEGREE * math.cos(math.radians(widest_lat))
+                if len(best) == k and -best[0][0] <= bound:
+                    break
+                if max_radius_m is not None and bound > max_radius_m:
+                    break
+                ring += 1
+        return sorted(((device_id, -neg) for neg, device_id in best), key=lambda item: item[1])
+
+    def stats(self) -> Dict:
+        """Return indexed devices, occupied cells and counters."""
+        with self._lock:
+            return {
+                "devices": len(self._positions),
+                "cells": len(self._cells),
+                "cell_size_deg": self.cell_size,
+                "updates": self.updates,
+                "cell_moves": self.moves,
+                "queries": self.queries,
+            }
@@ -0,0 +1,244 @@
+"""
+WebSocket Subscriptions for Bus Tracking API
+
+Lets a `/ws/live` client narrow its feed to specific devices, vehicle
+aliases (VID / plate) or a lat/lng bounding box. Subscriptions are indexed
+by device id, normalized alias and grid cell, so matching a snapshot costs
+one pass over the fleet plus the matches, not one pass per client.
+"""
+import json
+import math
+import threading
+from collections import defaultdict
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Set, Tuple
+
+from alias_index import normalize_alias
+
+# Grid cell size in degrees for bounding-box subscriptions (~5.5 km of latitude)
+DEFAULT_CELL_SIZE = 0.05
+# Boxes covering more cells than this are checked against every device instead
+MAX_INDEXED_CELLS = 400
+
+
+class Subscription:
+    """What one client asked to receive."""
+
+    __slots__ = ("device_ids", "aliases", "bbox", "sent_ids")
+
+    def __init__(self, device_ids: Set[str], aliases: Set[str], bbox: Optional[Tuple[float, float, float, float]]):
+        self.device_ids = device_ids
+        self.aliases = aliases
+        self.bbox = bbox  # (min_lat, min_lng, max_lat, max_lng)
+        self.sent_ids: Set[str] = set()  # devices the client currently holds (delta protocol)
+
+    def contains(self, lat: float, lng: float) -> bool:
+        min_lat, min_lng, max_lat, max_lng = self.bbox
+        return min_lat <= lat <= max_lat and min_lng <= lng <= max_lng
+
+
+def parse_bbox(value: Any) -> Optional[Tuple[float, float, float, float]]:
+    """
+    Parse a `[min_lat, min_lng, max_lat, max_lng]` list.
+
+    Raises:
+        ValueError: If the box is malformed
+    """
+    if value is None:
+        return None
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        raise ValueError("bbox must be [min_lat, min_lng, max_lat, max_lng]")
+    min_lat, min_lng, max_lat, max_lng = (float(v) for v in value)
+    if min_lat > max_lat or min_lng > max_lng:
+        raise ValueError("bbox minimums must not exceed maximums")
+    return min_lat, min_lng, max_lat, max_lng
+
+
+class SubscriptionIndex:
+    """
+    Indexes client subscriptions for fast per-snapshot matching.
+
+    Snapshot entries are expected in the fleet payload shape
+    (`device_id`, `plate_number`, `gps.vid`, `gps.latitude`, `gps.longitude`).
+    """
+
+    def __init__(self, cell_size: float = DEFAULT_CELL_SIZE):
+        self.cell_size = cell_size
+        self._subs: Dict[Hashable, Subscription] = {}
+        self._by_device: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._by_alias: Dict[str, Set[Hashable]] = defaultdict(set)
+        self._by_cell: Dict[Tuple[int, int], Set[Hashable]] = defaultdict(set)
+        self._wide: Set[Hashable] = set()
+        self._version = 0
+        self._lock = threading.Lock()
+
+        self._match_key: Optional[Tuple] = None
+        self._matches: Dict[Hashable, List[Dict]] = {}
+        self._encoded: Dict[Tuple[str, ...], str] = {}
+
+    def __contains__(self, client: Hashable) -> bool:
+        return client in self._subs
+
+    def __len__(self) -> int:
+        return len(self._subs)
+
+    def _cell(self, lat: float, lng: float) -> Tuple[int, int]:
+        return math.floor(lat / self.cell_size), math.floor(lng / self.cell_size)
+
+    def _cells(self, bbox: Tuple[float, float, float, float]) -> Optional[List[Tuple[int, int]]]:
+        lo_lat, lo_lng = self._cell(bbox[0], bbox[1])
+        hi_lat, hi_lng = self._cell(bbox[2], bbox[3])
+        if (hi_lat - lo_lat + 1) * (hi_lng - lo_lng + 1) > MAX_INDEXED_CELLS:
+            return None
+        return [(i, j) for i in range(lo_lat, hi_lat + 1) for j in range(lo_lng, hi_lng + 1)]
+
+    def subscribe(
+        self,
+        client: Hashable,
+        device_ids: Iterable[str] = (),
+        aliases: Iterable[Any] = (),
+        bbox: Optional[Tuple[float, float, float, float]] = None,
+    ):
+        """
+        Replace `client`'s subscription.
+
+        Args:
+            client: Subscriber key (the WebSocket)
+            device_ids: Raw device ids to receive
+            aliases: VIDs / plates / ERP ids to receive
+            bbox: Optional (min_lat, min_lng, max_lat, max_lng) box
+        """
+        sub = Subscription(
+            {str(d) for d in device_ids},
+            {a for a in (normalize_alias(a) for a in aliases) if a},
+            bbox,
+        )
+        with self._lock:
+            self._remove(client)
+            self._subs[client] = sub
+            for dev_id in sub.device_ids:
+                self._by_device[dev_id].add(client)
+            for alias in sub.aliases:
+                self._by_alias[alias].add(client)
+            if bbox is not None:
+                cells = self._cells(bbox)
+                if cells is None:
+                    self._wide.add(client)
+                else:
+                    for cell in cells:
+                        self._by_cell[cell].add(client)
+            self._version += 1
+
+    def unsubscribe(self, client: Hashable):
+        """Drop `client`'s subscription so it receives the full fleet again."""
+        with self._lock:
+            if self._remove(client):
+                self._version += 1
+
+    def _remove(self, client: Hashable) -> bool:
+        sub = self._subs.pop(client, None)
+        if sub is None:
+            return False
+        for dev_id in sub.device_ids:
+            self._discard(self._by_device, dev_id, client)
+        for alias in sub.aliases:
+            self._discard(self._by_alias, alias, client)
+        if sub.bbox is not None:
+            self._wide.discard(client)
+            for cell in self._cells(sub.bbox) or []:
+                self._discard(self._by_cell, cell, client)
+        return True
+
+    @staticmethod
+    def _discard(index: Dict, key: Hashable, client: Hashable):
+        clients = index.get(key)
+        if clients is not None:
+            clients.discard(client)
+            if not clients:
+                del index[key]
+
+    def match(self, snapshot: Any) -> Dict[Hashable, List[Dict]]:
+        """
+        Return the entries of `snapshot` each subscribed client should receive.
+
+        Results are cached until the snapshot version or the subscriptions change.
+        """
+        with self._lock:
+            key = (snapshot.version, self._version)
+            if key == self._match_key:
+                return self._matches
+
+            matches: Dict[Hashable, List[Dict]] = defaultdict(list)
+            for entry in snapshot.data:
+                clients = set(self._by_device.get(entry["device_id"], ()))
+                gps = entry.get("gps") or {}
+                for alias in (normalize_alias(gps.get("vid")), normalize_alias(entry.get("plate_number"))):
+                    if alias:
+                        clients.update(self._by_alias.get(alias, ()))
+
+                lat, lng = gps.get("latitude"), gps.get("longitude")
+                if lat is not None and lng is not None:
+                    for client in self._by_cell.get(self._cell(lat, lng), ()):
+                        if client not in clients and self._subs[client].contains(lat, lng):
+                            clients.add(client)
+                    for client in self._wide:
+                        if client not in clients and self._subs[client].contains(lat, lng):
+                            clients.add(client)
+
+                for client in clients:
+                    matches[client].append(entry)
+
+            self._match_key = key
+            self._matches = matches
+            self._encoded = {}
+            return matches
+
+    def encode(self, snapshot: Any, client: Hashable) -> str:
+        """Return `client`'s filtered fleet array, encoded once per distinct device set."""
+        entries = self.match(snapshot).get(client, [])
+        ids = tuple(entry["device_id"] for entry in entries)
+        with self._lock:
+            text = self._encoded.get(ids)
+            if text is None:
+                text = self._encoded[ids] = json.dumps(entries)
+        return text
+
+    def full_frame(self, snapshot: Any, client: Hashable, seq: int) -> str:
+        """Sequenced snapshot frame restricted to `client`'s matches."""
+        entries = self.match(snapshot).get(client, [])
+        sub = self._subs.get(client)
+        if sub is not None:
+            sub.sent_ids = {entry["device_id"] for entry in entries}
+        return json.dumps({"type": "snapshot", "seq": seq, "data": entries})
+
+    def delta_frame(self, snapshot: Any, client: Hashable, frame: Any) -> str:
+        """
+        Sequenced delta frame restricted to `client`'s matches.
+
+        Devices that newly entered the subscription (e.g. drove into the box)
+        are sent in full; devices that left it are listed as removed.
+        """
+        entries = self.match(snapshot).get(client, [])
+        sub = self._subs.get(client)
+        previous = sub.sent_ids if sub is not None else set()
+        current = {entry["device_id"] for entry in entries}
+
+        changed = [entry for entry in entries if entry["device_id"] not in previous]
+        changed.extend(
+            change for change in frame.changes
+            if change["device_id"] in current and change["device_id"] in previous
+        )
+        removed = [dev_id for dev_id in previous if dev_id not in current]
+        if sub is not None:
+            sub.sent_ids = current
+        return json.dumps({"type": "delta", "seq": frame.seq, "changed": changed, "removed": removed})
+
+    def stats(self) -> Dict:
+        """Return subscriber and index sizes."""
+        with self._lock:
+            return {
+                "subscribed_clients": len(self._subs),
+                "indexed_devices": len(self._by_device),
+                "indexed_aliases": len(self._by_alias),
+                "indexed_cells": len(self._by_cell),
+                "wide_boxes": len(self._wide),
+            }
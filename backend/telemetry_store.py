@@ -0,0 +1,403 @@
+"""
+On-Disk GPS Telemetry Store for Bus Tracking API
+
+Append-only log of GPS fixes, one segment file per UTC day, made of
+fixed-size binary records. The poller appends into an in-memory buffer that
+a background thread flushes in batches; reads memory-map the segments that
+overlap the requested time range and binary-search the (time-ordered)
+records, so historical track queries are served from local disk instead of
+the Fleet API's `queryTrackDetail`.
+
+Segments stay sorted by time: a fix older than the newest one already
+written for its day (a late poll or a shard's delayed frame) goes to that
+day's small `.late.bin` side segment instead. Reads scan the side segment
+linearly, and maintenance merges it back into the day's segment once the
+day is closed.
+
+Segments older than the retention period are deleted; segments older than
+the compaction age are rewritten keeping at most one fix per device per
+compaction interval.
+"""
+import hashlib
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# ts (float64), device key (16 bytes, see `device_key`), lat, lng (float64), speed (float32), online (uint8)
+RECORD = struct.Struct("<d16sddfB3x")
+DEVICE_KEY_SIZE = 16
+RECORD_SIZE = RECORD.size  # 48 bytes
+
+SEGMENT_PREFIX = "gps-"
+SEGMENT_SUFFIX = ".bin"
+COMPACTED_SUFFIX = ".c.bin"
+LATE_SUFFIX = ".late.bin"
+
+
+def device_key(device_id: str) -> bytes:
+    """
+    Fixed-width key a device's records are stored under.
+
+    Ids of up to 16 UTF-8 bytes are stored as-is (NUL padded); longer ids
+    are stored as their 16-byte BLAKE2b digest rather than truncated, so
+    two ids sharing a prefix never share records.
+    """
+    raw = device_id.encode("utf-8")
+    if len(raw) > DEVICE_KEY_SIZE:
+        return hashlib.blake2b(raw, digest_size=DEVICE_KEY_SIZE).digest()
+    return raw.ljust(DEVICE_KEY_SIZE, b"\0")
+
+
+def _day(ts: float) -> str:
+    return datetime.fromtimestamp(ts, tz=timezone.utc).strftime("%Y%m%d")
+
+
+def _day_start(day: str) -> float:
+    return datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc).timestamp()
+
+
+class TelemetryStore:
+    """Batched append-only writer and mmap-based range reader for GPS fixes."""
+
+    def __init__(
+        self,
+        directory: str,
+        flush_interval: float = 2.0,
+        flush_size: int = 512,
+        retention_days: int = 30,
+        compact_after_days: int = 7,
+        compact_interval: float = 30.0,
+    ):
+        """
+        Args:
+            directory: Folder holding the daily segment files
+            flush_interval: Maximum seconds a fix waits in memory before being written
+            flush_size: Buffered fixes that trigger an immediate flush
+            retention_days: Segments older than this many days are deleted (0 keeps everything)
+            compact_after_days: Segments older than this many days are compacted (0 disables)
+            compact_interval: Minimum seconds between kept fixes per device in compacted segments
+        """
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.flush_size = flush_size
+        self.retention_days = retention_days
+        self.compact_after_days = compact_after_days
+        self.compact_interval = compact_interval
+        os.makedirs(directory, exist_ok=True)
+
+        self._buffer: List[Tuple] = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._tails: Dict[str, float] = {}  # day -> newest ts in its sorted segment
+        self._disk = {"segments": 0, "late_segments": 0, "bytes_on_disk": 0}
+
+        self.appended = 0
+        self.written = 0
+        self.late = 0
+        self.torn_repairs = 0
+        self.flushes = 0
+        self.write_errors = 0
+        self.last_maintenance = 0.0
+        self._refresh_disk_usage()
+
+    # ------------------ WRITING ------------------
+
+    def start(self):
+        """Start the background flush thread (idempotent)."""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, daemon=True, name="telemetry-writer")
+            self._thread.start()
+            logger.info(f"Telemetry store writing to {self.directory}")
+
+    def append(self, device_id: str, ts: float, lat: float, lng: float, speed: float, online: bool):
+        """Buffer a fix for the next batched write."""
+        with self._lock:
+            self._buffer.append((ts, device_key(device_id), lat, lng, speed, 1 if online else 0))
+            self.appended += 1
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wakeup.set()
+
+    def _run(self):
+        while True:
+            self._wakeup.wait(self.flush_interval)
+            self._wakeup.clear()
+            self.flush()
+            if time.time() - self.last_maintenance > 3600:
+                self.maintain()
+
+    def flush(self):
+        """Write all buffered fixes to their day segments."""
+        with self._lock:
+            pending, self._buffer = self._buffer, []
+        if not pending:
+            return
+        pending.sort(key=lambda record: record[0])
+
+        with self._write_lock:
+            by_path: Dict[str, bytearray] = {}
+            new_tails: Dict[str, Tuple[str, float]] = {}  # sorted segment path -> (day, newest ts)
+            for record in pending:
+                ts, day = record[0], _day(record[0])
+                path = self._segment_path(day)
+                tail = new_tails[path][1] if path in new_tails else self._tail(day)
+                if ts < tail:
+                    # Older than what the sorted segment already holds
+                    path = self._segment_path(day, LATE_SUFFIX)
+                    self.late += 1
+                else:
+                    new_tails[path] = (day, ts)
+                by_path.setdefault(path, bytearray()).extend(RECORD.pack(*record))
+
+            for path, data in by_path.items():
+                try:
+                    self._append(path, bytes(data))
+                    self.written += len(data) // RECORD_SIZE
+                except OSError as e:
+                    self.write_errors += 1
+                    logger.error(f"Failed to write telemetry segment {path}: {e}")
+                    continue
+                if path in new_tails:
+                    day, ts = new_tails[path]
+                    self._tails[day] = ts  # only once the records are really on disk
+            self.flushes += 1
+        self._refresh_disk_usage()
+
+    def _append(self, path: str, data: bytes):
+        """
+        Append whole records to a segment.
+
+        A torn tail left by a crash mid-write is cut off first, so new records
+        stay aligned; a failed or short write is truncated back off again.
+
+        Raises:
+            OSError: If the write fails (the segment is left as it was)
+        """
+        with open(path, "ab", buffering=0) as f:
+            size = os.fstat(f.fileno()).st_size
+            torn = size % RECORD_SIZE
+            if torn:
+                size -= torn
+                f.truncate(size)
+                self.torn_repairs += 1
+                logger.warning(f"Telemetry segment {path} had a torn {torn}-byte record, truncated")
+            try:
+                written = f.write(data)
+                if written != len(data):
+                    raise OSError(f"short write ({written} of {len(data)} bytes)")
+            except OSError:
+                try:
+                    f.truncate(size)
+                except OSError:
+                    pass  # cut off on the next append
+                raise
+
+    def _tail(self, day: str) -> float:
+        """Newest timestamp in a day's sorted segment (read from disk on first use)."""
+        tail = self._tails.get(day)
+        if tail is None:
+            tail = float("-inf")
+            path = self._segment_path(day)
+            try:
+                size = os.path.getsize(path) // RECORD_SIZE * RECORD_SIZE
+                if size:
+                    with open(path, "rb") as f:
+                        f.seek(size - RECORD_SIZE)
+                        tail = struct.unpack("<d", f.read(8))[0]
+            except OSError:
+                pass
+            self._tails[day] = tail
+        return tail
+
+    def _segment_path(self, day: str, suffix: str = SEGMENT_SUFFIX) -> str:
+        return os.path.join(self.directory, f"{SEGMENT_PREFIX}{day}{suffix}")
+
+    # ------------------ READING ------------------
+
+    def _segments(self, late: bool = False) -> Dict[str, str]:
+        """Map of day -> sorted segment path (compacted included), or -> late side segment."""
+        segments = {}
+        for name in os.listdir(self.directory):
+            if name.startswith(SEGMENT_PREFIX) and name.endswith(SEGMENT_SUFFIX) and name.endswith(LATE_SUFFIX) == late:
+                day = name[len(SEGMENT_PREFIX):len(SEGMENT_PREFIX) + 8]
+                segments[day] = os.path.join(self.directory, name)
+        return segments
+
+    @staticmethod
+    def _first_at_or_after(buf, count: int, ts: float) -> int:
+        lo, hi = 0, count
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if struct.unpack_from("<d", buf, mid * RECORD_SIZE)[0] < ts:
+                lo = mid + 1
+            else:
+                hi = mid
+        return lo
+
+    def query(self, device_id: str, since: float, until: Optional[float] = None) -> Dict[str, list]:
+        """
+        Return a device's stored fixes in `[since, until]` as column lists.
+
+        Only segments overlapping the range are opened; each is memory-mapped
+        and binary-searched on the record timestamps, then scanned through a
+        zero-copy memoryview. Late side segments are scanned in full and
+        merged in by timestamp.
+        """
+        until = until if until is not None else time.time()
+        key = device_key(device_id)
+        rows: List[Tuple] = []
+        late_rows: List[Tuple] = []
+
+        sorted_segments = self._segments()
+        late_segments = self._segments(late=True)
+        for day in sorted(set(sorted_segments) | set(late_segments)):
+            day_start = _day_start(day)
+            if day_start > until or day_start + 86400 <= since:
+                continue
+            if day in sorted_segments:
+                self._scan(sorted_segments[day], key, since, until, rows, ordered=True)
+            if day in late_segments:
+                self._scan(late_segments[day], key, since, until, late_rows, ordered=False)
+
+        if late_rows:
+            rows.extend(late_rows)
+            rows.sort(key=lambda row: row[0])
+        columns = {"ts": [], "lat": [], "lng": [], "speed": [], "online": []}
+        for ts, lat, lng, speed, online in rows:
+            columns["ts"].append(ts)
+            columns["lat"].append(lat)
+            columns["lng"].append(lng)
+            columns["speed"].append(speed)
+            columns["online"].append(online)
+        return columns
+
+    def _scan(self, path: str, key: bytes, since: float, until: float, rows: List[Tuple], ordered: bool):
+        """Append a segment's `(ts, lat, lng, speed, online)` rows for `key` within the range."""
+        try:
+            size = os.path.getsize(path) // RECORD_SIZE * RECORD_SIZE
+            if size == 0:
+                return
+            with open(path, "rb") as f, mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ) as mm:
+                lo = self._first_at_or_after(mm, size // RECORD_SIZE, since) if ordered else 0
+                view = memoryview(mm)[lo * RECORD_SIZE:]
+                try:
+                    for ts, dev, lat, lng, speed, online in RECORD.iter_unpack(view):
+                        if ts > until:
+                            if ordered:
+                                break
+                            continue
+                        if dev == key and ts >= since:
+                            rows.append((ts, lat, lng, speed, online))
+                finally:
+                    view.release()
+        except (OSError, ValueError) as e:
+            logger.error(f"Failed to read telemetry segment {path}: {e}")
+
+    # ------------------ RETENTION / COMPACTION ------------------
+
+    def maintain(self):
+        """Apply the retention and compaction policy to closed segments."""
+        self.last_maintenance = time.time()
+        today = _day(time.time())
+        now = datetime.now(timezone.utc)
+        for day, late_path in self._segments(late=True).items():
+            if day != today:
+                try:
+                    self._merge_late(day, late_path)
+                except OSError as e:
+                    logger.error(f"Telemetry maintenance failed to merge late fixes of {day}: {e}")
+        for day, path in self._segments().items():
+            if day == today:
+                continue
+            age_days = (now - datetime.strptime(day, "%Y%m%d").replace(tzinfo=timezone.utc)).days
+            try:
+                if self.retention_days and age_days > self.retention_days:
+                    os.remove(path)
+                    logger.info(f"Telemetry retention: removed segment {day}")
+                elif (
+                    self.compact_after_days
+                    and age_days > self.compact_after_days
+                    and not path.endswith(COMPACTED_SUFFIX)
+                ):
+                    self._compact(day, path)
+            except OSError as e:
+                logger.error(f"Telemetry maintenance failed for segment {day}: {e}")
+
+        self._refresh_disk_usage()
+
+    def _merge_late(self, day: str, late_path: str):
+        """Fold a closed day's late side segment into its sorted segment."""
+        with self._write_lock:
+            path = self._segments().get(day, self._segment_path(day))
+            records = []
+            for source in (path, late_path):
+                if os.path.exists(source):
+                    with open(source, "rb") as f:
+                        data = f.read()
+                    usable = len(data) // RECORD_SIZE * RECORD_SIZE
+                    records.extend(data[offset:offset + RECORD_SIZE] for offset in range(0, usable, RECORD_SIZE))
+            records.sort(key=lambda record: struct.unpack_from("<d", record)[0])
+            tmp = path + ".tmp"
+            with open(tmp, "wb") as f:
+                f.write(b"".join(records))
+            os.replace(tmp, path)
+            os.remove(late_path)
+            self._tails.pop(day, None)
+        logger.info(f"Telemetry: merged late fixes into segment {day} ({len(records)} records)")
+
+    def _compact(self, day: str, path: str):
+        last_kept: Dict[bytes, float] = {}
+        kept = bytearray()
+        with open(path, "rb") as f:
+            data = f.read()
+        usable = len(data) // RECORD_SIZE * RECORD_SIZE
+        for offset in range(0, usable, RECORD_SIZE):
+            ts, dev = struct.unpack_from("<d16s", data, offset)
+            if ts - last_kept.get(dev, float("-inf")) >= self.compact_interval:
+                last_kept[dev] = ts
+                kept.extend(data[offset:offset + RECORD_SIZE])
+
+        target = os.path.join(self.directory, f"{SEGMENT_PREFIX}{day}{COMPACTED_SUFFIX}")
+        tmp = target + ".tmp"
+        with open(tmp, "wb") as f:
+            f.write(kept)
+        os.replace(tmp, target)
+        os.remove(path)
+        logger.info(f"Telemetry compaction: segment {day} {usable // RECORD_SIZE} -> {len(kept) // RECORD_SIZE} records")
+
+    def _refresh_disk_usage(self):
+        """Re-measure segment counts and size (writer thread; stats() only reads the result)."""
+        size = 0
+        late = self._segments(late=True)
+        segments = self._segments()
+        for path in list(segments.values()) + list(late.values()):
+            try:
+                size += os.path.getsize(path)
+            except OSError:
+                pass
+        self._disk = {"segments": len(segments), "late_segments": len(late), "bytes_on_disk": size}
+
+    def stats(self) -> Dict:
+        """Return write counters and the on-disk size measured at the last flush (no disk I/O)."""
+        with self._lock:
+            buffered = len(self._buffer)
+        return {
+            "directory": self.directory,
+            **self._disk,
+            "buffered": buffered,
+            "appended": self.appended,
+            "written": self.written,
+            "late": self.late,
+            "torn_repairs": self.torn_repairs,
+            "flushes": self.flushes,
+            "write_errors": self.write_errors,
+        }
@@ -0,0 +1,122 @@
+"""
+Track Simplification for Bus Tracking API
+
+Reduces history payloads before they reach the admin map: Douglas-Peucker
+line simplification with a tolerance in meters, then time-bucket
+downsampling to a target point count. Both stages work on the column
+lists produced by the history stores and return kept-row indices, so every
+column is sliced the same way.
+"""
+import math
+from array import array
+from typing import Dict, List, Optional
+
+# Meters per degree of latitude; longitude is scaled by cos(latitude)
+METERS_PER_DEGREE = 111320.0
+
+
+def _project(lat: List[float], lng: List[float]):
+    """Project coordinates onto a local equirectangular plane in meters."""
+    lat0 = lat[0]
+    scale_x = METERS_PER_DEGREE * math.cos(math.radians(lat0))
+    lng0 = lng[0]
+    xs = array("d", ((x - lng0) * scale_x for x in lng))
+    ys = array("d", ((y - lat0) * METERS_PER_DEGREE for y in lat))
+    return xs, ys
+
+
+def douglas_peucker(lat: List[float], lng: List[float], tolerance: float) -> List[int]:
+    """
+    Indices of the points kept by Douglas-Peucker simplification.
+
+    Iterative (explicit stack) so day-long tracks cannot hit the recursion limit.
+
+    Args:
+        lat: Latitudes
+        lng: Longitudes
+        tolerance: Maximum perpendicular deviation in meters
+
+    Returns:
+        Sorted indices of kept points (always includes the endpoints)
+    """
+    n = len(lat)
+    if n <= 2 or tolerance <= 0:
+        return list(range(n))
+
+    xs, ys = _project(lat, lng)
+    keep = bytearray(n)
+    keep[0] = keep[n - 1] = 1
+    stack = [(0, n - 1)]
+    while stack:
+        first, last = stack.pop()
+        if last - first < 2:
+            continue
+        ax, ay = xs[first], ys[first]
+        dx, dy = xs[last] - ax, ys[last] - ay
+        length = math.hypot(dx, dy)
+
+        max_dist, index = -1.0, first
+        for i in range(first + 1, last):
+            px, py = xs[i] - ax, ys[i] - ay
+            if length == 0.0:
+                dist = math.hypot(px, py)
+            else:
+                dist = abs(dx * py - dy * px) / length
+            if dist > max_dist:
+                max_dist, index = dist, i
+
+        if max_dist > tolerance:
+            keep[index] = 1
+            stack.append((first, index))
+            stack.append((index, last))
+    return [i for i in range(n) if keep[i]]
+
+
+def time_bucket(ts: List[float], indices: List[int], max_points: int) -> List[int]:
+    """
+    Downsample `indices` to at most `max_points` by equal time buckets.
+
+    The last point in each bucket is kept, plus the very first point, so the
+    start and end of the track are preserved.
+    """
+    if max_points <= 0 or len(indices) <= max_points:
+        return indices
+    if max_points == 1:
+        return [indices[-1]]
+
+    start, end = ts[indices[0]], ts[indices[-1]]
+    span = (end - start) or 1.0
+    buckets = max_points - 1
+    chosen: Dict[int, int] = {}
+    for i in indices[1:]:
+        bucket = min(buckets - 1, int((ts[i] - start) / span * buckets))
+        chosen[bucket] = i
+    return [indices[0]] + [chosen[b] for b in sorted(chosen)]
+
+
+def simplify(
+    columns: Dict[str, list],
+    tolerance: Optional[float] = None,
+    max_points: Optional[int] = None,
+) -> Dict[str, list]:
+    """
+    Run the simplification pipeline over history columns.
+
+    Args:
+        columns: Column lists with at least `ts`, `lat` and `lng`
+        tolerance: Douglas-Peucker tolerance in meters (skipped if None)
+        max_points: Target point count for time-bucket downsampling (skipped if None)
+
+    Returns:
+        New column dict with only the kept rows
+    """
+    n = len(columns["ts"])
+    if tolerance:
+        indices = douglas_peucker(columns["lat"], columns["lng"], tolerance)
+    else:
+        indices = list(range(n))
+    if max_points:
+        indices = time_bucket(columns["ts"], indices, max_points)
+    if len(indices) == n:
+        return columns
+    return {name: [values[i] for i in indices] for name, values in columns.items()}
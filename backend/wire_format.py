@@ -0,0 +1,206 @@
+"""
+Compact Binary Wire Format for Bus Tracking API
+
+An opt-in alternative to the JSON fleet array. Static fields (device id,
+plate, VID and the raw `device_info` record) move into a JSON *catalog*
+that a client fetches once and again only when its id changes. Each
+position frame is a 20-byte header plus one fixed-size record per device:
+
+    header  "<2sBBIId"  magic b"BT", format version, flags, catalog id,
+                        record count, base timestamp (newest last_update)
+    record  "<IiiHIB"   catalog index, lat and lng in 1e-7 degrees,
+                        speed in 0.01 km/h, age in 0.1 s before the base
+                        timestamp (0xFFFFFFFF = never updated), flags
+
+Record flags: bit 0 online, bit 1 has a fix. A record is 19 bytes against
+several hundred for the JSON entry. ETAs are not part of the binary frame;
+binary clients read them from `/api/eta`.
+"""
+import json
+import logging
+import struct
+import threading
+from typing import Any, Dict, Hashable, Iterable, List, Optional, Tuple
+
+from snapshot import is_newer
+
+logger = logging.getLogger(__name__)
+
+MEDIA_TYPE = "application/vnd.bustrack.fleet+binary"
+CATALOG_HEADER = "X-Fleet-Catalog"
+
+MAGIC = b"BT"
+FORMAT_VERSION = 1
+HEADER = struct.Struct("<2sBBIId")
+RECORD = struct.Struct("<IiiHIB")
+
+COORD_SCALE = 10_000_000  # 1e-7 degree (~1 cm)
+SPEED_SCALE = 100  # 0.01 km/h
+AGE_SCALE = 10  # 0.1 s
+AGE_UNKNOWN = 0xFFFFFFFF
+
+FLAG_ONLINE = 0x01
+FLAG_HAS_FIX = 0x02
+
+
+def accepts_binary(accept: Optional[str]) -> bool:
+    """True if an HTTP `Accept` header asks for the binary fleet format."""
+    return bool(accept) and MEDIA_TYPE in accept
+
+
+def catalog_entry(entry: Dict) -> Dict:
+    """The static part of one fleet payload entry."""
+    gps = entry.get("gps") or {}
+    return {
+        "device_id": entry["device_id"],
+        "device_name": entry.get("device_name"),
+        "plate_number": entry.get("plate_number"),
+        "vid": gps.get("vid"),
+        "device_info": entry.get("device_info"),
+    }
+
+
+def pack_record(index: int, gps: Dict, base_ts: float) -> bytes:
+    """Encode one device's live fields as a fixed-size record."""
+    last_update = gps.get("last_update") or 0
+    flags = FLAG_ONLINE if gps.get("online") else 0
+    if last_update:
+        flags |= FLAG_HAS_FIX
+        age = min(AGE_UNKNOWN - 1, max(0, round((base_ts - last_update) * AGE_SCALE)))
+    else:
+        age = AGE_UNKNOWN
+    speed = min(0xFFFF, max(0, round((gps.get("speed_kmh") or 0) * SPEED_SCALE)))
+    return RECORD.pack(
+        index,
+        round((gps.get("latitude") or 0) * COORD_SCALE),
+        round((gps.get("longitude") or 0) * COORD_SCALE),
+        speed,
+        age,
+        flags,
+    )
+
+
+def decode_frame(data: bytes) -> Tuple[int, float, List[Dict]]:
+    """
+    Decode a binary position frame (reference decoder, used by the benchmark).
+
+    Returns:
+        (catalog id, base timestamp, records) where each record has `index`,
+        `latitude`, `longitude`, `speed_kmh`, `last_update` and `online`
+
+    Raises:
+        ValueError: If the frame is truncated or not a fleet frame
+    """
+    if len(data) < HEADER.size:
+        raise ValueError("frame shorter than header")
+    magic, version, _, catalog_id, count, base_ts = HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        raise ValueError("not a fleet frame")
+    if len(data) != HEADER.size + count * RECORD.size:
+        raise ValueError("frame length does not match record count")
+    records = []
+    for index, lat, lng, speed, age, flags in RECORD.iter_unpack(memoryview(data)[HEADER.size:]):
+        records.append({
+            "index": index,
+            "latitude": lat / COORD_SCALE,
+            "longitude": lng / COORD_SCALE,
+            "speed_kmh": speed / SPEED_SCALE,
+            "last_update": base_ts - age / AGE_SCALE if flags & FLAG_HAS_FIX else 0,
+            "online": bool(flags & FLAG_ONLINE),
+        })
+    return catalog_id, base_ts, records
+
+
+class WireFrame:
+    """Catalog and position encodings of one fleet snapshot."""
+
+    __slots__ = ("version", "catalog_id", "catalog_text", "base_ts", "records", "rows", "body")
+
+    def __init__(
+        self,
+        version: Hashable,
+        catalog_id: int,
+        catalog_text: str,
+        base_ts: float,
+        records: List[bytes],
+        rows: Dict[str, int],
+    ):
+        self.version = version
+        self.catalog_id = catalog_id
+        self.catalog_text = catalog_text
+        self.base_ts = base_ts
+        self.records = records
+        self.rows = rows  # device id -> catalog index
+        self.body = self._pack(records)
+
+    def _pack(self, records: List[bytes]) -> bytes:
+        return HEADER.pack(MAGIC, FORMAT_VERSION, 0, self.catalog_id, len(records), self.base_ts) + b"".join(records)
+
+    def select(self, device_ids: Iterable[str]) -> bytes:
+        """A position frame holding only `device_ids` (for subscribed clients)."""
+        rows = self.rows
+        return self._pack([self.records[rows[dev]] for dev in device_ids if dev in rows])
+
+
+class WireEncoder:
+    """
+    Turns fleet snapshots into binary frames plus a versioned catalog.
+
+    The catalog id only moves when a static field changes (a device is added,
+    a bus reports a new VID or plate, device info is reloaded), so clients
+    normally download it once per connection.
+    """
+
+    def __init__(self):
+        self.catalog_id = 0
+        self._catalog: Optional[List[Dict]] = None
+        self._catalog_text = ""
+        self._frame: Optional[WireFrame] = None
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.catalogs = 0
+
+    def advance(self, snapshot: Any) -> WireFrame:
+        """
+        Encode `snapshot` (once per snapshot version) and return its frame.
+
+        A snapshot older than the last one encoded returns the current frame.
+
+        Args:
+            snapshot: Fleet snapshot whose data is the list of payload entries
+        """
+        frame = self._frame
+        if frame is not None and not is_newer(snapshot.version, frame.version):
+            return frame
+        with self._lock:
+            frame = self._frame
+            if frame is not None and not is_newer(snapshot.version, frame.version):
+                return frame  # a stale snapshot never replaces a newer frame
+
+            catalog = [catalog_entry(entry) for entry in snapshot.data]
+            if catalog != self._catalog:
+                self.catalog_id = (self.catalog_id + 1) & 0xFFFFFFFF
+                self._catalog = catalog
+                self._catalog_text = json.dumps({"type": "catalog", "catalog": self.catalog_id, "devices": catalog})
+                self.catalogs += 1
+                logger.debug(f"Wire catalog {self.catalog_id}: {len(catalog)} devices, {len(self._catalog_text)} bytes")
+
+            gps_entries = [entry.get("gps") or {} for entry in snapshot.data]
+            base_ts = max((gps.get("last_update") or 0 for gps in gps_entries), default=0)
+            records = [pack_record(index, gps, base_ts) for index, gps in enumerate(gps_entries)]
+            rows = {entry["device_id"]: index for index, entry in enumerate(snapshot.data)}
+            frame = WireFrame(snapshot.version, self.catalog_id, self._catalog_text, base_ts, records, rows)
+            self._frame = frame
+            self.frames += 1
+            return frame
+
+    def stats(self) -> Dict:
+        """Return encode counters and the current frame and catalog sizes."""
+        frame = self._frame
+        return {
+            "frames": self.frames,
+            "catalogs": self.catalogs,
+            "catalog_id": self.catalog_id,
+            "frame_bytes": len(frame.body) if frame else 0,
+            "catalog_bytes": len(frame.catalog_text) if frame else 0,
+        }